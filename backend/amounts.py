@@ -0,0 +1,52 @@
+import polars as pl
+
+# an optional sign, the whole units and up to two decimals after a comma (or a dot)
+AMOUNT_PATTERN = r"^([+-]?)(\d+)(?:[,.](\d{1,2}))?$"
+
+
+def amount_cents(amount: pl.Expr) -> pl.Expr:
+    """
+    Converts amount strings such as -39,2 to integer cents (-3920) with string operations only,
+    so the amounts are exact and never go through a float. Strings that are not amounts give null.
+
+    Args:
+        amount (pl.Expr): the amount strings
+
+    Returns:
+        pl.Expr: the amounts in cents (Int64)
+    """
+    parts = amount.str.strip_chars().str.extract_groups(AMOUNT_PATTERN)
+    units = parts.struct.field("2").cast(pl.Int64)
+    decimals = parts.struct.field("3").str.pad_end(2, "0").cast(pl.Int64).fill_null(0)
+    cents = units * 100 + decimals
+    return pl.when(parts.struct.field("1") == "-").then(-cents).otherwise(cents)
+
+
+def cents_to_units(cents: pl.Expr) -> pl.Expr:
+    """
+    Converts integer cents to whole units for display, e.g. 2924 to 29.24.
+    Goes through a decimal, polars divides floats by multiplying with the reciprocal,
+    which gives 29.240000000000002.
+
+    Args:
+        cents (pl.Expr): the amounts in cents
+
+    Returns:
+        pl.Expr: the amounts in whole units (Float64)
+    """
+    return (cents.cast(pl.Decimal(38, 2)) / 100).cast(pl.Float64)
+
+
+def units_to_cents(units: pl.Expr) -> pl.Expr:
+    """
+    Converts whole units with at most two decimals back to integer cents, e.g. the amounts of
+    transaction_frame. Rounding gives the exact cents since the float is at most off by a tiny
+    fraction of a cent.
+
+    Args:
+        units (pl.Expr): the amounts in whole units
+
+    Returns:
+        pl.Expr: the amounts in cents (Int64)
+    """
+    return (units * 100).round(0).cast(pl.Int64)
@@ -0,0 +1,291 @@
+from typing import Dict, List, Optional
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import asynccontextmanager
+import asyncio
+import enum
+import multiprocessing
+import os
+import time
+import uuid
+import polars as pl
+from fastapi import FastAPI, HTTPException, Query, Request
+from fastapi.middleware.cors import CORSMiddleware
+
+from column_mapping import umsatz_column_mapping
+from data_model import TransactionType
+from data_io import detail_profile_stmt
+from db import engine
+from detail_types import detail_type_labels
+from handle_csv import handleCSV, umsatz_csv_params
+from import_csv import prepare_file
+from monthly_summary import SummaryPeriod, read_monthly_summary
+
+UPLOAD_DIR = os.environ.get("SUMMARIZER_UPLOAD_DIR", "uploads")
+MAX_UPLOAD_BYTES = int(os.environ.get("SUMMARIZER_MAX_UPLOAD_BYTES", 100 * 1024 * 1024))
+PARSE_WORKERS = int(os.environ.get("SUMMARIZER_PARSE_WORKERS", 2))
+CORS_ORIGINS = os.environ.get("SUMMARIZER_CORS_ORIGINS", "http://localhost:3000").split(",")
+
+
+class JobStatus(str, enum.Enum):
+    queued = "queued"
+    parsing = "parsing"
+    waiting = "waiting"
+    importing = "importing"
+    done = "done"
+    failed = "failed"
+
+
+class importJob:
+    """
+    Class that holds the state of one uploaded statement on its way into the database.
+    """
+
+    def __init__(self, file_name: str, use_watermarks: bool):
+        self.id = uuid.uuid4().hex
+        self.file_name = file_name
+        self.file_path = os.path.join(UPLOAD_DIR, f"{self.id}.csv")
+        self.use_watermarks = use_watermarks
+        self.status = JobStatus.queued
+        self.size = 0
+        self.rows: Optional[int] = None
+        self.inserted: Optional[int] = None
+        self.error: Optional[str] = None
+        self.stats: Optional[dict] = None
+        self.created = time.time()
+        self.finished: Optional[float] = None
+
+    def as_dict(self) -> dict:
+        return {
+            "id": self.id,
+            "file_name": self.file_name,
+            "status": self.status.value,
+            "size": self.size,
+            "rows": self.rows,
+            "inserted": self.inserted,
+            "error": self.error,
+            "stats": self.stats,
+            "created": self.created,
+            "finished": self.finished,
+        }
+
+
+# the jobs of this server process, newest last
+jobs: Dict[str, importJob] = {}
+
+
+def write_job(job: importJob, df: pl.DataFrame, parse_seconds: float):
+    """
+    Deduplicates and inserts a parsed statement. Runs in a thread of the writer task,
+    one job at a time, the same as the single writer of import_csv.
+
+    Args:
+        job (importJob): the job
+        df (pl.DataFrame): the parsed csv data
+        parse_seconds (float): the time the parsing took in the worker process
+    """
+    handler = handleCSV(
+        file_path=job.file_path,
+        csv_params=umsatz_csv_params(),
+        column_mapping=umsatz_column_mapping(),
+        db_engine=engine,
+        df=df,
+    )
+    handler.stats.add_time("parse", parse_seconds)
+    handler.stats.count("bytes_read", job.size)
+    job.inserted = handler.bulk_insert_data(use_watermarks=job.use_watermarks)
+    job.stats = handler.stats.as_dict()
+
+
+async def writer(queue: asyncio.Queue):
+    """
+    Takes parsed statements from the queue and writes them one after the other,
+    so the event loop stays free while the database is busy.
+    """
+    loop = asyncio.get_running_loop()
+    while True:
+        job, df, parse_seconds = await queue.get()
+        job.status = JobStatus.importing
+        try:
+            await loop.run_in_executor(None, write_job, job, df, parse_seconds)
+            job.status = JobStatus.done
+        except Exception as e:
+            job.status = JobStatus.failed
+            job.error = str(e)
+        finally:
+            job.finished = time.time()
+            remove_upload(job)
+            queue.task_done()
+
+
+async def run_job(app: FastAPI, job: importJob):
+    """
+    Parses an uploaded statement in a worker process and hands it to the writer.
+    Uploads are parsed in parallel, up to PARSE_WORKERS at a time.
+    """
+    loop = asyncio.get_running_loop()
+    job.status = JobStatus.parsing
+    try:
+        _, df, parse_seconds = await loop.run_in_executor(
+            app.state.parse_pool,
+            prepare_file,
+            job.file_path,
+            umsatz_csv_params(),
+            umsatz_column_mapping(),
+        )
+    except Exception as e:
+        job.status = JobStatus.failed
+        job.error = str(e)
+        job.finished = time.time()
+        remove_upload(job)
+        return
+    job.rows = df.height
+    job.status = JobStatus.waiting
+    await app.state.write_queue.put((job, df, parse_seconds))
+
+
+def remove_upload(job: importJob):
+    try:
+        os.remove(job.file_path)
+    except FileNotFoundError:
+        pass
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # readers are not blocked by the writer in WAL mode, the setting is stored in the database file
+    with engine.connect() as conn:
+        conn.exec_driver_sql("PRAGMA journal_mode=WAL")
+    os.makedirs(UPLOAD_DIR, exist_ok=True)
+    # the workers are started on the first upload, after the writer already ran polars in
+    # this process, a forked child of such a process can hang in the polars thread pool
+    app.state.parse_pool = ProcessPoolExecutor(
+        max_workers=PARSE_WORKERS, mp_context=multiprocessing.get_context("spawn")
+    )
+    app.state.write_queue = asyncio.Queue()
+    app.state.tasks = set()
+    writer_task = asyncio.create_task(writer(app.state.write_queue))
+    yield
+    writer_task.cancel()
+    app.state.parse_pool.shutdown(cancel_futures=True)
+
+
+app = FastAPI(title="summarizer", lifespan=lifespan)
+app.add_middleware(CORSMiddleware, allow_origins=CORS_ORIGINS, allow_methods=["*"], allow_headers=["*"])
+
+
+@app.post("/imports", status_code=202)
+async def upload_statement(
+    request: Request, file_name: str, use_watermarks: bool = True
+) -> dict:
+    """
+    Uploads a csv statement as the raw request body and queues its import.
+    The body is written to disk chunk by chunk as it arrives.
+    """
+    job = importJob(file_name=os.path.basename(file_name), use_watermarks=use_watermarks)
+    try:
+        with open(job.file_path, "wb") as f:
+            async for chunk in request.stream():
+                job.size += len(chunk)
+                if job.size > MAX_UPLOAD_BYTES:
+                    raise HTTPException(status_code=413, detail="the statement is too large")
+                f.write(chunk)
+        if job.size == 0:
+            raise HTTPException(status_code=400, detail="the statement is empty")
+    except BaseException:
+        remove_upload(job)
+        raise
+
+    jobs[job.id] = job
+    # keep a reference, the event loop only holds weak references to tasks
+    task = asyncio.create_task(run_job(request.app, job))
+    request.app.state.tasks.add(task)
+    task.add_done_callback(request.app.state.tasks.discard)
+    return job.as_dict()
+
+
+@app.get("/imports")
+async def list_imports(limit: int = Query(50, ge=1, le=1000)) -> List[dict]:
+    """
+    The most recent import jobs, newest first.
+    """
+    return [job.as_dict() for job in list(jobs.values())[::-1][:limit]]
+
+
+@app.get("/imports/{job_id}")
+async def import_status(job_id: str) -> dict:
+    """
+    The status of one import job, for polling.
+    """
+    if job_id not in jobs:
+        raise HTTPException(status_code=404, detail="unknown import job")
+    return jobs[job_id].as_dict()
+
+
+def page(items: List[dict], offset: int, limit: int) -> dict:
+    """
+    A page of items that were queried with limit + 1, the extra item only tells that there are more.
+    """
+    return {
+        "items": items[:limit],
+        "offset": offset,
+        "limit": limit,
+        "next_offset": offset + limit if len(items) > limit else None,
+    }
+
+
+# the database endpoints are plain functions, fastapi runs them in its thread pool
+
+
+@app.get("/summary")
+def summary(
+    period: SummaryPeriod = SummaryPeriod.month,
+    tr_type: Optional[TransactionType] = None,
+    by_account: bool = False,
+    by_category: bool = False,
+    offset: int = Query(0, ge=0),
+    limit: int = Query(100, ge=1, le=1000),
+) -> dict:
+    """
+    The totals per month or year from the monthly_summary table.
+    """
+    df = read_monthly_summary(
+        engine,
+        period=period,
+        tr_type=tr_type,
+        by_account=by_account,
+        by_category=by_category,
+        offset=offset,
+        limit=limit + 1,
+    )
+    return page(df.to_dicts(), offset=offset, limit=limit)
+
+
+@app.get("/details")
+def details(
+    top_k: int = Query(5, ge=0, le=100),
+    offset: int = Query(0, ge=0),
+    limit: int = Query(100, ge=1, le=1000),
+) -> dict:
+    """
+    The profile of the transaction details, see summarize_transaction_detail in data_io.
+    """
+    labels = detail_type_labels(engine)
+    stmt = detail_profile_stmt(top_k=top_k).offset(offset).limit(limit + 1)
+    with engine.connect() as conn:
+        items = [
+            {
+                "label": labels[type_id],
+                "tot": tot,
+                "distinct": n_distinct,
+                "description": description,
+                "cnt": cnt,
+            }
+            for type_id, tot, n_distinct, description, cnt in conn.execute(stmt)
+        ]
+    return page(items, offset=offset, limit=limit)
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    uvicorn.run(app, host="127.0.0.1", port=8000)
@@ -0,0 +1,366 @@
+from typing import Callable, List
+from datetime import date, timedelta
+import json
+import os
+import platform
+import random
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+import zlib
+import typer
+import polars as pl
+import sqlalchemy
+from sqlalchemy import create_engine
+
+import csv_cache
+from data_model import Base
+from column_mapping import umsatz_column_mapping
+from handle_csv import handleCSV, read_csv_file, umsatz_csv_params
+
+app = typer.Typer()
+
+UMSATZ_COLUMNS = [
+    "Auftragskonto",
+    "Buchungstag",
+    "Valutadatum",
+    "Buchungstext",
+    "Verwendungszweck",
+    "Glaeubiger ID",
+    "Mandatsreferenz",
+    "Kundenreferenz (End-to-End)",
+    "Sammlerreferenz",
+    "Lastschrift Ursprungsbetrag",
+    "Auslagenersatz Ruecklastschrift",
+    "Beguenstigter/Zahlungspflichtiger",
+    "Kontonummer/IBAN",
+    "BIC (SWIFT-Code)",
+    "Betrag",
+    "Waehrung",
+    "Info",
+]
+
+# counterparty, buchungstext, typical amount in euro (negative for debits), is a direct debit
+COUNTERPARTIES = [
+    ("REWE Markt GmbH", "KARTENZAHLUNG", -45.0, False),
+    ("EDEKA Müller", "KARTENZAHLUNG", -30.0, False),
+    ("dm-drogerie markt", "KARTENZAHLUNG", -20.0, False),
+    ("Stadtwerke München GmbH", "FOLGELASTSCHRIFT", -85.0, True),
+    ("Telekom Deutschland GmbH", "FOLGELASTSCHRIFT", -40.0, True),
+    ("Allianz Versicherungs-AG", "FOLGELASTSCHRIFT", -120.0, True),
+    ("Netflix International B.V.", "FOLGELASTSCHRIFT", -13.0, True),
+    ("Hausverwaltung Schäfer", "DAUERAUFTRAG", -950.0, False),
+    ("Amazon EU S.a.r.l.", "ONLINE-UEBERWEISUNG", -35.0, False),
+    ("Deutsche Bahn Fernverkehr AG", "ONLINE-UEBERWEISUNG", -60.0, False),
+    ("Arbeitgeber GmbH & Co. KG", "LOHN / GEHALT", 3200.0, False),
+    ("Finanzamt Köln-Süd", "GUTSCHR. UEBERWEISUNG", 250.0, False),
+]
+
+
+def counterparty_iban(rng: random.Random) -> str:
+    return "DE" + "".join(str(rng.randint(0, 9)) for _ in range(20))
+
+
+def generate_rows(
+    rows: int, seed: int = 1, accounts: int = 2, years: int = 3, start: date = date(2020, 1, 1)
+) -> List[List[str]]:
+    """
+    Generates umsatz style csv rows, newest first like the bank exports.
+
+    Args:
+        rows (int): the number of rows
+        seed (int, optional): the random seed. Defaults to 1.
+        accounts (int, optional): the number of own accounts (auftragskonto). Defaults to 2.
+        years (int, optional): the number of years the bookings are spread over. Defaults to 3.
+        start (date, optional): the first booking date. Defaults to 2020-01-01.
+
+    Returns:
+        List[List[str]]: the rows, in the order of UMSATZ_COLUMNS
+    """
+    rng = random.Random(seed)
+    own_accounts = [counterparty_iban(rng) for _ in range(accounts)]
+    ibans = {name: counterparty_iban(rng) for name, _, _, _ in COUNTERPARTIES}
+    bics = {name: f"{name[:4].upper().replace(' ', 'X')}DEFFXXX" for name, _, _, _ in COUNTERPARTIES}
+    days = 365 * years
+    result = []
+    for nr in range(rows):
+        name, buchungstext, typical, direct_debit = rng.choice(COUNTERPARTIES)
+        booking = start + timedelta(days=nr * days // rows)
+        value = booking + timedelta(days=rng.choice([0, 0, 0, 1, 2]))
+        amount = round(typical * rng.uniform(0.5, 1.5), 2)
+        result.append(
+            [
+                rng.choice(own_accounts),
+                booking.strftime("%d.%m.%y"),
+                value.strftime("%d.%m.%y"),
+                buchungstext,
+                f"{name} {rng.randint(100000, 999999)} {booking.strftime('%d.%m')}",
+                f"DE98ZZZ{rng.randint(10**10, 10**11 - 1)}" if direct_debit else "",
+                f"M-{zlib.crc32(name.encode()) % 10**8:08d}" if direct_debit else "",
+                f"E2E-{seed}-{nr}",
+                "",
+                "",
+                "",
+                name,
+                ibans[name],
+                bics[name],
+                f"{amount:.2f}".replace(".", ","),
+                "EUR",
+                "Umsatz gebucht",
+            ]
+        )
+    result.reverse()
+    return result
+
+
+def write_umsatz_csv(file_path: str, rows: List[List[str]]):
+    """
+    Writes rows in the format of the umsatz exports: semicolon separated, all fields quoted, ISO-8859-1.
+
+    Args:
+        file_path (str): the csv file path
+        rows (List[List[str]]): the rows, in the order of UMSATZ_COLUMNS
+    """
+    with open(file_path, "w", encoding="iso8859-1", newline="") as f:
+        for row in [UMSATZ_COLUMNS] + rows:
+            f.write(";".join(f'"{val}"' for val in row) + "\n")
+
+
+def overlapping_rows(
+    rows: List[List[str]], duplicate_ratio: float, seed: int
+) -> List[List[str]]:
+    """
+    A second statement of the same size that repeats duplicate_ratio of the rows of the first one,
+    the rest are new rows.
+
+    Args:
+        rows (List[List[str]]): the rows of the first statement
+        duplicate_ratio (float): the share of repeated rows, between 0 and 1
+        seed (int): the random seed for the new rows
+
+    Returns:
+        List[List[str]]: the rows of the second statement
+    """
+    repeated = int(len(rows) * duplicate_ratio)
+    rng = random.Random(seed)
+    new_rows = generate_rows(len(rows) - repeated, seed=seed + 1)
+    return rng.sample(rows, repeated) + new_rows
+
+
+class benchResults:
+    """
+    Collects the timings of one benchmark run.
+    """
+
+    def __init__(self):
+        self.results = []
+
+    def timed(self, name: str, rows: int, func: Callable):
+        """
+        Runs func and records how long it took.
+
+        Args:
+            name (str): the name of the measurement
+            rows (int): the number of csv rows processed by func
+            func (Callable): the code to time
+
+        Returns:
+            the return value of func
+        """
+        start = time.perf_counter()
+        value = func()
+        seconds = time.perf_counter() - start
+        self.results.append(
+            {
+                "name": name,
+                "rows": rows,
+                "seconds": seconds,
+                "rows_per_s": rows / max(seconds, 1e-9),
+            }
+        )
+        print(f"{name}: {seconds:.3f}s")
+        return value
+
+
+def run_startup(bench: benchResults):
+    """
+    Measures how long the command line takes to start, each in a new interpreter.
+    """
+    backend_dir = os.path.dirname(os.path.abspath(__file__))
+    commands = {
+        "startup/cli --help": [os.path.join(backend_dir, "cli.py"), "--help"],
+        "startup/cli summarize-csv --help": [os.path.join(backend_dir, "cli.py"), "summarize-csv", "--help"],
+        "startup/cli import --help": [os.path.join(backend_dir, "cli.py"), "import", "--help"],
+    }
+    for name, args in commands.items():
+        bench.timed(
+            name,
+            0,
+            lambda: subprocess.run([sys.executable] + args, check=True, capture_output=True),
+        )
+
+
+def fresh_engine(directory: str, name: str):
+    engine = create_engine(f"sqlite+pysqlite:///{os.path.join(directory, name)}")
+    Base.metadata.create_all(engine)
+    return engine
+
+
+def run_size(bench: benchResults, rows: int, duplicate_ratio: float, seed: int, legacy_max_rows: int):
+    """
+    Runs all measurements for one statement size.
+    """
+    from data_io import detail_profile_stmt
+    from monthly_summary import read_monthly_summary
+    from transaction_frame import transaction_frame
+    import summarize_csv
+
+    csv_params = umsatz_csv_params()
+    column_mapping = umsatz_column_mapping()
+    with tempfile.TemporaryDirectory() as directory:
+        # handleCSV caches into csv_cache.CACHE_DIR, pointed at the temporary directory for the run
+        cache_dir = csv_cache.CACHE_DIR
+        csv_cache.CACHE_DIR = os.path.join(directory, "cache")
+        try:
+            first = os.path.join(directory, "first-umsatz.CSV")
+            second = os.path.join(directory, "second-umsatz.CSV")
+            first_rows = generate_rows(rows, seed=seed)
+            write_umsatz_csv(first, first_rows)
+            write_umsatz_csv(second, overlapping_rows(first_rows, duplicate_ratio, seed=seed))
+
+            bench.timed(
+                f"{rows}/parse",
+                rows,
+                lambda: read_csv_file(first, csv_params, column_mapping, use_cache=False),
+            )
+
+            engine = fresh_engine(directory, "fresh.db")
+            handler = bench.timed(
+                f"{rows}/handleCSV cold cache",
+                rows,
+                lambda: handleCSV(first, csv_params, column_mapping, db_engine=engine),
+            )
+            bench.timed(
+                f"{rows}/handleCSV warm cache",
+                rows,
+                lambda: handleCSV(first, csv_params, column_mapping, db_engine=engine),
+            )
+            bench.timed(f"{rows}/bulk_insert_data fresh db", rows, handler.bulk_insert_data)
+
+            overlap = handleCSV(second, csv_params, column_mapping, db_engine=engine)
+            bench.timed(
+                f"{rows}/find_duplicates populated db",
+                rows,
+                lambda: overlap.find_duplicates(overlap.df),
+            )
+            bench.timed(
+                f"{rows}/bulk_insert_data populated db",
+                rows,
+                lambda: overlap.bulk_insert_data(use_watermarks=False),
+            )
+
+            if rows <= legacy_max_rows:
+                legacy_engine = fresh_engine(directory, "legacy.db")
+                legacy = handleCSV(first, csv_params, column_mapping, db_engine=legacy_engine)
+                bench.timed(f"{rows}/insert_data fresh db", rows, legacy.insert_data)
+
+            bench.timed(
+                f"{rows}/summarize_csv",
+                rows,
+                lambda: summarize_csv.monthly_costs(summarize_csv.read_csv_file(first)),
+            )
+            bench.timed(
+                f"{rows}/summarize db",
+                rows,
+                lambda: read_monthly_summary(engine),
+            )
+
+            def profile_details():
+                with engine.connect() as conn:
+                    return conn.execute(detail_profile_stmt(top_k=5)).all()
+
+            bench.timed(f"{rows}/summarize_transaction_detail", rows, profile_details)
+            bench.timed(f"{rows}/transaction_frame", rows, lambda: transaction_frame(engine))
+            engine.dispose()
+        finally:
+            csv_cache.CACHE_DIR = cache_dir
+
+
+@app.command()
+def run(
+    rows: List[int] = typer.Option([10000], help="statement sizes, can be given several times"),
+    duplicate_ratio: float = typer.Option(0.5, help="share of the second statement already imported"),
+    seed: int = 1,
+    legacy_max_rows: int = typer.Option(10000, help="largest size the row by row insert_data is timed for"),
+    output: str = "benchmark.json",
+):
+    """
+    Times parsing, imports, duplicate detection and the summaries on synthetic statements,
+    against a fresh and a pre-populated database, and writes the results as json.
+    """
+    bench = benchResults()
+    run_startup(bench)
+    for size in rows:
+        run_size(bench, rows=size, duplicate_ratio=duplicate_ratio, seed=seed, legacy_max_rows=legacy_max_rows)
+
+    with open(output, "w") as f:
+        json.dump(
+            {
+                "meta": {
+                    "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                    "duplicate_ratio": duplicate_ratio,
+                    "seed": seed,
+                    "python": platform.python_version(),
+                    "polars": pl.__version__,
+                    "sqlalchemy": sqlalchemy.__version__,
+                    "sqlite": sqlite3.sqlite_version,
+                },
+                "results": bench.results,
+            },
+            f,
+            indent=2,
+        )
+    print(f"wrote {output}")
+
+
+@app.command()
+def compare(baseline: str, current: str, tolerance: float = typer.Option(1.2, help="allowed slowdown factor")):
+    """
+    Compares two benchmark json files and fails if a measurement got slower than the tolerance allows.
+    """
+    with open(baseline) as f:
+        before = {result["name"]: result for result in json.load(f)["results"]}
+    with open(current) as f:
+        after = {result["name"]: result for result in json.load(f)["results"]}
+
+    regressions = []
+    for name, result in after.items():
+        if name not in before:
+            continue
+        factor = result["seconds"] / max(before[name]["seconds"], 1e-9)
+        flag = "SLOWER" if factor > tolerance else ""
+        print(f"{name}: {before[name]['seconds']:.3f}s -> {result['seconds']:.3f}s ({factor:.2f}x) {flag}")
+        if factor > tolerance:
+            regressions.append(name)
+    if regressions:
+        raise typer.Exit(code=1)
+
+
+@app.command()
+def generate(
+    file_path: str,
+    rows: int = 10000,
+    seed: int = 1,
+    accounts: int = 2,
+    years: int = 3,
+):
+    """
+    Writes a synthetic umsatz csv file.
+    """
+    write_umsatz_csv(file_path, generate_rows(rows, seed=seed, accounts=accounts, years=years))
+
+
+if __name__ == "__main__":
+    app()
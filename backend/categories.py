@@ -0,0 +1,337 @@
+from typing import Dict, List, Optional
+import json
+import os
+import typer
+import polars as pl
+
+from column_mapping import columnMapping, MappedCols, umsatz_column_mapping
+from data_model import TransactionType
+from amounts import units_to_cents
+
+app = typer.Typer()
+
+CATEGORY_RULES_FILE = os.environ.get("SUMMARIZER_CATEGORY_RULES", "category_rules.json")
+# the columns of the umsatz exports the keywords and ibans are looked up in, unless the
+# rules file names others
+DEFAULT_TEXT_COLUMNS = ["beguenstigter/zahlungspflichtiger", "verwendungszweck"]
+DEFAULT_IBAN_COLUMN = "kontonummer/iban"
+RULE_KEYS = {"category", "keywords", "columns", "ibans", "tr_type", "min_amount", "max_amount"}
+
+
+def normalize_iban(iban: pl.Expr) -> pl.Expr:
+    """
+    Upper case without spaces, so ibans compare equal however they are written.
+    """
+    return iban.cast(pl.Utf8).str.replace_all(" ", "", literal=True).str.to_uppercase()
+
+
+def to_cents(amount) -> int:
+    """
+    An amount of a rule in whole units (a json number) in cents.
+    """
+    return round(float(amount) * 100)
+
+
+class categoryRules:
+    """
+    Class that holds a compiled rule set for categorizing transactions.
+    A rule has a category and any of: keywords (found in its text columns, case insensitive),
+    ibans (of the counterparty), a transaction type and an amount range in whole units.
+    A transaction matches a rule if it matches all of the rule's conditions, and gets the
+    category of the first rule it matches. A rule without conditions matches everything.
+
+    The rules are not evaluated one by one: all keywords of a text column are searched in a
+    single multi-pattern (Aho-Corasick) pass, the ibans are joined, and only the resulting
+    (row, rule) candidates are checked against the type and amount conditions.
+    """
+
+    def __init__(
+        self,
+        rules: List[dict],
+        text_cols: List[str] = DEFAULT_TEXT_COLUMNS,
+        iban_col: Optional[str] = DEFAULT_IBAN_COLUMN,
+    ):
+        """
+        Initialization
+
+        Args:
+            rules (List[dict]): the rules, in the order they are tried
+            text_cols (List[str], optional): the default columns of the keywords.
+                Defaults to DEFAULT_TEXT_COLUMNS.
+            iban_col (Optional[str], optional): the column with the counterparty iban.
+                Defaults to DEFAULT_IBAN_COLUMN.
+
+        Raises:
+            ValueError: if a rule is malformed
+        """
+        self.text_cols = text_cols
+        self.iban_col = iban_col
+        self.categories: List[str] = []
+        keywords = []
+        ibans = []
+        conditions = []
+        # rules without keywords or ibans are candidates for every row
+        self.open_rules: List[int] = []
+        for nr, rule in enumerate(rules):
+            unknown = set(rule) - RULE_KEYS
+            if len(unknown) > 0:
+                raise ValueError(f"rule {nr}: unknown keys {sorted(unknown)}")
+            category = rule.get("category")
+            if not isinstance(category, str) or category == "":
+                raise ValueError(f"rule {nr}: category missing")
+            rule_keywords = [keyword.lower() for keyword in rule.get("keywords", [])]
+            if any(keyword == "" for keyword in rule_keywords):
+                raise ValueError(f"rule {nr}: empty keyword")
+            rule_ibans = [iban.replace(" ", "").upper() for iban in rule.get("ibans", [])]
+            tr_type = rule.get("tr_type")
+            if tr_type is not None and tr_type not in TransactionType.__members__:
+                raise ValueError(f"rule {nr}: tr_type must be debit or credit, not {tr_type!r}")
+            self.categories.append(category)
+            keywords += [
+                (col, keyword, nr)
+                for col in rule.get("columns", text_cols)
+                for keyword in rule_keywords
+            ]
+            if len(rule_keywords) == 0:
+                if len(rule_ibans) > 0:
+                    ibans += [(iban, nr) for iban in rule_ibans]
+                else:
+                    self.open_rules.append(nr)
+            conditions.append(
+                (
+                    nr,
+                    tr_type,
+                    None if rule.get("min_amount") is None else to_cents(rule["min_amount"]),
+                    None if rule.get("max_amount") is None else to_cents(rule["max_amount"]),
+                    rule_ibans or None,
+                )
+            )
+        self.keywords = pl.DataFrame(
+            keywords, schema={"column": pl.Utf8, "keyword": pl.Utf8, "rule": pl.Int64}, orient="row"
+        ).unique()
+        self.ibans = pl.DataFrame(ibans, schema={"iban": pl.Utf8, "rule": pl.Int64}, orient="row")
+        self.conditions = pl.DataFrame(
+            conditions,
+            schema={
+                "rule": pl.Int64,
+                "rule_tr_type": pl.Utf8,
+                "min_cents": pl.Int64,
+                "max_cents": pl.Int64,
+                "rule_ibans": pl.List(pl.Utf8),
+            },
+            orient="row",
+        )
+
+    @classmethod
+    def from_file(cls, file_path: str) -> "categoryRules":
+        """
+        Reads a rules file: a json object with the rules under "rules" and optionally the
+        default keyword columns under "columns" and the iban column under "iban_column".
+
+        Args:
+            file_path (str): the path of the json file
+
+        Returns:
+            categoryRules: the compiled rules
+        """
+        with open(file_path, encoding="utf-8") as f:
+            config = json.load(f)
+        return cls(
+            rules=config.get("rules", []),
+            text_cols=config.get("columns", DEFAULT_TEXT_COLUMNS),
+            iban_col=config.get("iban_column", DEFAULT_IBAN_COLUMN),
+        )
+
+    def categorize(self, df: pl.DataFrame) -> pl.Series:
+        """
+        The category of every row of df, null where no rule matches.
+
+        Args:
+            df (pl.DataFrame): parsed csv rows or stored transactions, with the mapped columns
+                (amounts in cents) and the text and iban columns
+
+        Returns:
+            pl.Series: the categories, called category, in the order of df
+        """
+        if len(self.categories) == 0:
+            return pl.Series(MappedCols.category_col.value, [None] * df.height, dtype=pl.Utf8)
+        has_iban = self.iban_col is not None and self.iban_col in df.columns
+        rows = df.select(
+            pl.int_range(pl.len()).alias("row_nr"),
+            pl.col(MappedCols.tr_type_col.value).cast(pl.Utf8).alias("tr_type"),
+            pl.col(MappedCols.amount_col.value).alias("amount_cents"),
+            (normalize_iban(pl.col(self.iban_col)) if has_iban else pl.lit(None, dtype=pl.Utf8)).alias(
+                "iban"
+            ),
+        )
+
+        candidates = []
+        for (col,), keywords in self.keywords.partition_by("column", as_dict=True).items():
+            if col not in df.columns:
+                continue
+            found = df.select(
+                pl.int_range(pl.len()).alias("row_nr"),
+                pl.col(col)
+                .cast(pl.Utf8)
+                .str.to_lowercase()
+                .str.extract_many(keywords["keyword"].unique().implode(), overlapping=True)
+                .alias("keyword"),
+            ).explode("keyword")
+            candidates.append(
+                found.join(keywords.select("keyword", "rule"), on="keyword").select(
+                    "row_nr", "rule"
+                )
+            )
+        if has_iban and self.ibans.height > 0:
+            candidates.append(rows.join(self.ibans, on="iban").select("row_nr", "rule"))
+        if len(self.open_rules) > 0:
+            candidates.append(
+                rows.select("row_nr").join(
+                    pl.DataFrame({"rule": self.open_rules}, schema={"rule": pl.Int64}),
+                    how="cross",
+                )
+            )
+        if len(candidates) == 0:
+            return pl.Series(MappedCols.category_col.value, [None] * df.height, dtype=pl.Utf8)
+
+        matched = (
+            pl.concat(candidates)
+            .unique()
+            .join(self.conditions, on="rule")
+            .join(rows, on="row_nr")
+            .filter(
+                pl.col("rule_tr_type").is_null() | (pl.col("rule_tr_type") == pl.col("tr_type")),
+                pl.col("min_cents").is_null() | (pl.col("amount_cents") >= pl.col("min_cents")),
+                pl.col("max_cents").is_null() | (pl.col("amount_cents") <= pl.col("max_cents")),
+                pl.col("rule_ibans").is_null()
+                | pl.col("rule_ibans").list.contains(pl.col("iban")).fill_null(False),
+            )
+            .group_by("row_nr")
+            .agg(pl.col("rule").min())
+        )
+        categories = dict(enumerate(self.categories))
+        return (
+            rows.select("row_nr")
+            .join(matched, on="row_nr", how="left", maintain_order="left")
+            .select(
+                pl.col("rule")
+                .replace_strict(categories, default=None, return_dtype=pl.Utf8)
+                .alias(MappedCols.category_col.value)
+            )
+            .to_series()
+        )
+
+    def apply(self, df: pl.DataFrame) -> pl.DataFrame:
+        """
+        Adds the category column to df. Categories that df already has, e.g. from a mapped
+        category column of the csv, are kept.
+
+        Args:
+            df (pl.DataFrame): the rows, see categorize
+
+        Returns:
+            pl.DataFrame: df with the category column
+        """
+        categories = self.categorize(df)
+        if MappedCols.category_col.value in df.columns:
+            categories = df[MappedCols.category_col.value].cast(pl.Utf8).fill_null(categories)
+        return df.with_columns(categories.alias(MappedCols.category_col.value))
+
+
+def load_category_rules(file_path: Optional[str] = None) -> categoryRules:
+    """
+    The rules of the rules file, or no rules if there is no such file.
+
+    Args:
+        file_path (Optional[str], optional): the rules file. Defaults to None (CATEGORY_RULES_FILE).
+
+    Returns:
+        categoryRules: the compiled rules
+    """
+    file_path = file_path or CATEGORY_RULES_FILE
+    if not os.path.exists(file_path):
+        return categoryRules(rules=[])
+    return categoryRules.from_file(file_path)
+
+
+def recategorize_transactions(
+    db_engine, rules: categoryRules, column_mapping: columnMapping, batch_size: int = 5000
+) -> Dict[str, int]:
+    """
+    Categorizes all stored transactions again, e.g. after the rules changed, and stores the
+    categories that changed. The monthly summary has to be rebuilt afterwards.
+
+    Args:
+        db_engine (sqlalchemy engine): the database engine
+        rules (categoryRules): the rules
+        column_mapping (columnMapping): the column mapping used for the imports
+        batch_size (int, optional): the number of updates per statement. Defaults to 5000.
+
+    Returns:
+        Dict[str, int]: the number of categorized, changed and uncategorized transactions
+    """
+    from sqlalchemy import update, bindparam
+    from data_model import Transaction
+    from detail_types import detail_type_labels
+    from revisions import TRANSACTIONS, bump_revision
+    from transaction_frame import transaction_frame
+
+    labels = set(detail_type_labels(db_engine).values())
+    wanted = [*rules.text_cols, *rules.keywords["column"].unique().to_list(), rules.iban_col]
+    df = transaction_frame(
+        db_engine,
+        columns=["amount", "tr_type", "category"]
+        + list(dict.fromkeys(col for col in wanted if col in labels)),
+    ).with_columns(units_to_cents(pl.col("amount")).alias(MappedCols.amount_col.value))
+    categorized = df.select(
+        pl.col("id").alias("b_id"),
+        rules.categorize(df).alias("b_category"),
+        pl.col("category").alias("old_category"),
+    )
+    changed = categorized.filter(pl.col("b_category").ne_missing(pl.col("old_category")))
+
+    update_stmt = (
+        update(Transaction)
+        .where(Transaction.id == bindparam("b_id"))
+        .values(category=bindparam("b_category"))
+    )
+    with db_engine.begin() as conn:
+        for batch in changed.select("b_id", "b_category").iter_slices(batch_size):
+            conn.execute(update_stmt, batch.rows(named=True))
+        if changed.height > 0:
+            bump_revision(conn, TRANSACTIONS)
+    return {
+        "transactions": df.height,
+        "changed": changed.height,
+        "uncategorized": categorized["b_category"].null_count(),
+    }
+
+
+@app.command()
+def recategorize(
+    rules_file: Optional[str] = typer.Option(None, help=f"the rules, defaults to {CATEGORY_RULES_FILE}"),
+):
+    """
+    Categorizes all stored transactions again with the current rules and rebuilds the
+    monthly summary, so the totals per category follow the rules.
+    """
+    from db import engine
+    from monthly_summary import rebuild_monthly_summary
+
+    rules_file = rules_file or CATEGORY_RULES_FILE
+    if not os.path.exists(rules_file):
+        print(f"no rules file {rules_file}")
+        raise typer.Exit(code=1)
+    column_mapping = umsatz_column_mapping()
+    counts = recategorize_transactions(
+        engine, categoryRules.from_file(rules_file), column_mapping=column_mapping
+    )
+    rebuild_monthly_summary(engine, column_mapping=column_mapping)
+    print(
+        f"categorized {counts['transactions']} transactions, {counts['changed']} changed, "
+        f"{counts['uncategorized']} without category"
+    )
+
+
+if __name__ == "__main__":
+    app()
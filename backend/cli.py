@@ -0,0 +1,74 @@
+from typing import Dict, List, Tuple
+import importlib
+import typer
+from typer.core import TyperCommand, TyperGroup
+
+# command name: the module with the typer app of the command, the help shown in --help
+LAZY_COMMANDS: Dict[str, Tuple[str, str]] = {
+    "import": ("import_csv", "Import csv files into the database."),
+    "summarize": ("monthly_summary", "Totals per month or year from the database."),
+    "summarize-csv": ("summarize_csv", "Monthly costs of a csv file."),
+    "details": ("data_io", "Profile the transaction details."),
+    "export": ("transaction_frame", "Export the transactions with their details as columns."),
+    "near-duplicates": ("near_duplicates", "Report probable duplicates for review."),
+    "recategorize": ("categories", "Categorize the stored transactions with the current rules."),
+    "export-partitions": ("parquet_export", "Export the transactions to Parquet partitioned by month."),
+    "recurring": ("recurring", "List recurring payments with their cadence and next date."),
+    "store-summary": ("transaction_store", "Load the in-memory transaction store and print totals."),
+    "rebuild-filter": ("fingerprint_filter", "Rebuild the fingerprint filter of the duplicate checks."),
+    "migrate": ("migrate", "Bring an existing database up to date."),
+    "check-plans": ("query_plan", "Check the query plans of the hot queries."),
+    "benchmark": ("benchmark", "Generate synthetic statements and time the imports."),
+}
+
+
+class lazyGroup(TyperGroup):
+    """
+    A command group that only imports the module of a command when that command runs.
+    Until then the commands are placeholders that know their help text, so --help and
+    the completion do not pay for polars, sqlalchemy or the plotting libraries.
+    """
+
+    def __init__(self, **attrs):
+        super().__init__(**attrs)
+        for name, (_, help) in LAZY_COMMANDS.items():
+            self.add_command(TyperCommand(name=name, help=help))
+
+    def list_commands(self, ctx) -> List[str]:
+        return list(LAZY_COMMANDS)
+
+    def resolve_command(self, ctx, args):
+        cmd_name, cmd, args = super().resolve_command(ctx, args)
+        if cmd_name in LAZY_COMMANDS:
+            cmd = load_command(cmd_name)
+        return cmd_name, cmd, args
+
+
+def load_command(name: str):
+    """
+    Imports the module of a command and returns its click command.
+
+    Args:
+        name (str): the command name, a key of LAZY_COMMANDS
+
+    Returns:
+        the click command (or group, for modules with several commands)
+    """
+    module_name, _ = LAZY_COMMANDS[name]
+    command = typer.main.get_command(importlib.import_module(module_name).app)
+    command.name = name
+    return command
+
+
+app = typer.Typer(cls=lazyGroup, no_args_is_help=True)
+
+
+@app.callback()
+def main():
+    """
+    The summarizer commands.
+    """
+
+
+if __name__ == "__main__":
+    app()
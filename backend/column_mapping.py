@@ -1,11 +1,13 @@
 import enum
-from typing import List
+from typing import List, Optional
 class MappedCols(enum.Enum):
-    amount_col =  "amount"
+    # integer minor units (cents), see handle_csv.amount_cents
+    amount_col =  "amount_cents"
     booking_date_col =  "booking_date"
     value_date_col = "value_date"
     category_col = "category"
     tr_type_col = "tr_type"
+    fingerprint_col = "fingerprint"
 
 class columnMapping():
     """
@@ -20,7 +22,8 @@ class columnMapping():
         value_date_col: str,
         category_col: str,
         date_format_str: str,
-        unicity_cols: List[str] = []
+        unicity_cols: List[str] = [],
+        account_col: Optional[str] = None,
     ):
         self.amount_col = amount_col
         self.booking_date_col = booking_date_col
@@ -28,7 +31,16 @@ class columnMapping():
         self.category_col = category_col
         self.date_format_str = date_format_str
         self.unicity_cols = unicity_cols
-        self.col_list = [self.amount_col, self.booking_date_col, self.value_date_col, "tr_type"]
+        # the (cleaned) name of the detail column holding the account, used for the import watermarks
+        self.account_col = account_col
+        self.col_list = [
+            MappedCols.amount_col.value,
+            MappedCols.booking_date_col.value,
+            MappedCols.value_date_col.value,
+            MappedCols.tr_type_col.value,
+            MappedCols.fingerprint_col.value,
+            MappedCols.category_col.value,
+        ]
 
     def clean_name(self, col_name: str) -> str:
         """
@@ -63,3 +75,26 @@ class columnMapping():
         elif new_name == self.category_col:
             new_name = MappedCols.category_col.value
         return new_name
+
+
+def umsatz_column_mapping() -> columnMapping:
+    """
+    The column mapping for the umsatz csv exports from our bank.
+
+    Returns:
+        columnMapping: the column mapping
+    """
+    return columnMapping(
+        amount_col="betrag",
+        booking_date_col="buchungstag",
+        value_date_col="valutadatum",
+        category_col=None,
+        date_format_str="%d.%m.%y",
+        unicity_cols=[
+            "Buchungstext".lower(),
+            "Verwendungszweck".lower(),
+            "Beguenstigter/Zahlungspflichtiger".lower(),
+            "Kontonummer/IBAN".lower(),
+        ],
+        account_col="Auftragskonto".lower(),
+    )
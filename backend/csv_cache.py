@@ -0,0 +1,122 @@
+from typing import Callable, Iterable, Optional
+import hashlib
+import os
+import polars as pl
+
+# bump when the parsing/normalization of the csv changes, so old entries are not used anymore
+CACHE_VERSION = 2
+CACHE_DIR = os.environ.get("SUMMARIZER_CACHE_DIR", ".csv_cache")
+MAX_CACHE_BYTES = int(os.environ.get("SUMMARIZER_CACHE_MAX_BYTES", 512 * 1024 * 1024))
+
+
+def file_hash(file_path: str) -> str:
+    """
+    Hashes the content of a file.
+
+    Args:
+        file_path (str): the file path
+
+    Returns:
+        str: the sha256 hex digest of the content
+    """
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def params_repr(param) -> str:
+    """
+    A stable text representation of a parameter object such as csvParams or columnMapping.
+
+    Args:
+        param: the parameter, an object with attributes or a plain value
+
+    Returns:
+        str: the representation
+    """
+    if hasattr(param, "__dict__"):
+        return f"{type(param).__name__}{sorted(vars(param).items())!r}"
+    return repr(param)
+
+
+def cache_key(file_path: str, key_parts: Iterable) -> str:
+    """
+    The cache key of a parsed file: the file content plus everything that influences the parsing.
+
+    Args:
+        file_path (str): the csv file path
+        key_parts (Iterable): the parameters used for parsing, e.g. csvParams and columnMapping
+
+    Returns:
+        str: the key
+    """
+    digest = hashlib.sha256(f"{CACHE_VERSION}:{file_hash(file_path)}".encode("utf-8"))
+    for part in key_parts:
+        digest.update(params_repr(part).encode("utf-8"))
+    return digest.hexdigest()
+
+
+def evict(cache_dir: Optional[str] = None, max_bytes: Optional[int] = None):
+    """
+    Removes the least recently used entries until the cache is not bigger than max_bytes.
+
+    Args:
+        cache_dir (Optional[str], optional): the cache directory. Defaults to CACHE_DIR.
+        max_bytes (Optional[int], optional): the maximum size of the cache. Defaults to MAX_CACHE_BYTES.
+    """
+    cache_dir = CACHE_DIR if cache_dir is None else cache_dir
+    max_bytes = MAX_CACHE_BYTES if max_bytes is None else max_bytes
+    entries = [
+        entry
+        for entry in os.scandir(cache_dir)
+        if entry.is_file() and entry.name.endswith(".arrow")
+    ]
+    # reads touch the entries, so the oldest mtime is the least recently used
+    entries.sort(key=lambda entry: entry.stat().st_mtime)
+    total = sum(entry.stat().st_size for entry in entries)
+    for entry in entries:
+        if total <= max_bytes:
+            break
+        total -= entry.stat().st_size
+        try:
+            os.remove(entry.path)
+        except FileNotFoundError:
+            pass
+
+
+def cached_frame(
+    file_path: str,
+    key_parts: Iterable,
+    loader: Callable[[], pl.DataFrame],
+    cache_dir: Optional[str] = None,
+    max_bytes: Optional[int] = None,
+) -> pl.DataFrame:
+    """
+    Returns the parsed data of a csv file from the cache, or parses it with loader and stores
+    the result as an uncompressed Arrow IPC file. Cached frames are memory mapped when read.
+
+    Args:
+        file_path (str): the csv file path
+        key_parts (Iterable): the parameters used for parsing, e.g. csvParams and columnMapping
+        loader (Callable[[], pl.DataFrame]): parses the file when it is not cached
+        cache_dir (Optional[str], optional): the cache directory. Defaults to CACHE_DIR.
+        max_bytes (Optional[int], optional): the maximum size of the cache. Defaults to MAX_CACHE_BYTES.
+
+    Returns:
+        pl.DataFrame: the parsed data
+    """
+    cache_dir = CACHE_DIR if cache_dir is None else cache_dir
+    path = os.path.join(cache_dir, cache_key(file_path, key_parts) + ".arrow")
+    if os.path.exists(path):
+        os.utime(path)
+        return pl.read_ipc(path)
+
+    df = loader()
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    df.write_ipc(tmp_path)
+    os.replace(tmp_path, path)
+    evict(cache_dir=cache_dir, max_bytes=max_bytes)
+    return df
@@ -0,0 +1,70 @@
+from typing import Iterator, List
+import io
+import polars as pl
+
+
+def parse_csv_text(text: str, separator: str) -> pl.DataFrame:
+    """
+    Parses csv text (header included) with all columns read as strings, so that every
+    batch of a file ends up with the same schema.
+
+    Args:
+        text (str): the csv text
+        separator (str): the column separator
+
+    Returns:
+        pl.DataFrame: the parsed data
+    """
+    return pl.read_csv(
+        io.BytesIO(text.encode("utf-8")),
+        separator=separator,
+        infer_schema_length=0,
+    )
+
+
+def read_csv_header(file_path: str, separator: str, encoding: str) -> List[str]:
+    """
+    Reads only the column names of a csv file.
+
+    Args:
+        file_path (str): the file path to the csv
+        separator (str): the column separator
+        encoding (str): the file encoding
+
+    Returns:
+        List[str]: the column names as they are in the file
+    """
+    with open(file_path, encoding=encoding, newline="") as f:
+        return parse_csv_text(f.readline(), separator=separator).columns
+
+
+def iter_csv_batches(
+    file_path: str, separator: str, encoding: str, batch_size: int = 50000
+) -> Iterator[pl.DataFrame]:
+    """
+    Reads a csv file in batches of rows so that only one batch is in memory at a time.
+    The file is decoded line by line and a batch is only cut where the number of quote
+    characters read so far is even, i.e. never inside a quoted field that spans lines.
+
+    Args:
+        file_path (str): the file path to the csv
+        separator (str): the column separator
+        encoding (str): the file encoding
+        batch_size (int, optional): the number of lines per batch. Defaults to 50000.
+
+    Yields:
+        Iterator[pl.DataFrame]: the batches, all columns as strings
+    """
+    with open(file_path, encoding=encoding, newline="") as f:
+        header = f.readline()
+        lines = []
+        quotes = 0
+        for line in f:
+            lines.append(line)
+            quotes += line.count('"')
+            if len(lines) >= batch_size and quotes % 2 == 0:
+                yield parse_csv_text(header + "".join(lines), separator=separator)
+                lines = []
+                quotes = 0
+        if len(lines) > 0:
+            yield parse_csv_text(header + "".join(lines), separator=separator)
@@ -0,0 +1,253 @@
+from typing import List, Optional, Tuple
+from datetime import date, datetime, timedelta
+import polars as pl
+from sqlalchemy import select, func, exists, and_
+
+from data_model import Transaction, TransactionDetail, TransactionDetailType, TransactionType, DetailValue
+from amounts import cents_to_units
+from revisions import TRANSACTIONS, read_revision
+
+# the buckets of the charted time series and their length in days, finest first
+SERIES_BUCKETS = [("1d", 1), ("1w", 7), ("1mo", 30), ("3mo", 91), ("1y", 365)]
+
+
+class transactionFilter:
+    """
+    Class that holds the filters of the dashboard, applied in the database.
+    """
+
+    def __init__(
+        self,
+        date_from: Optional[date] = None,
+        date_to: Optional[date] = None,
+        tr_type: Optional[TransactionType] = None,
+        label: Optional[str] = None,
+        text: Optional[str] = None,
+    ):
+        """
+        Initialization
+
+        Args:
+            date_from (Optional[date], optional): first booking date. Defaults to None.
+            date_to (Optional[date], optional): last booking date. Defaults to None.
+            tr_type (Optional[TransactionType], optional): only debits or credits. Defaults to None.
+            label (Optional[str], optional): only transactions that have this detail. Defaults to None.
+            text (Optional[str], optional): only transactions whose detail of label contains the text,
+                or any detail if no label is given. Defaults to None.
+        """
+        self.date_from = date_from
+        self.date_to = date_to
+        self.tr_type = tr_type
+        self.label = label
+        self.text = text
+
+    def apply(self, stmt):
+        """
+        Adds the filters to a select over transaction_base.
+        """
+        if self.date_from is not None:
+            stmt = stmt.where(Transaction.booking_date >= datetime.combine(self.date_from, datetime.min.time()))
+        if self.date_to is not None:
+            stmt = stmt.where(
+                Transaction.booking_date < datetime.combine(self.date_to + timedelta(days=1), datetime.min.time())
+            )
+        if self.tr_type is not None:
+            stmt = stmt.where(Transaction.tr_type == self.tr_type)
+        if self.label is not None or self.text:
+            conditions = [TransactionDetail.transaction_id == Transaction.id]
+            if self.label is not None:
+                conditions.append(
+                    TransactionDetail.transaction_detail_type_id
+                    == select(TransactionDetailType.id)
+                    .where(TransactionDetailType.label == self.label)
+                    .scalar_subquery()
+                )
+            if self.text:
+                # the texts are stored once in detail_value, the details only hold their ids
+                conditions.append(
+                    TransactionDetail.value_id.in_(
+                        select(DetailValue.id).where(DetailValue.value.contains(self.text, autoescape=True))
+                    )
+                )
+            stmt = stmt.where(exists().where(and_(*conditions)))
+        return stmt
+
+    def key(self) -> tuple:
+        """
+        Returns:
+            tuple: the filter values, for cache keys
+        """
+        return (
+            self.date_from,
+            self.date_to,
+            None if self.tr_type is None else self.tr_type.value,
+            self.label,
+            self.text,
+        )
+
+
+def data_version(db_engine) -> Tuple[Optional[int], int]:
+    """
+    A cheap version of the imported data: the highest id, read from the end of the primary
+    key, and the revision of the changes that keep the ids (see revisions), e.g. a
+    recategorize. Imports only ever add transactions, so every import changes the version,
+    which makes it usable as a cache key for everything the dashboard reads.
+
+    Args:
+        db_engine (sqlalchemy engine): the database engine
+
+    Returns:
+        Tuple[Optional[int], int]: the highest id and the revision
+    """
+    with db_engine.connect() as conn:
+        max_id = conn.execute(select(func.max(Transaction.id))).scalar()
+        return max_id, read_revision(conn, TRANSACTIONS)
+
+
+def date_bounds(db_engine) -> Tuple[Optional[date], Optional[date]]:
+    """
+    Returns:
+        Tuple[Optional[date], Optional[date]]: the first and the last booking date
+    """
+    with db_engine.connect() as conn:
+        first, last = conn.execute(
+            select(func.min(Transaction.booking_date), func.max(Transaction.booking_date))
+        ).one()
+    return (
+        None if first is None else first.date(),
+        None if last is None else last.date(),
+    )
+
+
+def count_transactions(db_engine, filters: transactionFilter) -> int:
+    """
+    Returns:
+        int: the number of transactions matching the filters
+    """
+    with db_engine.connect() as conn:
+        return conn.execute(filters.apply(select(func.count()).select_from(Transaction))).scalar_one()
+
+
+def transactions_page(
+    db_engine,
+    filters: transactionFilter,
+    offset: int = 0,
+    limit: int = 100,
+    labels: Optional[List[str]] = None,
+) -> pl.DataFrame:
+    """
+    One page of the filtered transactions, newest first, with the details of the page
+    as columns. Only the rows of the page are read from the database.
+
+    Args:
+        db_engine (sqlalchemy engine): the database engine
+        filters (transactionFilter): the filters
+        offset (int, optional): the number of rows to skip. Defaults to 0.
+        limit (int, optional): the page size. Defaults to 100.
+        labels (Optional[List[str]], optional): the detail columns to add. Defaults to None (all).
+
+    Returns:
+        pl.DataFrame: id, booking_date, value_date, amount, tr_type and one column per detail label
+    """
+    stmt = filters.apply(
+        select(
+            Transaction.id,
+            Transaction.booking_date,
+            Transaction.value_date,
+            Transaction.amount_cents,
+            Transaction.tr_type,
+        )
+    ).order_by(Transaction.booking_date.desc(), Transaction.id.desc()).offset(offset).limit(limit)
+    schema = {
+        "id": pl.Int64,
+        "booking_date": pl.Date,
+        "value_date": pl.Date,
+        "amount": pl.Int64,
+        "tr_type": pl.Utf8,
+    }
+    with db_engine.connect() as conn:
+        rows = [
+            (row.id, row.booking_date.date(), row.value_date.date(), row.amount_cents, row.tr_type.value)
+            for row in conn.execute(stmt)
+        ]
+        page = pl.DataFrame(rows, schema=schema, orient="row").with_columns(
+            cents_to_units(pl.col("amount"))
+        )
+        if page.height == 0:
+            return page
+        detail_stmt = (
+            select(
+                TransactionDetail.transaction_id,
+                TransactionDetailType.label,
+                DetailValue.value,
+            )
+            .join(TransactionDetailType, TransactionDetailType.id == TransactionDetail.transaction_detail_type_id)
+            .join(DetailValue, DetailValue.id == TransactionDetail.value_id)
+            .where(TransactionDetail.transaction_id.in_(page["id"].to_list()))
+        )
+        if labels is not None:
+            detail_stmt = detail_stmt.where(TransactionDetailType.label.in_(labels))
+        details = pl.DataFrame(
+            [tuple(row) for row in conn.execute(detail_stmt)],
+            schema={"id": pl.Int64, "label": pl.Utf8, "description": pl.Utf8},
+            orient="row",
+        )
+    if details.height == 0:
+        return page
+    return page.join(
+        details.pivot(on="label", index="id", values="description", aggregate_function="first"),
+        on="id",
+        how="left",
+    )
+
+
+def series_bucket(date_from: date, date_to: date, max_points: int) -> str:
+    """
+    The finest bucket that keeps the time series at max_points per transaction type or less.
+
+    Args:
+        date_from (date): the first day
+        date_to (date): the last day
+        max_points (int): the maximum number of points
+
+    Returns:
+        str: the bucket as a polars duration, e.g. 1w
+    """
+    days = (date_to - date_from).days + 1
+    for every, bucket_days in SERIES_BUCKETS:
+        if days / bucket_days <= max_points:
+            return every
+    return SERIES_BUCKETS[-1][0]
+
+
+def amount_series(db_engine, filters: transactionFilter, max_points: int = 200) -> pl.DataFrame:
+    """
+    The summed amounts of the filtered transactions over time, downsampled for charting.
+    The daily sums of the cents are computed in the database, then summed up per bucket (day, week, month,
+    quarter or year) so that there are at most max_points points per transaction type.
+
+    Args:
+        db_engine (sqlalchemy engine): the database engine
+        filters (transactionFilter): the filters
+        max_points (int, optional): the maximum number of points per transaction type. Defaults to 200.
+
+    Returns:
+        pl.DataFrame: bucket (date), tr_type and amount, sorted by bucket
+    """
+    day = func.date(Transaction.booking_date)
+    stmt = filters.apply(
+        select(day, Transaction.tr_type, func.sum(Transaction.amount_cents))
+    ).group_by(day, Transaction.tr_type)
+    with db_engine.connect() as conn:
+        rows = [(day_str, tr_type.value, amount) for day_str, tr_type, amount in conn.execute(stmt)]
+    daily = pl.DataFrame(
+        rows, schema={"day": pl.Utf8, "tr_type": pl.Utf8, "amount": pl.Int64}, orient="row"
+    ).with_columns(pl.col("day").str.to_date("%Y-%m-%d"))
+    if daily.height == 0:
+        return daily.rename({"day": "bucket"}).with_columns(cents_to_units(pl.col("amount")))
+    every = series_bucket(daily["day"].min(), daily["day"].max(), max_points=max_points)
+    return (
+        daily.group_by(pl.col("day").dt.truncate(every).alias("bucket"), "tr_type")
+        .agg(cents_to_units(pl.col("amount").sum()))
+        .sort("bucket", "tr_type")
+    )
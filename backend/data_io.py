@@ -1,52 +1,115 @@
-from typing import List, Tuple, Optional
-from datetime import datetime
 import typer
-import enum
-import polars as pl
-from data_model import (
-    Transaction,
-    TransactionDetail,
-    TransactionDetailType,
-    TransactionType,
-)
-from db import engine
-from sqlalchemy import select, insert, and_, or_, text, func
-from sqlalchemy.orm import Session
-from column_mapping import columnMapping, MappedCols
-from  handle_csv import handleCSV, csvParams
+from data_model import TransactionDetail, DetailValue
+from sqlalchemy import select, and_, func, null
+from detail_types import detail_type_labels
 
 app = typer.Typer()
 
+def detail_profile_stmt(
+    min_total: int = 1000, min_distinct: int = 2, max_distinct: int = 400, top_k: int = 0
+):
+    """
+    Builds the column profiling query over transaction_detail. The counts per
+    (detail type, detail value id) and the totals and distinct counts per detail type are
+    aggregated in SQL on integers, the thresholds are applied with HAVING and only the top_k most
+    frequent descriptions of the qualifying detail types are looked up and returned.
+
+    Args:
+        min_total (int, optional): detail types need more than this many details. Defaults to 1000.
+        min_distinct (int, optional): detail types need more distinct descriptions than this. Defaults to 2.
+        max_distinct (int, optional): detail types need less distinct descriptions than this. Defaults to 400.
+        top_k (int, optional): the number of descriptions per detail type. Defaults to 0.
+
+    Returns:
+        select: rows of type_id, tot, distinct, description and cnt ordered by type_id and
+        decreasing cnt, description and cnt are None when top_k is 0
+    """
+    counts = (
+        select(
+            TransactionDetail.transaction_detail_type_id.label("type_id"),
+            TransactionDetail.value_id,
+            func.count().label("cnt"),
+        )
+        .group_by(
+            TransactionDetail.transaction_detail_type_id,
+            TransactionDetail.value_id,
+        )
+        .cte("counts")
+    )
+    tot = func.sum(counts.c.cnt)
+    n_distinct = func.count()
+    labels = (
+        select(counts.c.type_id, tot.label("tot"), n_distinct.label("distinct"))
+        .group_by(counts.c.type_id)
+        .having(and_(tot > min_total, n_distinct > min_distinct, n_distinct < max_distinct))
+        .subquery("labels")
+    )
+    if top_k <= 0:
+        return select(
+            labels.c.type_id,
+            labels.c.tot,
+            labels.c.distinct,
+            null().label("description"),
+            null().label("cnt"),
+        ).order_by(labels.c.type_id)
+
+    ranked = (
+        select(
+            counts.c.type_id,
+            counts.c.value_id,
+            counts.c.cnt,
+            func.row_number()
+            .over(partition_by=counts.c.type_id, order_by=counts.c.cnt.desc())
+            .label("rank"),
+        )
+        .where(counts.c.type_id.in_(select(labels.c.type_id)))
+        .subquery("ranked")
+    )
+    return (
+        select(
+            labels.c.type_id,
+            labels.c.tot,
+            labels.c.distinct,
+            DetailValue.value.label("description"),
+            ranked.c.cnt,
+        )
+        .outerjoin(
+            ranked,
+            and_(ranked.c.type_id == labels.c.type_id, ranked.c.rank <= top_k),
+        )
+        .outerjoin(DetailValue, DetailValue.id == ranked.c.value_id)
+        .order_by(labels.c.type_id, ranked.c.rank)
+    )
+
+
 @app.command()
-def summarize_transaction_detail():
-    stmt = select(
-        TransactionDetailType.label,
-        TransactionDetail.description,
-        func.count()
-    ).join(
-        TransactionDetail.transaction_detail_type
-    ).group_by(
-        TransactionDetailType.label,
-        TransactionDetail.description
+def summarize_transaction_detail(
+    min_total: int = typer.Option(1000, help="minimum number of details of a label"),
+    min_distinct: int = typer.Option(2, help="minimum number of distinct descriptions of a label"),
+    max_distinct: int = typer.Option(400, help="maximum number of distinct descriptions of a label"),
+    top_k: int = typer.Option(0, help="print the top k descriptions of every label"),
+):
+    from db import engine
+
+    stmt = detail_profile_stmt(
+        min_total=min_total,
+        min_distinct=min_distinct,
+        max_distinct=max_distinct,
+        top_k=top_k,
     )
+    labels = detail_type_labels(engine)
     # print(stmt)
-    with Session(engine) as conn:
-        summary = {}
-        detail = {}
-        for row in conn.execute(stmt).all():
-            if row._mapping["label"] not in summary:
-                summary[row._mapping["label"]] = {"tot":0, "distinct":0}
-                detail[row._mapping["label"]] = {}
-            summary[row._mapping["label"]]["distinct"] += 1
-            summary[row._mapping["label"]]["tot"] += row._mapping["count"]
-            detail[row._mapping["label"]][row._mapping["description"]] = row._mapping["count"]
-        for label, cnt in summary.items():
-            # not_labels = ["kontonummer/iban", "bic_(swift-code)"]
-            # not_labels = []  label not in not_labels and
-            if  cnt["tot"] > 1000 and cnt["distinct"] < 400 and cnt["distinct"] > 2:
-                print(f"{label}:all:{cnt}")
-                # for desc, cnt2 in detail[label].items():
-                #     print(f"{label}:{desc}:{cnt2}")
+    with engine.connect() as conn:
+        current_type = None
+        for type_id, tot, n_distinct, description, cnt in conn.execution_options(
+            stream_results=True, yield_per=1000
+        ).execute(stmt):
+            label = labels[type_id]
+            if type_id != current_type:
+                current_type = type_id
+                print(f"{label}:all:{ {'tot': tot, 'distinct': n_distinct} }")
+            if description is not None:
+                print(f"{label}:{description}:{cnt}")
 
 if __name__ == "__main__":
     app()
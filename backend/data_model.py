@@ -1,7 +1,7 @@
 from typing import List
 from typing import Optional
 from sqlalchemy import ForeignKey
-from sqlalchemy import Integer, String, DateTime, Enum
+from sqlalchemy import Integer, String, DateTime, Enum, Index
 from sqlalchemy.sql import func
 from sqlalchemy.orm import DeclarativeBase
 from sqlalchemy.orm import Mapped
@@ -19,18 +19,26 @@ class TransactionType(enum.Enum):
 
 class Transaction(Base):
     __tablename__ = "transaction_base"
+    __table_args__ = (
+        # duplicate lookups on the mapped columns (find_transactions)
+        Index("ix_transaction_base_lookup", "booking_date", "value_date", "amount_cents", "tr_type"),
+    )
     id: Mapped[int] = mapped_column(primary_key=True)
     booking_date: Mapped[datetime] = mapped_column(DateTime(timezone=False))
     value_date: Mapped[datetime] = mapped_column(DateTime(timezone=False))
-    amount: Mapped[float]
+    # integer minor units, always positive, the sign is in tr_type
+    amount_cents: Mapped[int]
     tr_type: Mapped[TransactionType]
+    fingerprint: Mapped[Optional[str]] = mapped_column(String(64), unique=True, index=True)
+    # set by the category rules at import and by recategorize, null if no rule matched
+    category: Mapped[Optional[str]] = mapped_column(String(255))
 
     transaction_details: Mapped[List["TransactionDetail"]] = relationship(
         back_populates="transaction", cascade="all, delete-orphan"
     )
 
     def __repr__(self) -> str:
-        return f"Transasction(id={self.id!r}, amount={self.amount!r}, transaction type={self.tr_type!r}, value date={self.value_date!r})"
+        return f"Transasction(id={self.id!r}, amount_cents={self.amount_cents!r}, transaction type={self.tr_type!r}, value date={self.value_date!r})"
 
 class TransactionDetailType(Base):
     __tablename__ = "transaction_detail_type"
@@ -45,20 +53,78 @@ class TransactionDetailType(Base):
         return f"TransactionDetailType(id={self.id!r}, label={self.label!r}, description={self.description!r})"
 
 
+# every distinct detail text is stored once, the details refer to it by id
+class DetailValue(Base):
+    __tablename__ = "detail_value"
+    id: Mapped[int] = mapped_column(primary_key=True)
+    value: Mapped[str] = mapped_column(unique=True)
+
+    transaction_details: Mapped[List["TransactionDetail"]] = relationship(
+        back_populates="value"
+    )
+
+    def __repr__(self) -> str:
+        return f"DetailValue(id={self.id!r}, value={self.value!r})"
+
+
 class TransactionDetail(Base):
     __tablename__ = "transaction_detail"
+    __table_args__ = (
+        # details of a transaction (find_transaction_details, find_duplicates)
+        Index("ix_transaction_detail_transaction", "transaction_id", "transaction_detail_type_id"),
+        # grouping of the details per type (summarize_transaction_detail)
+        Index("ix_transaction_detail_type_value", "transaction_detail_type_id", "value_id"),
+    )
     id: Mapped[int] = mapped_column(primary_key=True)
     transaction_id: Mapped[int] = mapped_column(ForeignKey("transaction_base.id"))
     transaction_detail_type_id: Mapped[int] = mapped_column(ForeignKey("transaction_detail_type.id"))
-    description: Mapped[str]
+    value_id: Mapped[int] = mapped_column(ForeignKey("detail_value.id"))
 
     transaction: Mapped["Transaction"] = relationship(back_populates="transaction_details")
     transaction_detail_type: Mapped["TransactionDetailType"] = relationship(back_populates="transaction_details")
+    value: Mapped["DetailValue"] = relationship(back_populates="transaction_details")
 
     def __repr__(self) -> str:
-        return f"TransactionDetail(id={self.id!r}, description={self.description!r}, transaction_id={self.transaction_id!r}, transaction_detail_type_id={self.transaction_detail_type_id!r})"
+        return f"TransactionDetail(id={self.id!r}, value_id={self.value_id!r}, transaction_id={self.transaction_id!r}, transaction_detail_type_id={self.transaction_detail_type_id!r})"
     
 
+# how far the imports of one account got: the latest booking date and the
+# fingerprints (json list) of the transactions booked on that date
+class ImportWatermark(Base):
+    __tablename__ = "import_watermark"
+    account: Mapped[str] = mapped_column(String(255), primary_key=True)
+    booking_date: Mapped[datetime] = mapped_column(DateTime(timezone=False))
+    fingerprints: Mapped[str]
+
+    def __repr__(self) -> str:
+        return f"ImportWatermark(account={self.account!r}, booking date={self.booking_date!r})"
+
+
+# monthly totals per transaction type, account and category, kept up to date by the imports
+class MonthlySummary(Base):
+    __tablename__ = "monthly_summary"
+    month: Mapped[str] = mapped_column(String(7), primary_key=True)
+    tr_type: Mapped[TransactionType] = mapped_column(primary_key=True)
+    account: Mapped[str] = mapped_column(String(255), primary_key=True)
+    category: Mapped[str] = mapped_column(String(255), primary_key=True)
+    amount_cents_sum: Mapped[int]
+    tr_count: Mapped[int]
+
+    def __repr__(self) -> str:
+        return f"MonthlySummary(month={self.month!r}, transaction type={self.tr_type!r}, account={self.account!r}, category={self.category!r}, amount_cents={self.amount_cents_sum!r}, count={self.tr_count!r})"
+
+
+# counters of the changes that keep the transaction ids, e.g. a recategorize or a migration,
+# so caches versioned by the highest transaction id notice them (see revisions)
+class DataRevision(Base):
+    __tablename__ = "data_revision"
+    name: Mapped[str] = mapped_column(String(64), primary_key=True)
+    revision: Mapped[int]
+
+    def __repr__(self) -> str:
+        return f"DataRevision(name={self.name!r}, revision={self.revision!r})"
+
+
 def create_tables():
     from db import engine
     Base.metadata.create_all(engine)
@@ -0,0 +1,226 @@
+from typing import Callable, Dict, Iterable, List, Optional, Set
+import json
+from sqlalchemy import select, func
+from sqlalchemy.dialects.sqlite import insert
+
+from data_model import TransactionDetailType, DetailValue
+
+
+class internCache:
+    """
+    Process wide text -> id cache of a table that interns texts, such as the detail type labels
+    or the detail values. Kept per database url together with the table version it was read at.
+    Rows are only ever added, so any change to the table changes the version.
+    """
+
+    def __init__(
+        self,
+        model,
+        text_col: str,
+        new_row: Callable[[str], dict],
+        max_size: Optional[int] = None,
+    ):
+        """
+        Initialization
+
+        Args:
+            model: the orm model of the table
+            text_col (str): the name of the unique text column
+            new_row (Callable[[str], dict]): builds the row to insert for a new text
+            max_size (Optional[int], optional): the cache is emptied when it grows over this
+                many texts. Defaults to None (no limit).
+        """
+        self.model = model
+        self.text_col = getattr(model, text_col)
+        self.text_col_name = text_col
+        self.new_row = new_row
+        self.max_size = max_size
+        self.ids: Dict[str, Dict[str, int]] = {}
+        self.versions: Dict[str, Optional[int]] = {}
+        # the databases whose cache holds all texts of the table, see fill
+        self.complete: Set[str] = set()
+
+    def table_version(self, conn) -> Optional[int]:
+        """
+        A cheap version of the table: the highest id. Rows are only ever appended, so it
+        changes with every insert, and unlike a count it is read from the end of the index.
+
+        Args:
+            conn (sqlalchemy connection): the database connection
+
+        Returns:
+            Optional[int]: the highest id, None for an empty table
+        """
+        return conn.execute(select(func.max(self.model.id))).scalar()
+
+    def invalidate(self, db_engine=None):
+        """
+        Drops the cached texts of one database, or of all databases.
+
+        Args:
+            db_engine (sqlalchemy engine, optional): the database engine. Defaults to None (all databases).
+        """
+        if db_engine is None:
+            self.ids.clear()
+            self.versions.clear()
+            self.complete.clear()
+        else:
+            self.ids.pop(str(db_engine.url), None)
+            self.versions.pop(str(db_engine.url), None)
+            self.complete.discard(str(db_engine.url))
+
+    def cached_ids(self, conn, key: str) -> Dict[str, int]:
+        """
+        Returns the cache of one database, emptied first if the table changed since it was filled.
+
+        Args:
+            conn (sqlalchemy connection): the database connection
+            key (str): the cache key of the database
+
+        Returns:
+            Dict[str, int]: the cached text -> id mapping
+        """
+        version = self.table_version(conn)
+        if key not in self.ids or self.versions[key] != version or (
+            self.max_size is not None and len(self.ids.get(key, {})) > self.max_size
+        ):
+            self.ids[key] = {}
+            self.versions[key] = version
+            self.complete.discard(key)
+        return self.ids[key]
+
+    def fill(self, conn, key: str) -> Dict[str, int]:
+        """
+        Returns the cache of one database holding all texts of the table, read once.
+
+        Args:
+            conn (sqlalchemy connection): the database connection
+            key (str): the cache key of the database
+
+        Returns:
+            Dict[str, int]: the text -> id mapping of the whole table
+        """
+        text_ids = self.cached_ids(conn, key)
+        if key not in self.complete:
+            text_ids.update(conn.execute(select(self.text_col, self.model.id)).tuples().all())
+            self.complete.add(key)
+        return text_ids
+
+    def lookup(self, conn, text_ids: Dict[str, int], texts: List[str]):
+        """
+        Adds the ids of the texts that are stored in the table to text_ids.
+        The texts are passed as one json parameter and unpacked by sqlite, which avoids
+        binding one parameter per text and the limit on the number of parameters.
+        """
+        requested = func.json_each(json.dumps(texts)).table_valued("value")
+        text_ids.update(
+            conn.execute(
+                select(self.text_col, self.model.id).where(
+                    self.text_col.in_(select(requested.c.value))
+                )
+            ).tuples().all()
+        )
+
+    def resolve(self, db_engine, texts: Iterable[str], insert_missing: bool = True) -> Dict[str, int]:
+        """
+        Looks up the ids of texts and inserts the texts that do not exist yet.
+        Texts that are not cached are resolved with one lookup query and one bulk insert of
+        the missing ones, all on a single connection.
+
+        Args:
+            db_engine (sqlalchemy engine): the database engine
+            texts (Iterable[str]): the texts
+            insert_missing (bool, optional): whether to insert missing texts, otherwise they are
+                left out of the result. Defaults to True.
+
+        Returns:
+            Dict[str, int]: a dictionary with the texts as keys and their ids as values
+        """
+        texts = list(dict.fromkeys(texts))
+        key = str(db_engine.url)
+        with db_engine.connect() as conn:
+            text_ids = self.cached_ids(conn, key)
+            missing = [text for text in texts if text not in text_ids]
+            if len(missing) > 0:
+                self.lookup(conn, text_ids, missing)
+                to_insert = [text for text in missing if text not in text_ids]
+                if len(to_insert) > 0 and insert_missing:
+                    conn.execute(
+                        insert(self.model).on_conflict_do_nothing(
+                            index_elements=[self.text_col_name]
+                        ),
+                        [self.new_row(text) for text in to_insert],
+                    )
+                    conn.commit()
+                    self.lookup(conn, text_ids, to_insert)
+                    self.versions[key] = self.table_version(conn)
+                    # other connections may have inserted texts meanwhile
+                    self.complete.discard(key)
+        return {text: text_ids[text] for text in texts if text in text_ids}
+
+
+detail_type_cache = internCache(
+    TransactionDetailType, "label", new_row=lambda label: {"label": label, "description": label}
+)
+# the values can be as many as the details, only the recently used ones are kept
+detail_value_cache = internCache(
+    DetailValue, "value", new_row=lambda value: {"value": value}, max_size=1000000
+)
+
+
+def invalidate_detail_type_cache(db_engine=None):
+    """
+    Drops the cached labels and values of one database, or of all databases.
+
+    Args:
+        db_engine (sqlalchemy engine, optional): the database engine. Defaults to None (all databases).
+    """
+    detail_type_cache.invalidate(db_engine)
+    detail_value_cache.invalidate(db_engine)
+
+
+def resolve_detail_types(db_engine, labels: List[str]) -> Dict[str, int]:
+    """
+    Looks up the ids of detail type labels and inserts the labels that do not exist yet.
+
+    Args:
+        db_engine (sqlalchemy engine): the database engine
+        labels (List[str]): the labels, i.e. the csv columns stored as details
+
+    Returns:
+        Dict[str, int]: a dictionary with the labels as keys and their ids as values
+    """
+    return detail_type_cache.resolve(db_engine, labels)
+
+
+def resolve_detail_values(
+    db_engine, values: Iterable[str], insert_missing: bool = True
+) -> Dict[str, int]:
+    """
+    Looks up the ids of detail values and inserts the values that do not exist yet.
+
+    Args:
+        db_engine (sqlalchemy engine): the database engine
+        values (Iterable[str]): the detail texts
+        insert_missing (bool, optional): whether to insert missing values, otherwise they are
+            left out of the result. Defaults to True.
+
+    Returns:
+        Dict[str, int]: a dictionary with the values as keys and their ids as values
+    """
+    return detail_value_cache.resolve(db_engine, values, insert_missing=insert_missing)
+
+
+def detail_type_labels(db_engine) -> Dict[int, str]:
+    """
+    The id -> label mapping of all detail types, e.g. for the summaries.
+
+    Args:
+        db_engine (sqlalchemy engine): the database engine
+
+    Returns:
+        Dict[int, str]: a dictionary with the ids as keys and the labels as values
+    """
+    with db_engine.connect() as conn:
+        label_ids = detail_type_cache.fill(conn, str(db_engine.url))
+    return {db_id: label for label, db_id in label_ids.items()}
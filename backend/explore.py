@@ -1,7 +1,96 @@
 import streamlit as st
-from summarize_csv import pd_read_csv_file
+from typing import Optional, Tuple
+
+from db import engine
+from data_model import TransactionType
+from detail_types import detail_type_labels
+from dashboard_data import (
+    transactionFilter,
+    data_version,
+    date_bounds,
+    count_transactions,
+    transactions_page,
+    amount_series,
+)
+
+PAGE_SIZE = 100
+MAX_CHART_POINTS = 200
+
+# the cached queries take the data version as first argument, so an import or a recategorize
+# invalidates them
+
+
+@st.cache_data(max_entries=8)
+def cached_bounds(version: Tuple[Optional[int], int]):
+    return date_bounds(engine)
+
+
+@st.cache_data(max_entries=8)
+def cached_labels(version: Tuple[Optional[int], int]):
+    return sorted(detail_type_labels(engine).values())
+
+
+@st.cache_data(max_entries=64)
+def cached_count(version: Tuple[Optional[int], int], filter_key: tuple) -> int:
+    return count_transactions(engine, transactionFilter(*filter_key_values(filter_key)))
+
+
+@st.cache_data(max_entries=64)
+def cached_series(version: Tuple[Optional[int], int], filter_key: tuple):
+    return amount_series(
+        engine, transactionFilter(*filter_key_values(filter_key)), max_points=MAX_CHART_POINTS
+    )
+
+
+@st.cache_data(max_entries=256)
+def cached_page(version: Tuple[Optional[int], int], filter_key: tuple, page: int):
+    return transactions_page(
+        engine,
+        transactionFilter(*filter_key_values(filter_key)),
+        offset=page * PAGE_SIZE,
+        limit=PAGE_SIZE,
+    )
+
+
+def filter_key_values(filter_key: tuple) -> tuple:
+    date_from, date_to, tr_type, label, text = filter_key
+    return date_from, date_to, None if tr_type is None else TransactionType(tr_type), label, text
+
 
 st.title("Siggi and Lisa's finances")
 
-df = pd_read_csv_file("20230414-101179311-umsatz.CSV")
-st.write(df)
\ No newline at end of file
+version = data_version(engine)
+first_day, last_day = cached_bounds(version)
+if first_day is None:
+    st.write("No transactions imported yet.")
+    st.stop()
+
+with st.sidebar:
+    dates = st.date_input(
+        "Booking date", value=(first_day, last_day), min_value=first_day, max_value=last_day
+    )
+    tr_type = st.selectbox("Type", ["all"] + [tr_type.value for tr_type in TransactionType])
+    label = st.selectbox("Detail", ["any"] + cached_labels(version))
+    text = st.text_input("Detail contains")
+
+# the date input returns a single date while the range is being picked
+date_from, date_to = dates if len(dates) == 2 else (dates[0], dates[0])
+filters = transactionFilter(
+    date_from=date_from,
+    date_to=date_to,
+    tr_type=None if tr_type == "all" else TransactionType(tr_type),
+    label=None if label == "any" else label,
+    text=text or None,
+)
+filter_key = filters.key()
+
+series = cached_series(version, filter_key)
+if series.height > 0:
+    st.line_chart(
+        series.pivot(on="tr_type", index="bucket", values="amount").sort("bucket"), x="bucket"
+    )
+
+total = cached_count(version, filter_key)
+pages = max((total + PAGE_SIZE - 1) // PAGE_SIZE, 1)
+page = st.number_input(f"Page (of {pages}, {total} transactions)", min_value=1, max_value=pages, value=1)
+st.dataframe(cached_page(version, filter_key, page - 1), hide_index=True)
@@ -0,0 +1,91 @@
+from typing import List
+import hashlib
+import polars as pl
+
+from column_mapping import columnMapping, MappedCols
+
+# unit separator, cannot show up in the csv text fields
+KEY_SEPARATOR = "\x1f"
+# rows hashed per slice in sha1_hex
+HASH_CHUNK_ROWS = 65536
+
+
+def fingerprint_key(column_mapping: columnMapping, columns: List[str]) -> pl.Expr:
+    """
+    Builds the canonical text that a transaction fingerprint is computed from:
+    booking date, value date, amount in cents, transaction type and the unicity columns,
+    in that order. Missing or empty unicity values all become the empty string so that a
+    csv row and a stored transaction without that detail give the same key.
+
+    Args:
+        column_mapping (columnMapping): the column mapping holding the unicity columns
+        columns (List[str]): the columns of the frame the expression is evaluated on
+
+    Returns:
+        pl.Expr: a string expression with the canonical key
+    """
+    unicity_parts = [
+        pl.col(col).cast(pl.Utf8).fill_null("")
+        if col in columns
+        else pl.lit("")
+        for col in column_mapping.unicity_cols
+    ]
+    return pl.concat_str(
+        [
+            pl.col(MappedCols.booking_date_col.value).dt.strftime("%Y-%m-%d"),
+            pl.col(MappedCols.value_date_col.value).dt.strftime("%Y-%m-%d"),
+            pl.col(MappedCols.amount_col.value).cast(pl.Int64).cast(pl.Utf8),
+            pl.col(MappedCols.tr_type_col.value).cast(pl.Utf8),
+            *unicity_parts,
+        ],
+        separator=KEY_SEPARATOR,
+    )
+
+
+def sha1_hex(keys: pl.Series) -> pl.Series:
+    """
+    Hashes every key with sha1. Polars' own hash is not stable between versions, and the
+    fingerprints are stored, so hashlib is used instead. The keys are encoded to utf-8 by
+    polars in one cast and hashed in slices of HASH_CHUNK_ROWS, so only one slice of python
+    objects exists at a time. hashlib has no batch interface, the sha1 calls themselves are
+    what is left: about 1 s per million keys (0.02 s for a 20k rows file), against 1.8 s
+    when every key was encoded from a python string.
+
+    Args:
+        keys (pl.Series): the canonical keys
+
+    Returns:
+        pl.Series: the hex digests
+    """
+    encoded = keys.cast(pl.Binary)
+    sha1 = hashlib.sha1
+    digests = [
+        pl.Series(
+            keys.name,
+            [sha1(key).hexdigest() for key in encoded.slice(start, HASH_CHUNK_ROWS)],
+            dtype=pl.Utf8,
+        )
+        for start in range(0, len(encoded), HASH_CHUNK_ROWS)
+    ]
+    if not digests:
+        return pl.Series(keys.name, [], dtype=pl.Utf8)
+    return pl.concat(digests)
+
+
+def add_fingerprint(df: pl.DataFrame, column_mapping: columnMapping) -> pl.DataFrame:
+    """
+    Adds the fingerprint column to a dataframe that has the mapped columns
+    (booking_date, value_date, amount and tr_type) and optionally the unicity columns.
+
+    Args:
+        df (pl.DataFrame): the dataframe
+        column_mapping (columnMapping): the column mapping holding the unicity columns
+
+    Returns:
+        pl.DataFrame: the dataframe with the fingerprint column added
+    """
+    return df.with_columns(
+        fingerprint_key(column_mapping=column_mapping, columns=df.columns)
+        .map_batches(sha1_hex, return_dtype=pl.Utf8)
+        .alias(MappedCols.fingerprint_col.value)
+    )
@@ -0,0 +1,327 @@
+from typing import Dict, Optional, Tuple
+import array
+import math
+import os
+import struct
+import typer
+import polars as pl
+from sqlalchemy import select, func
+
+from data_model import Transaction
+from revisions import FINGERPRINTS, read_revision
+
+app = typer.Typer()
+
+# the filter of a database file is stored next to it, e.g. our_db.db.fingerprints
+FILTER_SUFFIX = ".fingerprints"
+FALSE_POSITIVE_RATE = 0.01
+MIN_CAPACITY = 100000
+FILE_MAGIC = b"FPBLOOM2"
+# hashes, capacity, fingerprint count, fingerprints revision and highest transaction id of the
+# filter, then the words
+FILE_HEADER = struct.Struct("<8sQQqqq")
+# the fingerprints are sha1 hex digests, two slices of 15 hex digits are two independent
+# 60 bit hashes that fit into an Int64
+HASH_DIGITS = 15
+BIT_MASKS = pl.Series("mask", [1 << bit for bit in range(64)], dtype=pl.UInt64)
+
+
+class fingerprintFilter:
+    """
+    Bloom filter of the fingerprints of the stored transactions.
+    A fingerprint that is not in the filter is certainly not stored, one that is in the filter
+    probably is (FALSE_POSITIVE_RATE while the filter holds at most capacity fingerprints).
+    The bits are kept as UInt64 words in a polars series and are probed and set with
+    vectorized gathers and scatters, one call per batch of fingerprints.
+    """
+
+    def __init__(
+        self,
+        capacity: int,
+        hashes: Optional[int] = None,
+        words: Optional[pl.Series] = None,
+        count: int = 0,
+        version: Tuple[int, int] = (0, 0),
+    ):
+        """
+        Initialization
+
+        Args:
+            capacity (int): the number of fingerprints the filter is sized for
+            hashes (Optional[int], optional): the number of bits set per fingerprint.
+                Defaults to None (the optimum for FALSE_POSITIVE_RATE).
+            words (Optional[pl.Series], optional): the bits, e.g. read from a file.
+                Defaults to None (empty).
+            count (int, optional): the number of fingerprints in the filter. Defaults to 0.
+            version (Tuple[int, int], optional): the revision of the stored fingerprints and the
+                highest transaction id they were read up to, see stored_version.
+                Defaults to (0, 0).
+        """
+        self.capacity = capacity
+        if words is None:
+            bits = math.ceil(-capacity * math.log(FALSE_POSITIVE_RATE) / math.log(2) ** 2)
+            words = pl.Series("word", [0] * math.ceil(bits / 64), dtype=pl.UInt64)
+        self.words = words
+        self.bits = len(words) * 64
+        self.hashes = hashes or max(1, round(self.bits / capacity * math.log(2)))
+        self.count = count
+        self.version = version
+        # whether the filter changed since it was read or written
+        self.dirty = False
+
+    def positions(self, fingerprints: pl.Series) -> pl.DataFrame:
+        """
+        The bit positions of the fingerprints, by double hashing: h1 + i * h2 for i < hashes.
+
+        Args:
+            fingerprints (pl.Series): the fingerprints, not null
+
+        Returns:
+            pl.DataFrame: word and bit of every position, hashes rows per fingerprint in order
+        """
+        return (
+            pl.DataFrame({"fingerprint": fingerprints})
+            .select(
+                (
+                    pl.col("fingerprint").str.slice(0, HASH_DIGITS).str.to_integer(base=16)
+                    % self.bits
+                ).alias("h1"),
+                (
+                    pl.col("fingerprint")
+                    .str.slice(HASH_DIGITS, HASH_DIGITS)
+                    .str.to_integer(base=16)
+                    % self.bits
+                ).alias("h2"),
+                pl.int_ranges(0, self.hashes).alias("i"),
+            )
+            .explode("i")
+            .select(((pl.col("h1") + pl.col("i") * pl.col("h2")) % self.bits).alias("position"))
+            .select(
+                (pl.col("position") // 64).alias("word"),
+                (pl.col("position") % 64).alias("bit"),
+            )
+        )
+
+    def might_contain(self, fingerprints: pl.Series) -> pl.Series:
+        """
+        Probes the filter.
+
+        Args:
+            fingerprints (pl.Series): the fingerprints
+
+        Returns:
+            pl.Series: False where the fingerprint is certainly not stored, True where it
+                probably is or is null
+        """
+        present = fingerprints.drop_nulls()
+        if len(present) == 0:
+            return fingerprints.is_null()
+        positions = self.positions(present)
+        is_set = (
+            self.words.gather(positions["word"]) & BIT_MASKS.gather(positions["bit"])
+        ) != 0
+        found = is_set.reshape((len(present), self.hashes)).arr.all()
+        if len(present) == len(fingerprints):
+            return found
+        return fingerprints.is_null().scatter(fingerprints.is_not_null().arg_true(), found)
+
+    def add(self, fingerprints: pl.Series, max_id: int):
+        """
+        Adds the fingerprints of newly stored transactions.
+
+        Args:
+            fingerprints (pl.Series): the fingerprints, nulls are left out
+            max_id (int): the highest id of the new transactions
+        """
+        fingerprints = fingerprints.drop_nulls()
+        if len(fingerprints) == 0:
+            return
+        positions = self.positions(fingerprints)
+        positions = positions.with_columns(BIT_MASKS.gather(positions["bit"]))
+        changed = positions.group_by("word").agg(pl.col("mask").bitwise_or())
+        self.words.scatter(
+            changed["word"], self.words.gather(changed["word"]) | changed["mask"]
+        )
+        revision, known_max_id = self.version
+        self.count += len(fingerprints)
+        self.version = (revision, max(known_max_id, max_id))
+        self.dirty = True
+
+    def write(self, file_path: str):
+        """
+        Writes the filter to file_path, replacing the file in one step.
+
+        Args:
+            file_path (str): the path of the filter file
+        """
+        tmp_path = f"{file_path}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(
+                FILE_HEADER.pack(
+                    FILE_MAGIC, self.hashes, self.capacity, self.count, *self.version
+                )
+            )
+            array.array("Q", self.words.to_list()).tofile(f)
+        os.replace(tmp_path, file_path)
+        self.dirty = False
+
+    @classmethod
+    def read(cls, file_path: str) -> Optional["fingerprintFilter"]:
+        """
+        Reads a filter written by write.
+
+        Args:
+            file_path (str): the path of the filter file
+
+        Returns:
+            Optional[fingerprintFilter]: the filter, None if the file is missing or not a filter
+        """
+        if not os.path.exists(file_path):
+            return None
+        with open(file_path, "rb") as f:
+            header = f.read(FILE_HEADER.size)
+            if len(header) < FILE_HEADER.size:
+                return None
+            magic, hashes, capacity, count, revision, max_id = FILE_HEADER.unpack(header)
+            data = f.read()
+        if magic != FILE_MAGIC or hashes == 0 or len(data) == 0 or len(data) % 8 != 0:
+            return None
+        words = array.array("Q")
+        words.frombytes(data)
+        return cls(
+            capacity=capacity,
+            hashes=hashes,
+            words=pl.Series("word", words, dtype=pl.UInt64),
+            count=count,
+            version=(revision, max_id),
+        )
+
+
+# the filter of each database, per database url
+fingerprint_filters: Dict[str, fingerprintFilter] = {}
+
+
+def filter_path(db_engine) -> Optional[str]:
+    """
+    The path of the filter file of a database.
+
+    Args:
+        db_engine (sqlalchemy engine): the database engine
+
+    Returns:
+        Optional[str]: the path, None for an in-memory database
+    """
+    database = db_engine.url.database
+    if database is None or database in ("", ":memory:"):
+        return None
+    return database + FILTER_SUFFIX
+
+
+def stored_version(db_engine) -> Tuple[int, int]:
+    """
+    A cheap version of the stored fingerprints: the revision of the changes to them that keep
+    the ids (see revisions), e.g. the backfill of a migration, and the highest transaction id,
+    read from the end of the primary key. A filter with another version is missing
+    fingerprints or holds deleted ones.
+
+    Args:
+        db_engine (sqlalchemy engine): the database engine
+
+    Returns:
+        Tuple[int, int]: the revision and the highest transaction id
+    """
+    with db_engine.connect() as conn:
+        max_id = conn.execute(select(func.max(Transaction.id))).scalar()
+        return read_revision(conn, FINGERPRINTS), max_id or 0
+
+
+def build_fingerprint_filter(db_engine, batch_size: int = 100000) -> fingerprintFilter:
+    """
+    Builds the filter from all stored fingerprints, sized for twice as many.
+
+    Args:
+        db_engine (sqlalchemy engine): the database engine
+        batch_size (int, optional): the number of fingerprints read at a time. Defaults to 100000.
+
+    Returns:
+        fingerprintFilter: the filter
+    """
+    version = stored_version(db_engine)
+    with db_engine.connect() as conn:
+        count = conn.execute(select(func.count(Transaction.fingerprint))).scalar()
+    fingerprint_filter = fingerprintFilter(capacity=max(MIN_CAPACITY, 2 * count))
+    stmt = select(Transaction.fingerprint).where(Transaction.fingerprint.is_not(None))
+    with db_engine.connect() as conn:
+        for batch in pl.read_database(
+            stmt, conn, iter_batches=True, batch_size=batch_size, schema_overrides={"fingerprint": pl.Utf8}
+        ):
+            fingerprint_filter.add(batch["fingerprint"], max_id=0)
+    fingerprint_filter.version = version
+    return fingerprint_filter
+
+
+def load_fingerprint_filter(db_engine) -> fingerprintFilter:
+    """
+    The filter of a database: the cached one or the one of the filter file if it is up to date
+    with the database, otherwise a rebuilt one. A filter that outgrew its capacity is rebuilt
+    larger.
+
+    Args:
+        db_engine (sqlalchemy engine): the database engine
+
+    Returns:
+        fingerprintFilter: the filter
+    """
+    key = str(db_engine.url)
+    version = stored_version(db_engine)
+    fingerprint_filter = fingerprint_filters.get(key)
+    file_path = filter_path(db_engine)
+    if (fingerprint_filter is None or fingerprint_filter.version != version) and file_path is not None:
+        fingerprint_filter = fingerprintFilter.read(file_path)
+    if (
+        fingerprint_filter is None
+        or fingerprint_filter.version != version
+        or fingerprint_filter.count > fingerprint_filter.capacity
+    ):
+        fingerprint_filter = build_fingerprint_filter(db_engine)
+        if file_path is not None:
+            fingerprint_filter.write(file_path)
+    fingerprint_filters[key] = fingerprint_filter
+    return fingerprint_filter
+
+
+def save_fingerprint_filter(db_engine, fingerprint_filter: fingerprintFilter):
+    """
+    Writes the filter next to the database if it changed, e.g. after an import.
+
+    Args:
+        db_engine (sqlalchemy engine): the database engine
+        fingerprint_filter (fingerprintFilter): the filter
+    """
+    file_path = filter_path(db_engine)
+    if file_path is not None and fingerprint_filter.dirty:
+        fingerprint_filter.write(file_path)
+
+
+@app.command()
+def rebuild_filter():
+    """
+    Rebuilds the fingerprint filter of the duplicate checks from the stored transactions.
+    It is rebuilt on its own when it does not match the database, e.g. after transactions
+    were deleted, this forces it, e.g. to resize it or after the file was damaged.
+    """
+    from db import engine
+
+    fingerprint_filter = build_fingerprint_filter(engine)
+    file_path = filter_path(engine)
+    if file_path is not None:
+        fingerprint_filter.write(file_path)
+    fingerprint_filters[str(engine.url)] = fingerprint_filter
+    print(
+        f"{fingerprint_filter.count} fingerprints, {fingerprint_filter.bits // 8} bytes, "
+        f"{fingerprint_filter.hashes} hashes, written to {file_path}"
+    )
+
+
+if __name__ == "__main__":
+    app()
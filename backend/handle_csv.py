@@ -1,15 +1,31 @@
-from typing import List, Tuple, Optional, Dict
+from typing import List, Optional, Dict, Iterator
 from datetime import datetime
+import json
+import os
+import time
 import polars as pl
-from sqlalchemy import select, insert, and_, or_, text
+from sqlalchemy import select, insert, and_
+from sqlalchemy import Table, Column, MetaData, Integer
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import aliased
 
 from data_model import (
     Transaction,
     TransactionDetail,
-    TransactionDetailType,
     TransactionType,
+    ImportWatermark,
+    DetailValue,
 )
-from column_mapping import columnMapping, MappedCols
+from column_mapping import columnMapping, MappedCols, umsatz_column_mapping
+from fingerprint import add_fingerprint
+from amounts import amount_cents
+from csv_stream import iter_csv_batches, read_csv_header
+from csv_cache import cached_frame
+from detail_types import resolve_detail_types, resolve_detail_values
+from monthly_summary import add_to_monthly_summary
+from categories import categoryRules, load_category_rules
+from fingerprint_filter import fingerprintFilter, load_fingerprint_filter, save_fingerprint_filter
+from import_stats import importStats
 
 
 class csvParams:
@@ -22,6 +38,110 @@ class csvParams:
         self.encoding = encoding
 
 
+def map_column_names(columns: List[str], column_mapping: columnMapping) -> List[str]:
+    """
+    Removes spaces from column names and removes case as well, and maps the names
+    of the columns that belong to the transaction itself.
+
+    Args:
+        columns (List[str]): the column names as they are in the csv
+        column_mapping (columnMapping): the column mapping
+
+    Returns:
+        List[str]: the cleaned and mapped column names
+    """
+    return [column_mapping.get_mapped_name(header) for header in columns]
+
+
+def normalize_frame(df: pl.DataFrame, column_mapping: columnMapping) -> pl.DataFrame:
+    """
+    Maps the columns for amount, booking_date and value_date according to column_mapping.
+    Cleans the column names so that they don't contain spaces and ensures that they are
+    lower case. Adds the fingerprint column used for duplicate detection.
+    The amounts are converted to positive integer cents, their sign goes to tr_type.
+
+    Args:
+        df (pl.DataFrame): the csv data as read from the file
+        column_mapping (columnMapping): the column mapping
+
+    Returns:
+        pl.DataFrame: a polars dataframe with the parsed data
+    """
+    df.columns = map_column_names(columns=df.columns, column_mapping=column_mapping)
+
+    # cast the mapped columns to their correct types and add the transaction_type column
+    amount = pl.col(MappedCols.amount_col.value)
+    df = df.with_columns(
+        pl.col(MappedCols.booking_date_col.value).str.strptime(
+            pl.Date, column_mapping.date_format_str
+        ),
+        pl.col(MappedCols.value_date_col.value).str.strptime(
+            pl.Date, column_mapping.date_format_str
+        ),
+        amount_cents(amount).alias("cents"),
+    )
+    invalid = df.filter(pl.col("cents").is_null() & amount.is_not_null())
+    if invalid.height > 0:
+        raise ValueError(
+            f"invalid amount {invalid[MappedCols.amount_col.value][0]!r} in {invalid.height} rows"
+        )
+    df = df.with_columns(
+        pl.when(pl.col("cents") < 0)
+        .then(pl.lit(TransactionType.debit.value))
+        .otherwise(pl.lit(TransactionType.credit.value))
+        .alias("tr_type"),
+        pl.col("cents").abs().alias(MappedCols.amount_col.value),
+    ).drop("cents")
+
+    return add_fingerprint(df=df, column_mapping=column_mapping)
+
+
+def read_csv_file(
+    file_path: str,
+    csv_params: csvParams,
+    column_mapping: columnMapping,
+    use_cache: bool = True,
+) -> pl.DataFrame:
+    """
+    Reads a CSV file and returns it as a Polars DataFrame, see normalize_frame.
+    All columns are read as strings, the same as in streaming mode.
+    Does not need the database, so it can run in a worker process.
+    The normalized frame is cached (see csv_cache), keyed by the file content and the parameters.
+
+    Args:
+        file_path (str): the file path to the csv to be read
+        csv_params (csvParams): the parameters needed to read the csv file
+        column_mapping (columnMapping): the column mapping
+        use_cache (bool, optional): whether to use the parsed csv cache. Defaults to True.
+
+    Returns:
+        pl.DataFrame: a polars dataframe with the parsed data
+    """
+
+    def parse() -> pl.DataFrame:
+        df = pl.read_csv(
+            file_path,
+            separator=csv_params.separator,
+            encoding=csv_params.encoding,
+            infer_schema_length=0,
+        )
+        return normalize_frame(df=df, column_mapping=column_mapping)
+
+    if not use_cache:
+        return parse()
+    return cached_frame(file_path, key_parts=("handle_csv", csv_params, column_mapping), loader=parse)
+
+
+def umsatz_csv_params() -> csvParams:
+    """
+    The csv parameters for the umsatz csv exports from our bank.
+
+    Returns:
+        csvParams: the csv parameters
+    """
+    return csvParams(separator=";", encoding="iso8859-1")
+
+
 class handleCSV:
     """
     A class that handles reading the csv and writing the result to the database
@@ -33,6 +153,9 @@ class handleCSV:
         csv_params: csvParams,
         column_mapping: columnMapping,
         db_engine,
+        streaming: bool = False,
+        df: Optional[pl.DataFrame] = None,
+        category_rules: Optional[categoryRules] = None,
     ):
         """
         Initialization
@@ -42,122 +165,167 @@ class handleCSV:
             csv_params (csvParams): a class that holds the parameters needed to read the csv file
             column_mapping (columnMapping): a class that holds the column mappings and takes care of the column name cleaning
             db_engine (sqlalchemy engine): the database engine used to save the data
+            streaming (bool, optional): if True the file is not loaded up front (self.df is None)
+                but read batch by batch during the import, keeping the memory use flat. Defaults to False.
+            df (Optional[pl.DataFrame], optional): the already parsed csv data, as returned by read_csv_file,
+                e.g. when the file was parsed in a worker process. Defaults to None.
+            category_rules (Optional[categoryRules], optional): the rules that set the category of the
+                new transactions. Defaults to None (the rules file, see load_category_rules).
         """
         self.file_path = file_path
         self.csv_params = csv_params
         self.column_mapping = column_mapping
         self.db_engine = db_engine
-        self.df = self.read_csv_file()
+        self.category_rules = category_rules if category_rules is not None else load_category_rules()
+        # the bloom filter of the stored fingerprints, loaded with the first duplicate check
+        self.fingerprints: Optional[fingerprintFilter] = None
+        # timings per stage and counters of the work done with this file, see import_stats
+        self.stats = importStats()
+        if df is None:
+            self.stats.count("bytes_read", os.path.getsize(self.file_path))
+        if streaming:
+            self.df = None
+            with self.stats.stage("parse"):
+                columns = self.map_column_names(
+                    read_csv_header(
+                        self.file_path,
+                        separator=self.csv_params.separator,
+                        encoding=self.csv_params.encoding,
+                    )
+                )
+        else:
+            if df is None:
+                with self.stats.stage("parse"):
+                    df = self.read_csv_file()
+            self.df = df
+            self.stats.count("rows_parsed", self.df.height)
+            columns = self.df.columns
         self.detail_cols = [
             header
-            for header in self.df.columns
+            for header in columns
             if header not in self.column_mapping.col_list
         ]
-        self.detail_mapping = self.sync_detail_types()
+        with self.stats.stage("sync_detail_types"), self.stats.watch(self.db_engine):
+            self.detail_mapping = self.sync_detail_types()
         self.rev_detail_mapping = {val:key for key, val in self.detail_mapping.items()}
 
+    def map_column_names(self, columns: List[str]) -> List[str]:
+        """
+        See map_column_names at module level.
+        """
+        return map_column_names(columns=columns, column_mapping=self.column_mapping)
+
     def read_csv_file(self) -> pl.DataFrame:
         """
-        Reads a CSV file and returns it as a Polars DataFrame.
-        Maps the columns for amount, booking_date and value_date according to column_mapping.
-        Cleans the column names so that they don't contain spaces and ensures that they are
-        lower case.
+        See read_csv_file at module level.
 
         Returns:
             pl.DataFrame: a polars dataframe with the parsed data
         """
-        df = pl.read_csv(
-            self.file_path,
-            separator=self.csv_params.separator,
-            encoding=self.csv_params.encoding,
+        return read_csv_file(
+            file_path=self.file_path,
+            csv_params=self.csv_params,
+            column_mapping=self.column_mapping,
         )
 
-        # Remove spaces from column names and remove case as well
-        df.columns = [
-            self.column_mapping.get_mapped_name(header) for header in df.columns
-        ]
+    def iter_batches(self, batch_size: int) -> Iterator[pl.DataFrame]:
+        """
+        Iterates over the data in batches. In streaming mode the batches are read from the file
+        and normalized one at a time (timed as the parse stage), otherwise they are slices of self.df.
 
-        # cast the mapped columns to their correct types and add the transaction_type column
-        df = (
-            df.with_columns(
-                pl.col(MappedCols.booking_date_col.value).str.strptime(
-                    pl.Date, self.column_mapping.date_format_str
-                ),
-                pl.col(MappedCols.value_date_col.value).str.strptime(
-                    pl.Date, self.column_mapping.date_format_str
-                ),
-                pl.col(MappedCols.amount_col.value)
-                .str.replace(",", ".")
-                .cast(pl.Float64),
-            )
-            .with_columns(
-                pl.when(pl.col(MappedCols.amount_col.value) < 0)
-                .then(TransactionType.debit.value)
-                .otherwise(TransactionType.credit.value)
-                .alias("tr_type")
-            )
-            .with_columns(
-                pl.when(pl.col(MappedCols.amount_col.value) < 0)
-                .then(pl.col(MappedCols.amount_col.value) * (-1))
-                .otherwise(pl.col(MappedCols.amount_col.value))
-            )
+        Args:
+            batch_size (int): the number of csv rows per batch
+
+        Yields:
+            Iterator[pl.DataFrame]: the normalized batches
+        """
+        if self.df is not None:
+            for offset in range(0, self.df.height, batch_size):
+                yield self.df.slice(offset, batch_size)
+            return
+        batches = iter_csv_batches(
+            self.file_path,
+            separator=self.csv_params.separator,
+            encoding=self.csv_params.encoding,
+            batch_size=batch_size,
         )
+        while True:
+            with self.stats.stage("parse"):
+                batch = next(batches, None)
+                if batch is not None:
+                    batch = self.normalize_frame(batch)
+            if batch is None:
+                return
+            self.stats.count("rows_parsed", batch.height)
+            yield batch
 
-        return df
+    def normalize_frame(self, df: pl.DataFrame) -> pl.DataFrame:
+        """
+        See normalize_frame at module level.
+        """
+        return normalize_frame(df=df, column_mapping=self.column_mapping)
 
     def sync_detail_types(self) -> dict:
         """
         Looks up all column names that are not mapped to transaction itself in TransactionDetailType.
         If found stores the id (needed for inserts later), if not found inserts it and retreives the
-        inserted id.
+        inserted id. The lookup goes through the process wide cache of detail_types, so only the
+        columns not seen before cost a query and all of them are resolved in one go.
 
         Returns:
             dict: a dictionary with keys as the column names and the id from the data base as the value
         """
+        return resolve_detail_types(self.db_engine, labels=self.detail_cols)
 
-        detail_mapping = {}
-        ins_stmt = insert(TransactionDetailType).returning(TransactionDetailType.id)
-        for one_col in self.detail_cols:
-            stmt = select(TransactionDetailType.id).where(
-                TransactionDetailType.label == one_col
-            )
+    def find_possible_duplicate(self, row: dict, legacy: bool = True, conn=None) -> List[int]:
+        """
+        Finds the stored transactions the row duplicates: the one with the same fingerprint
+        (unique), otherwise, with legacy, those stored without fingerprint that have the same
+        mapped and unicity columns (see find_transactions).
+
+        Args:
+            row (dict): one csv row from incoming data
+            legacy (bool, optional): whether there are stored transactions without fingerprint
+                to compare the columns with. Defaults to True.
+            conn (sqlalchemy connection, optional): the connection to look up on, e.g. the one
+                holding the uncommitted inserts of the batch. Defaults to None (a connection of
+                its own).
+
+        Returns:
+            List[int]: the ids of the duplicates
+        """
+        if conn is None:
             with self.db_engine.connect() as conn:
-                found_id = conn.execute(stmt).scalar_one_or_none()
-                if found_id is None:
-                    found_id = conn.execute(
-                        ins_stmt, [{"label": one_col, "description": one_col}]
-                    ).scalar_one_or_none()
-                    if found_id is not None:
-                        conn.commit()
-                detail_mapping[one_col] = found_id
-        return detail_mapping
-
-    def find_possible_duplicate(self, row):
-        found_trans = self.find_transactions(row=row)
-        return found_trans
-        # if len(found_trans) > 0:
-        #     found_trans_det = self.find_transaction_details(row=row, ids=found_trans)
-
-        #     if len(found_trans_det):
-        #         return list(found_trans_det.keys())
-        #     else:
-        #         return []
-
-    def find_transactions(self, row: dict) -> List[int]:
+                return self.find_possible_duplicate(row=row, legacy=legacy, conn=conn)
+        fingerprint = row.get(MappedCols.fingerprint_col.value)
+        if fingerprint is not None:
+            found_ids = conn.execute(
+                select(Transaction.id).where(Transaction.fingerprint == fingerprint)
+            ).scalars().all()
+            if len(found_ids) > 0 or not legacy:
+                return found_ids
+        return self.find_transactions(row=row, conn=conn)
+
+    def find_transactions(self, row: dict, conn=None) -> List[int]:
         """
         Counts current transactions that contain the same data as found in the row
 
         Args:
             row (dict): one csv row from incoming data
+            conn (sqlalchemy connection, optional): the connection to look up on. Defaults to
+                None (a connection of its own).
 
         Returns:
             List[int]: the list of ids matchin the incoming data
         """
+        if conn is None:
+            with self.db_engine.connect() as conn:
+                return self.find_transactions(row=row, conn=conn)
         my_booking_date = row[MappedCols.booking_date_col.value]
         my_value_date = row[MappedCols.value_date_col.value]
         stmt: select = select(Transaction.id).where(
             and_(
-                Transaction.amount == row[MappedCols.amount_col.value],
+                Transaction.amount_cents == row[MappedCols.amount_col.value],
                 Transaction.booking_date
                 == datetime(
                     my_booking_date.year, my_booking_date.month, my_booking_date.day
@@ -168,75 +336,613 @@ class handleCSV:
                 == TransactionType(row[MappedCols.tr_type_col.value]),
             )
         )
-        with self.db_engine.connect() as conn:
-            found_ids = conn.execute(stmt).scalars().all()
-            if found_ids is not None:
-                found_ids = self.find_transaction_details(row=row, ids=found_ids)
+        found_ids = conn.execute(stmt).scalars().all()
+        if found_ids is not None:
+            found_ids = self.find_transaction_details(row=row, ids=found_ids, conn=conn)
         return found_ids
 
-    def find_transaction_details(self, row: dict, ids: List[int]) -> List[int]:
+    def find_transaction_details(self, row: dict, ids: List[int], conn=None) -> List[int]:
         """
         Finds matching transaction details for matching transaction ids.
 
         Args:
             row (dict): one csv row from incoming data
             ids (List[int]): the list of transaction ids to search for
+            conn (sqlalchemy connection, optional): the connection to look up on. Defaults to
+                None (a connection of its own).
 
 
         Returns:
             List[int]: the lists of transaction detail ids matching the incoming data
         """
+        if conn is None:
+            with self.db_engine.connect() as conn:
+                return self.find_transaction_details(row=row, ids=ids, conn=conn)
         found_ids = []
         for oneid in ids:
-            stmt: select = select(TransactionDetail).where(
+            stmt: select = select(
+                TransactionDetail.transaction_detail_type_id, DetailValue.value.label("description")
+            ).join(DetailValue).where(
                 TransactionDetail.transaction_id == oneid
             )
             found_dict = {}
-            with self.db_engine.connect() as conn:
-                for one_found in conn.execute(stmt).all():
-                    rev_detail = self.rev_detail_mapping[
-                        one_found._mapping["transaction_detail_type_id"]
-                    ]
-                    if (
-                        rev_detail in self.column_mapping.unicity_cols
-                        and one_found._mapping["description"] == row[rev_detail]
-                    ):
-                        found_dict[rev_detail] = one_found._mapping["description"]
+            for one_found in conn.execute(stmt).all():
+                # details of types that are no longer detail columns, e.g. the mapped
+                # columns stored as details by old databases, are not compared
+                rev_detail = self.rev_detail_mapping.get(
+                    one_found._mapping["transaction_detail_type_id"]
+                )
+                if (
+                    rev_detail in self.column_mapping.unicity_cols
+                    and one_found._mapping["description"] == row[rev_detail]
+                ):
+                    found_dict[rev_detail] = one_found._mapping["description"]
             if len(found_dict) == len(self.column_mapping.unicity_cols):
                 found_ids.append(oneid)
 
         return found_ids
 
     def insert_data(self):
-        for row in self.df.rows(named=True):
-            duplicates = self.find_possible_duplicate(row)
-            if duplicates is not None and len(duplicates) != 0:
-                # possible duplicates found, deal with it
-                print(f"error found duplicates of row: {row}")
-            else:
-                # all good, lets instert some data
-                self.insert_one_row(row=row)
+        """
+        Inserts the data one row at a time, every batch of rows with its details and its share
+        of the monthly_summary table in one database transaction. The rows are looked up on
+        that transaction too, so a row repeating an earlier row of the batch is found. The
+        summary is rolled up once per batch from the inserted rows. The watermarks are moved
+        once all rows are committed, as in bulk_insert_data.
+        """
+        with self.stats.watch(self.db_engine):
+            fingerprints = self.fingerprint_filter()
+            has_unfingerprinted = self.has_unfingerprinted()
+            latest = None
+            for batch in self.iter_batches(batch_size=5000):
+                with self.stats.stage("categorize"):
+                    batch = self.category_rules.apply(batch)
+                with self.stats.stage("watermarks"):
+                    latest = self.latest_rows(
+                        batch if latest is None else pl.concat([latest, self.latest_rows(batch)])
+                    )
+                # rows that are certainly new skip the lookup, unless there are stored
+                # transactions the filter does not know, rows repeating an earlier row of the
+                # batch are checked since the filter only learns about them when they are inserted
+                with self.stats.stage("find_duplicates"):
+                    if has_unfingerprinted:
+                        to_check = [True] * batch.height
+                    else:
+                        to_check = batch.select(
+                            fingerprints.might_contain(batch[MappedCols.fingerprint_col.value])
+                            | pl.col(MappedCols.fingerprint_col.value).is_first_distinct().not_()
+                        ).to_series().to_list()
+                # new detail values are committed on a connection of their own, so all of the
+                # batch are resolved before its transaction is opened
+                with self.stats.stage("insert"):
+                    value_ids = resolve_detail_values(
+                        self.db_engine, self.detail_values(batch.select(self.detail_cols))
+                    )
+                inserted = []
+                with self.db_engine.begin() as conn:
+                    for nr, (row, check) in enumerate(zip(batch.rows(named=True), to_check)):
+                        duplicates = None
+                        if check:
+                            with self.stats.stage("find_duplicates"):
+                                duplicates = self.find_possible_duplicate(
+                                    row, legacy=has_unfingerprinted, conn=conn
+                                )
+                            self.stats.count("checked_in_db")
+                        if duplicates is not None and len(duplicates) != 0:
+                            # possible duplicates found, deal with it
+                            print(f"error found duplicates of row: {row}")
+                            self.stats.count("duplicates")
+                        else:
+                            # all good, lets instert some data
+                            with self.stats.stage("insert"):
+                                self.insert_one_row(row=row, conn=conn, value_ids=value_ids)
+                            inserted.append(nr)
+                            self.stats.count("inserted")
+                    if len(inserted) > 0:
+                        with self.stats.stage("insert"):
+                            add_to_monthly_summary(
+                                conn=conn, df=batch[inserted], column_mapping=self.column_mapping
+                            )
+            if latest is not None and latest.height > 0:
+                with self.stats.stage("watermarks"), self.db_engine.begin() as conn:
+                    self.update_watermarks(conn=conn, df=latest)
+            with self.stats.stage("insert"):
+                save_fingerprint_filter(self.db_engine, fingerprints)
 
-    def insert_one_row(self, row: dict):
+    def fingerprint_filter(self) -> fingerprintFilter:
+        """
+        The bloom filter of the stored fingerprints, see fingerprint_filter. It is read (or rebuilt
+        if it does not match the database) once per file and kept up to date by the inserts.
+
+        Returns:
+            fingerprintFilter: the filter
+        """
+        if self.fingerprints is None:
+            with self.stats.stage("fingerprint_filter"):
+                self.fingerprints = load_fingerprint_filter(self.db_engine)
+        return self.fingerprints
+
+    def has_unfingerprinted(self) -> bool:
+        """
+        Whether there are stored transactions without fingerprint, i.e. imported before the
+        fingerprints and not backfilled. They are only found by comparing the columns.
+
+        Returns:
+            bool: True if there is at least one
+        """
+        with self.db_engine.connect() as conn:
+            return (
+                conn.execute(
+                    select(Transaction.id).where(Transaction.fingerprint.is_(None)).limit(1)
+                ).first()
+                is not None
+            )
+
+    def find_duplicates(self, df: pl.DataFrame) -> pl.Series:
+        """
+        Set based duplicate detection for a whole dataframe.
+        The fingerprints of df are loaded into a temporary staging table and all rows that already
+        exist in transaction_base are resolved with a single join on the unique fingerprint index
+        instead of one lookup per row. Rows that repeat an earlier row of df are flagged as well.
+
+        Only the rows whose fingerprint the bloom filter of the stored fingerprints probably
+        holds are looked up, if there are none the database is not queried at all.
+
+        Transactions stored before fingerprints existed are still matched on the mapped columns
+        and the unicity columns, as long as there are any left that have not been backfilled.
+        All rows are looked up then. The unicity columns are compared as detail value ids.
+
+        Args:
+            df (pl.DataFrame): the parsed csv data, as returned by read_csv_file
+
+        Returns:
+            pl.Series: a boolean series called is_duplicate with one value per row of df
+        """
+        unicity_cols = [
+            col for col in self.column_mapping.unicity_cols if col in self.detail_mapping
+        ]
+        base_cols = Transaction.__table__.c
+        staging = Table(
+            "staging_transaction",
+            MetaData(),
+            Column("row_nr", Integer, primary_key=True),
+            Column("fingerprint", base_cols.fingerprint.type),
+            Column("booking_date", base_cols.booking_date.type),
+            Column("value_date", base_cols.value_date.type),
+            Column("amount_cents", base_cols.amount_cents.type),
+            Column("tr_type", base_cols.tr_type.type),
+            *[Column(f"unicity_{nr}", Integer) for nr in range(len(unicity_cols))],
+            prefixes=["TEMPORARY"],
+        )
+        has_unfingerprinted = self.has_unfingerprinted()
+        to_check = df.with_row_index("row_nr")
+        if not has_unfingerprinted:
+            to_check = to_check.filter(
+                self.fingerprint_filter().might_contain(df[MappedCols.fingerprint_col.value])
+            )
+        self.stats.count("checked_in_db", to_check.height)
+        # empty details are not stored (NULL), values that were never stored can not match (-1)
+        value_ids = resolve_detail_values(
+            self.db_engine, self.detail_values(to_check.select(unicity_cols)), insert_missing=False
+        )
+        staging_rows = to_check.select(
+            pl.col("row_nr").cast(pl.Int64),
+            pl.col(MappedCols.fingerprint_col.value).alias("fingerprint"),
+            pl.col(MappedCols.booking_date_col.value).alias("booking_date"),
+            pl.col(MappedCols.value_date_col.value).alias("value_date"),
+            pl.col(MappedCols.amount_col.value).alias("amount_cents"),
+            pl.col(MappedCols.tr_type_col.value).alias("tr_type"),
+            *[
+                pl.when(pl.col(col).cast(pl.Utf8) != "")
+                .then(
+                    pl.col(col)
+                    .cast(pl.Utf8)
+                    .replace_strict(value_ids, default=-1, return_dtype=pl.Int64)
+                )
+                .alias(f"unicity_{nr}")
+                for nr, col in enumerate(unicity_cols)
+            ],
+        ).rows(named=True)
+
+        fingerprint_stmt = select(staging.c.row_nr).join(
+            Transaction, Transaction.fingerprint == staging.c.fingerprint
+        )
+        legacy_stmt = (
+            select(staging.c.row_nr)
+            .distinct()
+            .join(
+                Transaction,
+                and_(
+                    Transaction.fingerprint.is_(None),
+                    Transaction.amount_cents == staging.c.amount_cents,
+                    Transaction.booking_date == staging.c.booking_date,
+                    Transaction.value_date == staging.c.value_date,
+                    Transaction.tr_type == staging.c.tr_type,
+                ),
+            )
+        )
+        for nr, col in enumerate(unicity_cols):
+            detail = aliased(TransactionDetail)
+            legacy_stmt = legacy_stmt.outerjoin(
+                detail,
+                and_(
+                    detail.transaction_id == Transaction.id,
+                    detail.transaction_detail_type_id == self.detail_mapping[col],
+                ),
+            ).where(detail.value_id.is_not_distinct_from(staging.c[f"unicity_{nr}"]))
+
+        found_rows = []
+        if len(staging_rows) > 0:
+            with self.db_engine.connect() as conn:
+                # the connection is pooled, a table left behind by a failed check would block this one
+                staging.drop(conn, checkfirst=True)
+                staging.create(conn)
+                try:
+                    conn.execute(insert(staging), staging_rows)
+                    found_rows = conn.execute(fingerprint_stmt).scalars().all()
+                    if has_unfingerprinted:
+                        found_rows += conn.execute(legacy_stmt).scalars().all()
+                finally:
+                    staging.drop(conn)
+                    conn.commit()
+
+        return df.select(
+            (
+                pl.int_range(pl.len()).is_in(found_rows)
+                | pl.col(MappedCols.fingerprint_col.value).is_first_distinct().not_()
+            ).alias("is_duplicate")
+        ).to_series()
+
+    def load_watermarks(self) -> pl.DataFrame:
+        """
+        Reads the import watermarks of all accounts.
+
+        Returns:
+            pl.DataFrame: account, watermark_date and watermark_fingerprints (list) per account
+        """
+        with self.db_engine.connect() as conn:
+            rows = conn.execute(
+                select(
+                    ImportWatermark.account,
+                    ImportWatermark.booking_date,
+                    ImportWatermark.fingerprints,
+                )
+            ).all()
+        return pl.DataFrame(
+            {
+                "account": [row.account for row in rows],
+                "watermark_date": [row.booking_date.date() for row in rows],
+                "watermark_fingerprints": [json.loads(row.fingerprints) for row in rows],
+            },
+            schema={
+                "account": pl.Utf8,
+                "watermark_date": pl.Date,
+                "watermark_fingerprints": pl.List(pl.Utf8),
+            },
+        )
+
+    def apply_watermarks(self, df: pl.DataFrame, watermarks: pl.DataFrame) -> pl.DataFrame:
+        """
+        Drops the rows that are behind the watermark of their account: rows booked before the
+        watermark date, and rows booked on the watermark date whose fingerprint is already known.
+        Rows without an account or of accounts without a watermark are all kept.
+
+        Args:
+            df (pl.DataFrame): the parsed csv data
+            watermarks (pl.DataFrame): the watermarks, as returned by load_watermarks
+
+        Returns:
+            pl.DataFrame: the rows of df that still need the duplicate check
+        """
+        account_col = self.column_mapping.account_col
+        if account_col is None or account_col not in df.columns or watermarks.height == 0:
+            return df
+        booking_date = pl.col(MappedCols.booking_date_col.value)
+        return (
+            df.join(watermarks, left_on=account_col, right_on="account", how="left")
+            .filter(
+                pl.col("watermark_date").is_null()
+                | (booking_date > pl.col("watermark_date"))
+                | (
+                    (booking_date == pl.col("watermark_date"))
+                    & ~pl.col("watermark_fingerprints").list.contains(
+                        pl.col(MappedCols.fingerprint_col.value)
+                    )
+                )
+            )
+            .select(df.columns)
+        )
+
+    def latest_rows(self, df: pl.DataFrame) -> pl.DataFrame:
+        """
+        The account, booking date and fingerprint of the rows of df booked on the latest date
+        of their account, all update_watermarks needs. Latest rows of several batches can be
+        concatenated and reduced again, so a whole file is tracked in little memory.
+
+        Args:
+            df (pl.DataFrame): csv rows, or latest rows
+
+        Returns:
+            pl.DataFrame: the latest rows, empty if df has no account column
+        """
+        account_col = self.column_mapping.account_col
+        booking_date = pl.col(MappedCols.booking_date_col.value)
+        columns = [account_col, MappedCols.booking_date_col.value, MappedCols.fingerprint_col.value]
+        if account_col is None or account_col not in df.columns:
+            return pl.DataFrame()
+        return (
+            df.select(columns)
+            .filter(pl.col(account_col).is_not_null())
+            .filter(booking_date == booking_date.max().over(account_col))
+        )
+
+    def update_watermarks(self, conn, df: pl.DataFrame):
+        """
+        Moves the watermarks of the accounts in df forward to the latest booking date in df.
+        Meant to run once all rows of df are committed, so a file that fails partway leaves
+        the watermarks where they were and its rows can be imported again.
+
+        Args:
+            conn (sqlalchemy connection): the connection holding the open database transaction
+            df (pl.DataFrame): csv rows (or their latest_rows) that are all stored in the database now
+        """
+        account_col = self.column_mapping.account_col
+        if account_col is None or account_col not in df.columns:
+            return
+        booking_date = pl.col(MappedCols.booking_date_col.value)
+        latest = (
+            self.latest_rows(df)
+            .group_by(account_col)
+            .agg(
+                booking_date.first(),
+                pl.col(MappedCols.fingerprint_col.value).unique().sort(),
+            )
+        )
+        if latest.height == 0:
+            return
+
+        current = {
+            row.account: row
+            for row in conn.execute(
+                select(ImportWatermark).where(
+                    ImportWatermark.account.in_(latest[account_col].to_list())
+                )
+            )
+        }
+        values = []
+        for account, new_date, fingerprints in latest.rows():
+            old = current.get(account)
+            if old is not None:
+                old_date = old.booking_date.date()
+                if old_date > new_date:
+                    continue
+                if old_date == new_date:
+                    fingerprints = sorted(set(fingerprints) | set(json.loads(old.fingerprints)))
+            values.append(
+                {
+                    "account": account,
+                    "booking_date": new_date,
+                    "fingerprints": json.dumps(fingerprints),
+                }
+            )
+        if len(values) > 0:
+            stmt = sqlite_insert(ImportWatermark)
+            conn.execute(
+                stmt.on_conflict_do_update(
+                    index_elements=[ImportWatermark.account],
+                    set_={
+                        "booking_date": stmt.excluded.booking_date,
+                        "fingerprints": stmt.excluded.fingerprints,
+                    },
+                ),
+                values,
+            )
+
+    def bulk_insert_data(
+        self,
+        batch_size: int = 5000,
+        use_watermarks: bool = True,
+        watermarks: Optional[pl.DataFrame] = None,
+    ) -> int:
+        """
+        Inserts the data in batches instead of one row at a time. Duplicates of every batch are
+        resolved with find_duplicates, then the new transactions and their details are written
+        with executemany inside a single database transaction, so there is one commit per batch
+        instead of one per inserted row. The monthly_summary table is updated in the same transaction.
+        In streaming mode only one batch is in memory at a time.
+
+        With use_watermarks, rows behind the import watermark of their account are dropped before
+        any database work (see apply_watermarks), so re-importing an overlapping statement only
+        costs time for the new rows. The watermarks are moved forward once all batches are
+        committed, since the statements are newest first. Turn it off to import statements older than what was imported before for an account.
+
+        The time per stage (parse, watermarks, find_duplicates, insert) and the counters
+        are added to self.stats.
+
+        Args:
+            batch_size (int, optional): the number of csv rows per database transaction. Defaults to 5000.
+            use_watermarks (bool, optional): whether to skip rows behind the watermarks. Defaults to True.
+            watermarks (Optional[pl.DataFrame], optional): the watermarks to filter with, e.g. one snapshot
+                shared by the files of a multi-file import. Defaults to None (read at the start).
+
+        Returns:
+            int: the number of inserted transactions
+        """
+        with self.stats.watch(self.db_engine):
+            return self._bulk_insert_data(
+                batch_size=batch_size, use_watermarks=use_watermarks, watermarks=watermarks
+            )
+
+    def _bulk_insert_data(
+        self, batch_size: int, use_watermarks: bool, watermarks: Optional[pl.DataFrame]
+    ) -> int:
+        start = time.perf_counter()
+        # read once, the watermarks moved by this import must not drop its own older rows
+        if not use_watermarks:
+            watermarks = None
+        elif watermarks is None:
+            with self.stats.stage("watermarks"):
+                watermarks = self.load_watermarks()
+        total = 0
+        behind_watermark = 0
+        duplicates = 0
+        inserted = 0
+        # the rows the watermarks move to, written when the whole file is committed
+        latest = None
+        for batch in self.iter_batches(batch_size=batch_size):
+            total += batch.height
+            if watermarks is not None:
+                with self.stats.stage("watermarks"):
+                    fresh = self.apply_watermarks(batch, watermarks)
+                    latest = self.latest_rows(
+                        fresh if latest is None else pl.concat([latest, self.latest_rows(fresh)])
+                    )
+                behind_watermark += batch.height - fresh.height
+                batch = fresh
+            if batch.height == 0:
+                continue
+            with self.stats.stage("find_duplicates"):
+                is_duplicate = self.find_duplicates(batch)
+            duplicates += is_duplicate.sum()
+            new_rows = batch.filter(~is_duplicate)
+            if new_rows.height == 0:
+                continue
+            with self.stats.stage("categorize"):
+                new_rows = self.category_rules.apply(new_rows)
+            # includes the value lookups, the summary and watermark updates and the commit
+            with self.stats.stage("insert"):
+                value_ids = resolve_detail_values(
+                    self.db_engine, self.detail_values(new_rows.select(self.detail_cols))
+                )
+            with self.stats.stage("insert"), self.db_engine.begin() as conn:
+                inserted += self.insert_batch(
+                    conn=conn, rows=new_rows.rows(named=True), value_ids=value_ids
+                )
+                add_to_monthly_summary(conn=conn, df=new_rows, column_mapping=self.column_mapping)
+        if latest is not None and latest.height > 0:
+            with self.stats.stage("watermarks"), self.db_engine.begin() as conn:
+                self.update_watermarks(conn=conn, df=latest)
+        if inserted > 0:
+            with self.stats.stage("insert"):
+                save_fingerprint_filter(self.db_engine, self.fingerprint_filter())
+
+        self.stats.count("behind_watermark", behind_watermark)
+        self.stats.count("duplicates", duplicates)
+        self.stats.count("inserted", inserted)
+        elapsed = time.perf_counter() - start
+        if behind_watermark > 0:
+            print(f"skipped {behind_watermark} rows behind the import watermarks")
+        if duplicates > 0:
+            print(f"skipped {duplicates} duplicate rows")
+        print(
+            f"inserted {inserted} of {total} rows in {elapsed:.2f}s "
+            f"({total / max(elapsed, 1e-9):.0f} rows/s)"
+        )
+        return inserted
+
+    def detail_values(self, df: pl.DataFrame) -> List[str]:
+        """
+        The distinct non empty texts of the columns of df, e.g. to resolve their detail value ids.
+
+        Args:
+            df (pl.DataFrame): the detail columns
+
+        Returns:
+            List[str]: the texts
+        """
+        if df.width == 0:
+            return []
+        values = pl.concat([df.get_column(col).cast(pl.Utf8) for col in df.columns]).unique()
+        return values.filter(values.is_not_null() & (values != "")).to_list()
+
+    def insert_batch(self, conn, rows: List[dict], value_ids: Dict[str, int]) -> int:
+        """
+        Insert a batch of rows and their details using the given connection.
+        Committing is left to the caller, so the detail values have to be resolved before.
+
+        Args:
+            conn (sqlalchemy connection): the connection holding the open database transaction
+            rows (List[dict]): the csv rows to insert
+            value_ids (Dict[str, int]): the detail value ids of the detail texts of rows
+
+        Returns:
+            int: the number of inserted transactions
+        """
+        # sort_by_parameter_order would make sqlalchemy insert one row at a time on sqlite,
+        # the rows of a batch have distinct fingerprints, so the ids are matched on those
+        returned = conn.execute(
+            insert(Transaction).returning(Transaction.fingerprint, Transaction.id),
+            [
+                {
+                    "booking_date": row[MappedCols.booking_date_col.value],
+                    "value_date": row[MappedCols.value_date_col.value],
+                    "amount_cents": row[MappedCols.amount_col.value],
+                    "tr_type": row[MappedCols.tr_type_col.value],
+                    "fingerprint": row[MappedCols.fingerprint_col.value],
+                    "category": row.get(MappedCols.category_col.value),
+                }
+                for row in rows
+            ],
+        ).all()
+        ids_by_fingerprint = dict(returned)
+        trans_ids = [ids_by_fingerprint[row[MappedCols.fingerprint_col.value]] for row in rows]
+        self.fingerprint_filter().add(pl.Series(list(ids_by_fingerprint)), max_id=max(trans_ids))
+
+        details = [
+            {
+                "transaction_id": transaction_id,
+                "transaction_detail_type_id": db_id,
+                "value_id": value_ids[row[detail]],
+            }
+            for transaction_id, row in zip(trans_ids, rows)
+            for detail, db_id in self.detail_mapping.items()
+            if row[detail]
+        ]
+        if len(details) > 0:
+            conn.execute(insert(TransactionDetail), details)
+        return len(trans_ids)
+
+    def insert_one_row(self, row: dict, conn=None, value_ids: Optional[Dict[str, int]] = None):
         """
         Insert one row
 
         Args:
             row (dict): one row from the csv
+            conn (sqlalchemy connection, optional): the connection holding the open database
+                transaction, committing is left to the caller. Defaults to None (a transaction
+                of its own).
+            value_ids (Dict[str, int], optional): the ids of the detail values of the row,
+                resolved by the caller. Defaults to None (resolved here).
         """
+        if conn is None:
+            with self.db_engine.begin() as conn:
+                return self.insert_one_row(row=row, conn=conn, value_ids=value_ids)
+        if value_ids is None:
+            # resolved before the inserts, new values are committed on a connection of their own
+            value_ids = resolve_detail_values(
+                self.db_engine, [row[detail] for detail in self.detail_mapping if row[detail]]
+            )
         transaction_id = self.insert_transaction(
             booking_date=row[MappedCols.booking_date_col.value],
             value_date=row[MappedCols.value_date_col.value],
-            amount=row[MappedCols.amount_col.value],
+            amount_cents=row[MappedCols.amount_col.value],
             tr_type=row[MappedCols.tr_type_col.value],
+            fingerprint=row.get(MappedCols.fingerprint_col.value),
+            category=row.get(MappedCols.category_col.value),
+            conn=conn,
+        )
+        self.fingerprint_filter().add(
+            pl.Series([row.get(MappedCols.fingerprint_col.value)], dtype=pl.Utf8),
+            max_id=transaction_id,
         )
-        
         for detail, db_id in self.detail_mapping.items():
             if row[detail]:
                 detail_id = self.insert_trans_detail(
                     transaction_id=transaction_id,
                     transaction_detail_type_id=db_id,
                     description=row[detail],
+                    value_id=value_ids[row[detail]],
+                    conn=conn,
                 )
                 
 
@@ -244,8 +950,11 @@ class handleCSV:
         self,
         booking_date: datetime,
         value_date: datetime,
-        amount: float,
+        amount_cents: int,
         tr_type: TransactionType,
+        fingerprint: Optional[str] = None,
+        category: Optional[str] = None,
+        conn=None,
     ) -> int:
         """
         Insert one transation
@@ -253,30 +962,50 @@ class handleCSV:
         Args:
             booking_date (datetime): booking_date
             value_date (datetime): value_date
-            amount (float): amount
+            amount_cents (int): the amount in cents
             tr_type (TransactionType): tr_type
+            fingerprint (Optional[str], optional): fingerprint. Defaults to None.
+            category (Optional[str], optional): category. Defaults to None.
+            conn (sqlalchemy connection, optional): the connection holding the open database
+                transaction. Defaults to None (committed on its own).
 
         Returns:
             int: the new transaction id
         """
+        if conn is None:
+            with self.db_engine.begin() as conn:
+                return self.insert_transaction(
+                    booking_date=booking_date,
+                    value_date=value_date,
+                    amount_cents=amount_cents,
+                    tr_type=tr_type,
+                    fingerprint=fingerprint,
+                    category=category,
+                    conn=conn,
+                )
         stmt = insert(Transaction).returning(Transaction.id)
-        with self.db_engine.connect() as conn:
-            trans_id: int = conn.execute(
-                stmt,
-                [
-                    {
-                        "booking_date": booking_date,
-                        "value_date": value_date,
-                        "amount": amount,
-                        "tr_type": tr_type,
-                    }
-                ],
-            ).scalar_one()
-            conn.commit()
+        trans_id: int = conn.execute(
+            stmt,
+            [
+                {
+                    "booking_date": booking_date,
+                    "value_date": value_date,
+                    "amount_cents": amount_cents,
+                    "tr_type": tr_type,
+                    "fingerprint": fingerprint,
+                    "category": category,
+                }
+            ],
+        ).scalar_one()
         return trans_id
 
     def insert_trans_detail(
-        self, transaction_id: int, transaction_detail_type_id: int, description: str
+        self,
+        transaction_id: int,
+        transaction_detail_type_id: int,
+        description: str,
+        value_id: Optional[int] = None,
+        conn=None,
     ) -> int:
         """
         Insert one transaction detail
@@ -285,23 +1014,37 @@ class handleCSV:
             transaction_id (int): transaction_id
             transaction_detail_type_id (int): transaction_detail_type_id
             description (str): description
+            value_id (Optional[int], optional): the detail value id of description, if already
+                resolved. Defaults to None.
+            conn (sqlalchemy connection, optional): the connection holding the open database
+                transaction, value_id has to be resolved then. Defaults to None (committed on
+                its own).
 
         Returns:
             int: the transaction detail id
         """
+        if value_id is None:
+            value_id = resolve_detail_values(self.db_engine, [description])[description]
+        if conn is None:
+            with self.db_engine.begin() as conn:
+                return self.insert_trans_detail(
+                    transaction_id=transaction_id,
+                    transaction_detail_type_id=transaction_detail_type_id,
+                    description=description,
+                    value_id=value_id,
+                    conn=conn,
+                )
         stmt = insert(TransactionDetail).returning(TransactionDetail.id)
-        with self.db_engine.connect() as conn:
-            trans_detail_id = conn.execute(
-                stmt,
-                [
-                    {
-                        "transaction_id": transaction_id,
-                        "transaction_detail_type_id": transaction_detail_type_id,
-                        "description": description,
-                    }
-                ],
-            ).scalar_one()
-            conn.commit()
+        trans_detail_id = conn.execute(
+            stmt,
+            [
+                {
+                    "transaction_id": transaction_id,
+                    "transaction_detail_type_id": transaction_detail_type_id,
+                    "value_id": value_id,
+                }
+            ],
+        ).scalar_one()
         return trans_detail_id
 
     def get_trans_count(self):
@@ -317,21 +1060,9 @@ class handleCSV:
 if __name__ == "__main__":
     from db import engine
 
-    my_mapping = columnMapping(
-        amount_col="betrag",
-        booking_date_col="buchungstag",
-        value_date_col="valutadatum",
-        category_col=None,
-        date_format_str="%d.%m.%y",
-        unicity_cols=[
-            "Buchungstext".lower(),
-            "Verwendungszweck".lower(),
-            "Beguenstigter/Zahlungspflichtiger".lower(),
-            "Kontonummer/IBAN".lower(),
-        ],
-    )
+    my_mapping = umsatz_column_mapping()
 
-    my_csvparam = csvParams(separator=";", encoding="iso8859-1")
+    my_csvparam = umsatz_csv_params()
 
     mydata = handleCSV(
         file_path="20230414-101179311-umsatz.CSV",
@@ -341,5 +1072,5 @@ if __name__ == "__main__":
         db_engine=engine,
     )
     # print(mydata.df.head(5))
-    mydata.insert_data()
+    mydata.bulk_insert_data(batch_size=5000)
     print(mydata.get_trans_count())
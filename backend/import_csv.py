@@ -0,0 +1,179 @@
+from typing import List, Optional, Tuple, TYPE_CHECKING
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import glob
+import multiprocessing
+import os
+import time
+import typer
+
+from column_mapping import columnMapping, umsatz_column_mapping
+from import_stats import importStats, cprofile_capture
+
+# polars and sqlalchemy are imported by the commands, --help does not need them
+if TYPE_CHECKING:
+    import polars as pl
+    from handle_csv import csvParams
+
+app = typer.Typer()
+
+
+def find_csv_files(path: str, pattern: str) -> List[str]:
+    """
+    Lists the csv files to import.
+
+    Args:
+        path (str): a directory or a glob pattern
+        pattern (str): the glob pattern for the files inside a directory
+
+    Returns:
+        List[str]: the sorted file paths
+    """
+    if os.path.isdir(path):
+        path = os.path.join(path, pattern)
+    return sorted(glob.glob(path))
+
+
+def prepare_file(
+    file_path: str, csv_params: "csvParams", column_mapping: columnMapping
+) -> Tuple[str, "pl.DataFrame", float]:
+    """
+    Parses and normalizes one csv file. Runs in a worker process and does not touch the database.
+
+    Args:
+        file_path (str): the file path to the csv
+        csv_params (csvParams): the parameters needed to read the csv file
+        column_mapping (columnMapping): the column mapping
+
+    Returns:
+        Tuple[str, pl.DataFrame, float]: the file path, the parsed data and the parse time in seconds
+    """
+    from handle_csv import read_csv_file
+
+    start = time.perf_counter()
+    df = read_csv_file(file_path=file_path, csv_params=csv_params, column_mapping=column_mapping)
+    return file_path, df, time.perf_counter() - start
+
+
+def import_files(
+    file_paths: List[str],
+    db_engine,
+    csv_params: "csvParams",
+    column_mapping: columnMapping,
+    workers: Optional[int] = None,
+    batch_size: int = 5000,
+    use_watermarks: bool = True,
+    stats: Optional[importStats] = None,
+) -> Tuple[int, int]:
+    """
+    Imports several csv files. The files are parsed in parallel worker processes and handed to
+    this process, the single writer that owns the database connection, as soon as they are ready.
+    Every file is committed before the next one is deduplicated, so rows that show up in more
+    than one file are only inserted once. All files are filtered with the watermarks as they were
+    before the import, the files can be ready in any order.
+
+    Args:
+        file_paths (List[str]): the csv files
+        db_engine (sqlalchemy engine): the database engine used to save the data
+        csv_params (csvParams): the parameters needed to read the csv files
+        column_mapping (columnMapping): the column mapping
+        workers (Optional[int], optional): the number of worker processes. Defaults to the number of cpus.
+        batch_size (int, optional): the number of csv rows per database transaction. Defaults to 5000.
+        use_watermarks (bool, optional): whether to skip rows behind the import watermarks. Defaults to True.
+        stats (Optional[importStats], optional): collects the stats of all files, the parse stage
+            is the time spent in the workers. Defaults to None.
+
+    Returns:
+        Tuple[int, int]: the number of parsed rows and of inserted transactions
+    """
+    from handle_csv import handleCSV
+    from categories import load_category_rules
+
+    total_rows = 0
+    total_inserted = 0
+    watermarks = None
+    category_rules = load_category_rules()
+    # spawned, a forked child of a process that already ran polars can hang in its thread pool
+    with ProcessPoolExecutor(
+        max_workers=workers, mp_context=multiprocessing.get_context("spawn")
+    ) as executor:
+        futures = [
+            executor.submit(prepare_file, file_path, csv_params, column_mapping)
+            for file_path in file_paths
+        ]
+        for future in as_completed(futures):
+            file_path, df, parse_seconds = future.result()
+            print(
+                f"{file_path}: parsed {df.height} rows in {parse_seconds:.2f}s "
+                f"({df.height / max(parse_seconds, 1e-9):.0f} rows/s)"
+            )
+            handler = handleCSV(
+                file_path=file_path,
+                csv_params=csv_params,
+                column_mapping=column_mapping,
+                db_engine=db_engine,
+                df=df,
+                category_rules=category_rules,
+            )
+            handler.stats.add_time("parse", parse_seconds)
+            handler.stats.count("bytes_read", os.path.getsize(file_path))
+            if use_watermarks and watermarks is None:
+                watermarks = handler.load_watermarks()
+            total_inserted += handler.bulk_insert_data(
+                batch_size=batch_size, use_watermarks=use_watermarks, watermarks=watermarks
+            )
+            total_rows += df.height
+            if stats is not None:
+                stats.merge(handler.stats)
+    return total_rows, total_inserted
+
+
+@app.command()
+def import_csv(
+    path: str,
+    pattern: str = "*.[cC][sS][vV]",
+    workers: Optional[int] = None,
+    batch_size: int = 5000,
+    use_watermarks: bool = typer.Option(
+        True, help="skip rows older than what was imported before for their account"
+    ),
+    profile: bool = typer.Option(False, help="print the time per stage and the counters"),
+    profile_json: Optional[str] = typer.Option(None, help="write the stats to this json file"),
+    cprofile: Optional[str] = typer.Option(None, help="write a cProfile capture to this file"),
+):
+    """
+    Imports all csv files in a directory, or matching a glob pattern, into the database.
+    """
+    from db import engine
+    from handle_csv import umsatz_csv_params
+
+    file_paths = find_csv_files(path=path, pattern=pattern)
+    if len(file_paths) == 0:
+        print(f"no csv files found in {path}")
+        raise typer.Exit(code=1)
+
+    stats = importStats()
+    start = time.perf_counter()
+    with cprofile_capture(cprofile):
+        total_rows, total_inserted = import_files(
+            file_paths=file_paths,
+            db_engine=engine,
+            csv_params=umsatz_csv_params(),
+            column_mapping=umsatz_column_mapping(),
+            workers=workers,
+            batch_size=batch_size,
+            use_watermarks=use_watermarks,
+            stats=stats,
+        )
+    elapsed = time.perf_counter() - start
+    print(
+        f"imported {len(file_paths)} files: inserted {total_inserted} of {total_rows} rows "
+        f"in {elapsed:.2f}s ({total_rows / max(elapsed, 1e-9):.0f} rows/s)"
+    )
+    if profile:
+        print(stats.report())
+    if profile_json is not None:
+        stats.write_json(profile_json)
+
+
+if __name__ == "__main__":
+    app()
@@ -0,0 +1,174 @@
+from typing import Dict, Iterator, List, Optional
+from contextlib import contextmanager
+import cProfile
+import json
+import threading
+import time
+
+# the counters every import reports, in the order they are printed
+COUNTERS = [
+    "bytes_read",
+    "rows_parsed",
+    "behind_watermark",
+    "checked_in_db",
+    "duplicates",
+    "inserted",
+    "sql_statements",
+    "commits",
+]
+
+
+class importStats:
+    """
+    Class that collects the time spent per stage and the counters of an import.
+    The stage times are exclusive: while a stage runs inside another one, e.g.
+    fingerprint_filter inside find_duplicates, the outer stage is paused, so the stages
+    add up to the total.
+    """
+
+    def __init__(self):
+        self.stages: Dict[str, float] = {}
+        self.counters: Dict[str, int] = {name: 0 for name in COUNTERS}
+        # the running stages, innermost last, with the time they were (re)started
+        self.running: List[list] = []
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        """
+        Adds the time spent inside the with block to the stage, without the time of the
+        stages nested in it.
+
+        Args:
+            name (str): the name of the stage, e.g. parse or find_duplicates
+        """
+        start = time.perf_counter()
+        if len(self.running) > 0:
+            outer = self.running[-1]
+            self.add_time(outer[0], start - outer[1])
+        self.running.append([name, start])
+        try:
+            yield
+        finally:
+            end = time.perf_counter()
+            _, started = self.running.pop()
+            self.add_time(name, end - started)
+            if len(self.running) > 0:
+                self.running[-1][1] = end
+
+    def add_time(self, name: str, seconds: float):
+        """
+        Adds time measured elsewhere, e.g. the parsing in a worker process.
+
+        Args:
+            name (str): the name of the stage
+            seconds (float): the time in seconds
+        """
+        self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    def count(self, name: str, value: int = 1):
+        """
+        Increases a counter.
+
+        Args:
+            name (str): the name of the counter
+            value (int, optional): the increment. Defaults to 1.
+        """
+        self.counters[name] = self.counters.get(name, 0) + int(value)
+
+    @contextmanager
+    def watch(self, db_engine) -> Iterator[None]:
+        """
+        Counts the sql statements and commits issued through db_engine inside the with block.
+        The engine is shared, e.g. with the requests of the api, the import checks out its
+        connections from the pool as it goes, so only the connections used by the thread
+        that runs the import are counted.
+
+        Args:
+            db_engine (sqlalchemy engine): the database engine
+        """
+        from sqlalchemy import event
+
+        thread_id = threading.get_ident()
+
+        def on_execute(conn, cursor, statement, parameters, context, executemany):
+            if threading.get_ident() == thread_id:
+                self.count("sql_statements")
+
+        def on_commit(conn):
+            if threading.get_ident() == thread_id:
+                self.count("commits")
+
+        event.listen(db_engine, "before_cursor_execute", on_execute)
+        event.listen(db_engine, "commit", on_commit)
+        try:
+            yield
+        finally:
+            event.remove(db_engine, "before_cursor_execute", on_execute)
+            event.remove(db_engine, "commit", on_commit)
+
+    def merge(self, other: "importStats"):
+        """
+        Adds the stages and counters of another import, e.g. for a multi-file import.
+
+        Args:
+            other (importStats): the stats to add
+        """
+        for name, seconds in other.stages.items():
+            self.add_time(name, seconds)
+        for name, value in other.counters.items():
+            self.count(name, value)
+
+    def as_dict(self) -> dict:
+        """
+        Returns:
+            dict: the stage timings in seconds, the counters and the total time
+        """
+        return {
+            "stages": dict(self.stages),
+            "counters": dict(self.counters),
+            "total_seconds": sum(self.stages.values()),
+        }
+
+    def report(self) -> str:
+        """
+        Returns:
+            str: the stages with their share of the total time, followed by the counters
+        """
+        total = max(sum(self.stages.values()), 1e-9)
+        lines = [
+            f"{name:<20}{seconds:>10.3f}s {100 * seconds / total:>5.1f}%"
+            for name, seconds in sorted(self.stages.items(), key=lambda item: -item[1])
+        ]
+        lines += [f"{name:<20}{value:>10}" for name, value in self.counters.items()]
+        return "\n".join(lines)
+
+    def write_json(self, file_path: str):
+        """
+        Writes as_dict to a json file.
+
+        Args:
+            file_path (str): the json file path
+        """
+        with open(file_path, "w") as f:
+            json.dump(self.as_dict(), f, indent=2)
+
+
+@contextmanager
+def cprofile_capture(file_path: Optional[str]) -> Iterator[None]:
+    """
+    Runs the with block under cProfile and dumps the stats to file_path,
+    to be read with pstats or snakeviz. Does nothing if file_path is None.
+
+    Args:
+        file_path (Optional[str]): the file path for the profile
+    """
+    if file_path is None:
+        yield
+        return
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        profiler.dump_stats(file_path)
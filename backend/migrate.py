@@ -0,0 +1,338 @@
+from typing import Dict, List
+import typer
+import polars as pl
+from sqlalchemy import select, update, delete, inspect, text, bindparam
+
+from data_model import (
+    Base,
+    Transaction,
+    TransactionDetail,
+    TransactionDetailType,
+    MonthlySummary,
+    DetailValue,
+)
+from column_mapping import columnMapping, MappedCols, umsatz_column_mapping
+from fingerprint import add_fingerprint
+from monthly_summary import rebuild_monthly_summary
+from detail_types import invalidate_detail_type_cache
+from revisions import TRANSACTIONS, FINGERPRINTS, bump_revision
+
+app = typer.Typer()
+
+# joins the fingerprint of a stored transaction and the id of a duplicate of it, see
+# backfill_fingerprints, imports never produce such a fingerprint
+DUPLICATE_SEPARATOR = ":"
+# the mapped columns, databases from before the column mapping fix stored them as details too
+# (amount is the mapped amount column from before the cents)
+MAPPED_DETAIL_LABELS = [col.value for col in MappedCols] + ["amount"]
+
+
+def add_missing_columns(engine) -> List[str]:
+    """
+    Adds the columns of the data model that are missing in existing tables.
+    create_all only creates missing tables, so new columns need an ALTER TABLE.
+
+    Args:
+        engine (sqlalchemy engine): the database engine
+
+    Returns:
+        List[str]: the added columns as table.column
+    """
+    added = []
+    inspector = inspect(engine)
+    with engine.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            existing = {col["name"] for col in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing:
+                    continue
+                col_type = column.type.compile(dialect=engine.dialect)
+                conn.execute(
+                    text(f"ALTER TABLE {table.name} ADD COLUMN {column.name} {col_type}")
+                )
+                added.append(f"{table.name}.{column.name}")
+    return added
+
+
+def create_missing_indexes(engine):
+    """
+    Creates the indexes of the data model that are missing in existing tables.
+
+    Args:
+        engine (sqlalchemy engine): the database engine
+    """
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(engine, checkfirst=True)
+
+
+def encode_detail_values(engine) -> bool:
+    """
+    Moves the detail texts of a database from before the detail_value table into it.
+    Every distinct text is stored once and the details get its id, then the old
+    description column is dropped and the file is compacted.
+
+    Args:
+        engine (sqlalchemy engine): the database engine
+
+    Returns:
+        bool: whether the details were encoded, False if they already were
+    """
+    existing = {col["name"] for col in inspect(engine).get_columns(TransactionDetail.__tablename__)}
+    if "description" not in existing:
+        return False
+    with engine.begin() as conn:
+        conn.execute(
+            text(
+                "INSERT OR IGNORE INTO detail_value (value) "
+                "SELECT DISTINCT description FROM transaction_detail WHERE description IS NOT NULL"
+            )
+        )
+        conn.execute(
+            text(
+                "UPDATE transaction_detail SET value_id = "
+                "(SELECT id FROM detail_value WHERE value = transaction_detail.description) "
+                "WHERE value_id IS NULL"
+            )
+        )
+        conn.execute(text("DROP INDEX IF EXISTS ix_transaction_detail_type_description"))
+        conn.execute(text("ALTER TABLE transaction_detail DROP COLUMN description"))
+    # VACUUM cannot run inside a transaction
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        conn.execute(text("VACUUM"))
+    invalidate_detail_type_cache(engine)
+    return True
+
+
+def amounts_to_cents(engine) -> bool:
+    """
+    Converts the float amounts of a database from before the integer cents to cents.
+    The old amount columns are dropped, the monthly summary is emptied so that it gets
+    rebuilt from the converted amounts.
+
+    Args:
+        engine (sqlalchemy engine): the database engine
+
+    Returns:
+        bool: whether the amounts were converted, False if they already were
+    """
+    inspector = inspect(engine)
+    existing = {col["name"] for col in inspector.get_columns(Transaction.__tablename__)}
+    if "amount" not in existing:
+        return False
+    summary_cols = {col["name"] for col in inspector.get_columns(MonthlySummary.__tablename__)}
+    with engine.begin() as conn:
+        conn.execute(
+            text(
+                "UPDATE transaction_base SET amount_cents = CAST(ROUND(amount * 100) AS INTEGER) "
+                "WHERE amount_cents IS NULL"
+            )
+        )
+        conn.execute(text("DROP INDEX IF EXISTS ix_transaction_base_lookup"))
+        conn.execute(text("ALTER TABLE transaction_base DROP COLUMN amount"))
+        bump_revision(conn, TRANSACTIONS)
+        if "amount_sum" in summary_cols:
+            conn.execute(text("DELETE FROM monthly_summary"))
+            conn.execute(text("ALTER TABLE monthly_summary DROP COLUMN amount_sum"))
+    return True
+
+
+def remove_mapped_details(engine) -> int:
+    """
+    Deletes the details and detail types of the mapped columns (MAPPED_DETAIL_LABELS) that
+    old databases stored as details next to the transaction columns holding the same data.
+
+    Args:
+        engine (sqlalchemy engine): the database engine
+
+    Returns:
+        int: the number of deleted details
+    """
+    with engine.begin() as conn:
+        type_ids = conn.execute(
+            select(TransactionDetailType.id).where(
+                TransactionDetailType.label.in_(MAPPED_DETAIL_LABELS)
+            )
+        ).scalars().all()
+        if len(type_ids) == 0:
+            return 0
+        deleted = conn.execute(
+            delete(TransactionDetail).where(
+                TransactionDetail.transaction_detail_type_id.in_(type_ids)
+            )
+        ).rowcount
+        conn.execute(delete(TransactionDetailType).where(TransactionDetailType.id.in_(type_ids)))
+        bump_revision(conn, TRANSACTIONS)
+    invalidate_detail_type_cache(engine)
+    return deleted
+
+
+def backfill_fingerprints(
+    engine, column_mapping: columnMapping, batch_size: int = 5000
+) -> Dict[str, int]:
+    """
+    Computes the fingerprint for stored transactions that do not have one yet.
+    The transactions are read in batches of ids together with their unicity details and
+    the fingerprints are computed in the same way as for incoming csv data.
+    Transactions that turn out to be duplicates of an already fingerprinted transaction get
+    its fingerprint suffixed with their id (DUPLICATE_SEPARATOR), since the fingerprint is
+    unique. They are kept, but no transaction is left without fingerprint, which would send
+    every later import through the slow column comparison.
+
+    Args:
+        engine (sqlalchemy engine): the database engine
+        column_mapping (columnMapping): the column mapping used for the imports
+        batch_size (int, optional): the number of transactions per database transaction. Defaults to 5000.
+
+    Returns:
+        Dict[str, int]: the number of updated transactions and of the duplicates among them
+    """
+    with engine.connect() as conn:
+        type_labels = {
+            row.id: row.label
+            for row in conn.execute(
+                select(TransactionDetailType.id, TransactionDetailType.label).where(
+                    TransactionDetailType.label.in_(column_mapping.unicity_cols)
+                )
+            )
+        }
+
+    update_stmt = (
+        update(Transaction)
+        .where(Transaction.id == bindparam("b_id"))
+        .values(fingerprint=bindparam("b_fingerprint"))
+    )
+    counts = {"updated": 0, "duplicates": 0}
+    last_id = 0
+    while True:
+        with engine.begin() as conn:
+            base_rows = conn.execute(
+                select(
+                    Transaction.id,
+                    Transaction.booking_date,
+                    Transaction.value_date,
+                    Transaction.amount_cents,
+                    Transaction.tr_type,
+                )
+                .where(Transaction.fingerprint.is_(None), Transaction.id > last_id)
+                .order_by(Transaction.id)
+                .limit(batch_size)
+            ).all()
+            if len(base_rows) == 0:
+                break
+            last_id = base_rows[-1].id
+
+            df = pl.DataFrame(
+                [
+                    (row.id, row.booking_date, row.value_date, row.amount_cents, row.tr_type.value)
+                    for row in base_rows
+                ],
+                schema=[
+                    "id",
+                    MappedCols.booking_date_col.value,
+                    MappedCols.value_date_col.value,
+                    MappedCols.amount_col.value,
+                    MappedCols.tr_type_col.value,
+                ],
+                orient="row",
+            )
+            detail_rows = conn.execute(
+                select(
+                    TransactionDetail.transaction_id,
+                    TransactionDetail.transaction_detail_type_id,
+                    DetailValue.value,
+                )
+                .join(DetailValue, DetailValue.id == TransactionDetail.value_id)
+                .where(
+                    TransactionDetail.transaction_id.between(base_rows[0].id, last_id),
+                    TransactionDetail.transaction_detail_type_id.in_(list(type_labels)),
+                )
+            ).all()
+            if len(detail_rows) > 0:
+                details = pl.DataFrame(
+                    [tuple(row) for row in detail_rows],
+                    schema=["id", "type_id", "description"],
+                    orient="row",
+                ).with_columns(
+                    pl.col("type_id").replace_strict(type_labels, return_dtype=pl.Utf8).alias("label")
+                )
+                df = df.join(
+                    details.pivot(
+                        on="label", index="id", values="description", aggregate_function="first"
+                    ),
+                    on="id",
+                    how="left",
+                )
+            df = add_fingerprint(df=df, column_mapping=column_mapping)
+
+            taken = set(
+                conn.execute(
+                    select(Transaction.fingerprint).where(
+                        Transaction.fingerprint.in_(df[MappedCols.fingerprint_col.value].to_list())
+                    )
+                ).scalars()
+            )
+            fingerprint = pl.col(MappedCols.fingerprint_col.value)
+            is_duplicate = fingerprint.is_in(list(taken)) | fingerprint.is_first_distinct().not_()
+            updates = df.select(
+                pl.col("id").alias("b_id"),
+                pl.when(is_duplicate)
+                .then(
+                    pl.concat_str(
+                        [fingerprint, pl.col("id").cast(pl.Utf8)], separator=DUPLICATE_SEPARATOR
+                    )
+                )
+                .otherwise(fingerprint)
+                .alias("b_fingerprint"),
+                is_duplicate.alias("duplicate"),
+            )
+            conn.execute(update_stmt, updates.select("b_id", "b_fingerprint").rows(named=True))
+            # the fingerprint filters of the database are rebuilt
+            bump_revision(conn, FINGERPRINTS)
+            counts["updated"] += updates.height
+            counts["duplicates"] += updates["duplicate"].sum()
+    return counts
+
+
+@app.command()
+def upgrade(batch_size: int = 5000):
+    """
+    Brings an existing database up to date with the data model:
+    creates missing tables, columns and indexes, moves the detail texts into detail_value,
+    converts the amounts to cents, removes the details of mapped columns, backfills the
+    fingerprints and fills the monthly summary if it is still empty.
+    """
+    from db import engine
+
+    Base.metadata.create_all(engine)
+    for added in add_missing_columns(engine):
+        print(f"added column {added}")
+    if encode_detail_values(engine):
+        print("moved the detail texts into detail_value")
+    if amounts_to_cents(engine):
+        print("converted the amounts to cents")
+    removed = remove_mapped_details(engine)
+    if removed > 0:
+        print(f"removed {removed} details of mapped columns")
+    create_missing_indexes(engine)
+    counts = backfill_fingerprints(
+        engine, column_mapping=umsatz_column_mapping(), batch_size=batch_size
+    )
+    print(
+        f"fingerprinted {counts['updated']} transactions, "
+        f"{counts['duplicates']} of them duplicates of stored transactions"
+    )
+    with engine.connect() as conn:
+        summary_missing = (
+            conn.execute(select(MonthlySummary.month).limit(1)).first() is None
+            and conn.execute(select(Transaction.id).limit(1)).first() is not None
+        )
+    if summary_missing:
+        rebuild_monthly_summary(engine, column_mapping=umsatz_column_mapping())
+        print("rebuilt the monthly summary")
+
+
+if __name__ == "__main__":
+    app()
@@ -0,0 +1,234 @@
+from typing import Optional
+import enum
+import typer
+import polars as pl
+from sqlalchemy import select, delete, func, and_
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.orm import aliased
+
+from data_model import (
+    Transaction,
+    TransactionDetail,
+    TransactionDetailType,
+    TransactionType,
+    MonthlySummary,
+    DetailValue,
+)
+from column_mapping import columnMapping, MappedCols, umsatz_column_mapping
+from amounts import cents_to_units
+
+app = typer.Typer()
+
+
+class SummaryPeriod(str, enum.Enum):
+    month = "month"
+    year = "year"
+
+
+def rollup_frame(df: pl.DataFrame, column_mapping: columnMapping) -> pl.DataFrame:
+    """
+    Aggregates parsed csv rows the same way as the monthly_summary table.
+    Rows without account or category are summed up under the empty string.
+
+    Args:
+        df (pl.DataFrame): the parsed csv data, as returned by read_csv_file
+        column_mapping (columnMapping): the column mapping
+
+    Returns:
+        pl.DataFrame: month, tr_type, account, category, amount_cents_sum and tr_count
+    """
+    account_col = column_mapping.account_col
+    return df.group_by(
+        pl.col(MappedCols.booking_date_col.value).dt.strftime("%Y-%m").alias("month"),
+        pl.col(MappedCols.tr_type_col.value).alias("tr_type"),
+        (
+            pl.col(account_col).fill_null("")
+            if account_col in df.columns
+            else pl.lit("")
+        ).alias("account"),
+        (
+            pl.col(MappedCols.category_col.value).fill_null("")
+            if MappedCols.category_col.value in df.columns
+            else pl.lit("")
+        ).alias("category"),
+    ).agg(
+        pl.col(MappedCols.amount_col.value).sum().alias("amount_cents_sum"),
+        pl.len().alias("tr_count"),
+    )
+
+
+def add_to_monthly_summary(conn, df: pl.DataFrame, column_mapping: columnMapping):
+    """
+    Adds newly inserted rows to the monthly_summary table.
+    Meant to run in the same database transaction as the inserts of df.
+
+    Args:
+        conn (sqlalchemy connection): the connection holding the open database transaction
+        df (pl.DataFrame): the inserted csv rows
+        column_mapping (columnMapping): the column mapping
+    """
+    rollup = rollup_frame(df=df, column_mapping=column_mapping)
+    if rollup.height == 0:
+        return
+    stmt = insert(MonthlySummary)
+    conn.execute(
+        stmt.on_conflict_do_update(
+            index_elements=[
+                MonthlySummary.month,
+                MonthlySummary.tr_type,
+                MonthlySummary.account,
+                MonthlySummary.category,
+            ],
+            set_={
+                "amount_cents_sum": MonthlySummary.amount_cents_sum
+                + stmt.excluded.amount_cents_sum,
+                "tr_count": MonthlySummary.tr_count + stmt.excluded.tr_count,
+            },
+        ),
+        rollup.rows(named=True),
+    )
+
+
+def rebuild_monthly_summary(db_engine, column_mapping: columnMapping):
+    """
+    Recomputes the monthly_summary table from all stored transactions,
+    e.g. for transactions imported before the table existed or after a recategorize.
+
+    Args:
+        db_engine (sqlalchemy engine): the database engine
+        column_mapping (columnMapping): the column mapping used for the imports
+    """
+    account = aliased(TransactionDetail)
+    account_type_id = (
+        select(TransactionDetailType.id)
+        .where(TransactionDetailType.label == column_mapping.account_col)
+        .scalar_subquery()
+    )
+    month = func.strftime("%Y-%m", Transaction.booking_date)
+    account_value = func.coalesce(DetailValue.value, "")
+    category_value = func.coalesce(Transaction.category, "")
+    stmt = (
+        select(
+            month,
+            Transaction.tr_type,
+            account_value,
+            category_value,
+            func.sum(Transaction.amount_cents),
+            func.count(),
+        )
+        .select_from(Transaction)
+        .outerjoin(
+            account,
+            and_(
+                account.transaction_id == Transaction.id,
+                account.transaction_detail_type_id == account_type_id,
+            ),
+        )
+        .outerjoin(DetailValue, DetailValue.id == account.value_id)
+        .group_by(month, Transaction.tr_type, account_value, category_value)
+    )
+    with db_engine.begin() as conn:
+        conn.execute(delete(MonthlySummary))
+        conn.execute(
+            insert(MonthlySummary).from_select(
+                ["month", "tr_type", "account", "category", "amount_cents_sum", "tr_count"],
+                stmt,
+            )
+        )
+
+
+def read_monthly_summary(
+    db_engine,
+    period: SummaryPeriod = SummaryPeriod.month,
+    tr_type: Optional[TransactionType] = None,
+    by_account: bool = False,
+    by_category: bool = False,
+    offset: int = 0,
+    limit: Optional[int] = None,
+) -> pl.DataFrame:
+    """
+    Reads the totals per month or year from the monthly_summary table.
+
+    Args:
+        db_engine (sqlalchemy engine): the database engine
+        period (SummaryPeriod, optional): month or year. Defaults to month.
+        tr_type (Optional[TransactionType], optional): only this transaction type. Defaults to None (both).
+        by_account (bool, optional): split the totals per account. Defaults to False.
+        by_category (bool, optional): split the totals per category. Defaults to False.
+        offset (int, optional): skip this many rows, for paging. Defaults to 0.
+        limit (Optional[int], optional): return at most this many rows. Defaults to None (all).
+
+    Returns:
+        pl.DataFrame: period, tr_type, the optional account and category, amount and count.
+            The amounts are summed up in cents, amount is the sum in whole units.
+    """
+    if period == SummaryPeriod.year:
+        period_col = func.substr(MonthlySummary.month, 1, 4)
+    else:
+        period_col = MonthlySummary.month
+    group_cols = [period_col.label("period"), MonthlySummary.tr_type]
+    if by_account:
+        group_cols.append(MonthlySummary.account)
+    if by_category:
+        group_cols.append(MonthlySummary.category)
+
+    stmt = (
+        select(
+            *group_cols,
+            func.sum(MonthlySummary.amount_cents_sum).label("amount"),
+            func.sum(MonthlySummary.tr_count).label("count"),
+        )
+        .group_by(*group_cols)
+        .order_by(*group_cols)
+    )
+    if tr_type is not None:
+        stmt = stmt.where(MonthlySummary.tr_type == tr_type)
+    if offset > 0 or limit is not None:
+        stmt = stmt.offset(offset).limit(limit)
+
+    with db_engine.connect() as conn:
+        result = conn.execute(stmt)
+        columns = list(result.keys())
+        rows = [
+            tuple(val.value if isinstance(val, TransactionType) else val for val in row)
+            for row in result
+        ]
+    return pl.DataFrame(rows, schema=columns, orient="row").with_columns(
+        cents_to_units(pl.col("amount"))
+    )
+
+
+@app.command()
+def summarize(
+    period: SummaryPeriod = SummaryPeriod.month,
+    tr_type: Optional[TransactionType] = typer.Option(None, help="only debits or only credits"),
+    by_account: bool = False,
+    by_category: bool = False,
+    rebuild: bool = typer.Option(False, help="recompute the summary table from all transactions first"),
+    plot: bool = typer.Option(False, help="save a line plot to out.png"),
+):
+    """
+    Summarizes the imported transactions per month or year from the monthly_summary table,
+    without touching the csv files or the transaction tables.
+    """
+    from db import engine
+
+    if rebuild:
+        rebuild_monthly_summary(engine, column_mapping=umsatz_column_mapping())
+    summary = read_monthly_summary(
+        engine,
+        period=period,
+        tr_type=tr_type,
+        by_account=by_account,
+        by_category=by_category,
+    )
+    with pl.Config(tbl_rows=-1):
+        print(summary)
+    if plot:
+        from plots import save_lineplot
+
+        save_lineplot(summary, x="period", y="amount", hue="tr_type" if tr_type is None else None)
+
+
+if __name__ == "__main__":
+    app()
@@ -0,0 +1,386 @@
+from typing import List, Optional
+from datetime import timedelta
+import typer
+import polars as pl
+
+from column_mapping import columnMapping, MappedCols, umsatz_column_mapping
+from fingerprint import add_fingerprint
+from amounts import cents_to_units, units_to_cents
+
+app = typer.Typer()
+
+# the number of candidate pairs whose texts are compared at once
+SCORE_BATCH = 200000
+
+
+def tokens(text: pl.Expr) -> pl.Expr:
+    """
+    The distinct lower case words of a text, a missing text has no words.
+
+    Args:
+        text (pl.Expr): the texts
+
+    Returns:
+        pl.Expr: a list of the words
+    """
+    return text.cast(pl.Utf8).fill_null("").str.to_lowercase().str.extract_all(r"\w+").list.unique()
+
+
+def jaccard(left: pl.Expr, right: pl.Expr) -> pl.Expr:
+    """
+    The share of the words that two texts have in common. Null if both texts have no words.
+
+    Args:
+        left (pl.Expr): the words of the first texts
+        right (pl.Expr): the words of the second texts
+
+    Returns:
+        pl.Expr: the similarity between 0 and 1
+    """
+    union = left.list.set_union(right).list.len()
+    return pl.when(union > 0).then(left.list.set_intersection(right).list.len() / union)
+
+
+def blocking_frame(df: pl.DataFrame, column_mapping: columnMapping) -> pl.DataFrame:
+    """
+    The columns of parsed csv rows or stored transactions that near duplicates must agree on
+    (account, transaction type and amount), the dates and the key of the rows.
+
+    Args:
+        df (pl.DataFrame): the rows with a key column and the mapped columns
+        column_mapping (columnMapping): the column mapping
+
+    Returns:
+        pl.DataFrame: key, account, tr_type, amount_cents, booking_date, value_date and day
+    """
+    account_col = column_mapping.account_col
+    return df.select(
+        "key",
+        (pl.col(account_col).fill_null("") if account_col in df.columns else pl.lit("")).alias(
+            "account"
+        ),
+        pl.col(MappedCols.tr_type_col.value).cast(pl.Utf8).alias("tr_type"),
+        pl.col(MappedCols.amount_col.value).alias("amount_cents"),
+        pl.col(MappedCols.booking_date_col.value).alias("booking_date"),
+        pl.col(MappedCols.value_date_col.value).alias("value_date"),
+        pl.col(MappedCols.booking_date_col.value).cast(pl.Int32).alias("day"),
+    )
+
+
+def candidate_pairs(
+    incoming: pl.DataFrame, existing: pl.DataFrame, window_days: int, same_frame: bool = False
+) -> pl.DataFrame:
+    """
+    The pairs of rows with the same account, transaction type and amount whose booking and
+    value dates are at most window_days apart. The booking dates are cut into buckets of
+    window_days + 1 days and the existing rows are joined to their own and the neighbouring
+    buckets, so a windowed equi-join finds every pair without comparing all rows of an amount.
+
+    Args:
+        incoming (pl.DataFrame): the blocking frame of the new rows, see blocking_frame
+        existing (pl.DataFrame): the blocking frame of the stored rows
+        window_days (int): the maximum number of days between the dates of a pair
+        same_frame (bool, optional): incoming and existing are the same rows, every pair is
+            returned once. Defaults to False.
+
+    Returns:
+        pl.DataFrame: key, key_existing, the amount, the dates and the day differences
+    """
+    bucket_days = window_days + 1
+    block = ["account", "tr_type", "amount_cents", "bucket"]
+    bucket = pl.col("day") // bucket_days
+    left = incoming.with_columns(bucket.alias("bucket"))
+    right = existing.with_columns(
+        pl.concat_list(bucket - 1, bucket, bucket + 1).alias("bucket")
+    ).explode("bucket")
+    pairs = left.join(right, on=block, how="inner", suffix="_existing").with_columns(
+        (pl.col("booking_date_existing") - pl.col("booking_date"))
+        .dt.total_days()
+        .alias("booking_days"),
+        (pl.col("value_date_existing") - pl.col("value_date")).dt.total_days().alias("value_days"),
+    )
+    pairs = pairs.filter(
+        pl.col("booking_days").abs() <= window_days, pl.col("value_days").abs() <= window_days
+    )
+    if same_frame:
+        pairs = pairs.filter(pl.col("key") < pl.col("key_existing"))
+    return pairs.drop("bucket", "day", "day_existing")
+
+
+def score_pairs(
+    pairs: pl.DataFrame,
+    incoming_texts: pl.DataFrame,
+    existing_texts: pl.DataFrame,
+    text_cols: List[str],
+    min_score: float,
+    batch_size: int = SCORE_BATCH,
+) -> pl.DataFrame:
+    """
+    Scores the text similarity of the candidate pairs batch by batch, so only the words of
+    batch_size pairs are in memory at a time. Every text column is compared by the share of
+    common words, the score is the mean over the columns that have words on either side
+    (1 if none has).
+
+    Args:
+        pairs (pl.DataFrame): the candidate pairs, see candidate_pairs
+        incoming_texts (pl.DataFrame): key and the text columns of the new rows
+        existing_texts (pl.DataFrame): key and the text columns of the stored rows
+        text_cols (List[str]): the text columns to compare, e.g. the unicity columns
+        min_score (float): pairs with a lower score are left out
+        batch_size (int, optional): the number of pairs per batch. Defaults to SCORE_BATCH.
+
+    Returns:
+        pl.DataFrame: the pairs with the texts of both rows, a similarity per text column
+            and the score
+    """
+    # only the rows of candidate pairs are split into words
+    incoming_texts = incoming_texts.filter(pl.col("key").is_in(pairs["key"].unique().implode()))
+    existing_texts = existing_texts.filter(
+        pl.col("key").is_in(pairs["key_existing"].unique().implode())
+    )
+    incoming_words = incoming_texts.select(
+        "key", *[tokens(pl.col(col)).alias(f"{col}_words") for col in text_cols]
+    )
+    existing_words = existing_texts.select(
+        pl.col("key").alias("key_existing"),
+        *[tokens(pl.col(col)).alias(f"{col}_words_existing") for col in text_cols],
+    )
+    scored = []
+    # an empty batch still gives the columns of the report
+    for batch in pairs.iter_slices(batch_size) if pairs.height > 0 else [pairs]:
+        batch = (
+            batch.join(incoming_words, on="key", how="left")
+            .join(existing_words, on="key_existing", how="left")
+            .with_columns(
+                [
+                    jaccard(pl.col(f"{col}_words"), pl.col(f"{col}_words_existing")).alias(
+                        f"{col}_similarity"
+                    )
+                    for col in text_cols
+                ]
+            )
+            .with_columns(
+                pl.mean_horizontal([f"{col}_similarity" for col in text_cols])
+                .fill_null(1.0)
+                .alias("score")
+            )
+            .filter(pl.col("score") >= min_score)
+            .drop(
+                [f"{col}_words" for col in text_cols]
+                + [f"{col}_words_existing" for col in text_cols]
+            )
+        )
+        scored.append(batch)
+    return (
+        pl.concat(scored)
+        .join(incoming_texts, on="key", how="left")
+        .join(
+            existing_texts.rename({col: f"{col}_existing" for col in text_cols}),
+            left_on="key_existing",
+            right_on="key",
+            how="left",
+        )
+    )
+
+
+def find_near_duplicates(
+    incoming: pl.DataFrame,
+    existing: pl.DataFrame,
+    column_mapping: columnMapping,
+    window_days: int = 3,
+    min_score: float = 0.5,
+    same_frame: bool = False,
+    batch_size: int = SCORE_BATCH,
+) -> pl.DataFrame:
+    """
+    Finds rows that are probably the same transaction without being exact duplicates, e.g. the
+    same payment in two exports with a shifted value date or a reworded Verwendungszweck.
+    Candidates are blocked by account, transaction type, amount and a date window, then
+    their unicity columns are scored by text similarity. Exact duplicates (the same
+    fingerprint) are left to the imports.
+
+    Args:
+        incoming (pl.DataFrame): the new rows with a unique key column, the mapped columns,
+            the fingerprint and the unicity and account columns
+        existing (pl.DataFrame): the stored rows, with the same columns
+        column_mapping (columnMapping): the column mapping
+        window_days (int, optional): the maximum number of days between the booking dates
+            and between the value dates of a pair. Defaults to 3.
+        min_score (float, optional): the minimum text similarity of a pair. Defaults to 0.5.
+        same_frame (bool, optional): incoming and existing are the same rows. Defaults to False.
+        batch_size (int, optional): the number of pairs scored at once. Defaults to SCORE_BATCH.
+
+    Returns:
+        pl.DataFrame: the review report, one row per pair, best matches first
+    """
+    text_cols = column_mapping.unicity_cols
+    pairs = candidate_pairs(
+        blocking_frame(incoming, column_mapping),
+        blocking_frame(existing, column_mapping),
+        window_days=window_days,
+        same_frame=same_frame,
+    )
+    fingerprints = MappedCols.fingerprint_col.value
+    pairs = (
+        pairs.join(incoming.select("key", pl.col(fingerprints).alias("fp")), on="key", how="left")
+        .join(
+            existing.select(
+                pl.col("key").alias("key_existing"), pl.col(fingerprints).alias("fp_existing")
+            ),
+            on="key_existing",
+            how="left",
+        )
+        .filter(pl.col("fp") != pl.col("fp_existing"))
+        .drop("fp", "fp_existing")
+    )
+
+    def texts(df: pl.DataFrame) -> pl.DataFrame:
+        return df.select(
+            "key",
+            *[
+                pl.col(col).cast(pl.Utf8)
+                if col in df.columns
+                else pl.lit(None, dtype=pl.Utf8).alias(col)
+                for col in text_cols
+            ],
+        )
+
+    report = score_pairs(
+        pairs,
+        incoming_texts=texts(incoming),
+        existing_texts=texts(existing),
+        text_cols=text_cols,
+        min_score=min_score,
+        batch_size=batch_size,
+    )
+    return report.select(
+        "key",
+        "key_existing",
+        "score",
+        "account",
+        "tr_type",
+        cents_to_units(pl.col("amount_cents")).alias("amount"),
+        "booking_date",
+        "booking_date_existing",
+        "value_date",
+        "value_date_existing",
+        "booking_days",
+        "value_days",
+        *[
+            pl.col(name)
+            for col in text_cols
+            for name in (col, f"{col}_existing", f"{col}_similarity")
+        ],
+    ).sort(
+        ["score", pl.col("booking_days").abs(), "key", "key_existing"],
+        descending=[True, False, False, False],
+    )
+
+
+def stored_transactions(
+    db_engine, column_mapping: columnMapping, date_from=None, date_to=None
+) -> pl.DataFrame:
+    """
+    The stored transactions in the layout of parsed csv rows: the mapped columns with the
+    amounts in cents, the fingerprint and the unicity and account details, keyed by id.
+
+    Args:
+        db_engine (sqlalchemy engine): the database engine
+        column_mapping (columnMapping): the column mapping
+        date_from (Optional[date], optional): first booking date. Defaults to None.
+        date_to (Optional[date], optional): last booking date. Defaults to None.
+
+    Returns:
+        pl.DataFrame: the transactions
+    """
+    from detail_types import detail_type_labels
+    from transaction_frame import transaction_frame
+
+    wanted = [column_mapping.account_col, *column_mapping.unicity_cols]
+    labels = set(detail_type_labels(db_engine).values())
+    df = transaction_frame(
+        db_engine,
+        date_from=date_from,
+        date_to=date_to,
+        columns=["booking_date", "value_date", "amount", "tr_type"]
+        + [col for col in wanted if col in labels],
+    )
+    df = df.with_columns(
+        pl.col("id").alias("key"),
+        units_to_cents(pl.col("amount")).alias(MappedCols.amount_col.value),
+        *[pl.lit(None, dtype=pl.Utf8).alias(col) for col in wanted if col not in df.columns],
+    ).drop("amount")
+    return add_fingerprint(df=df, column_mapping=column_mapping)
+
+
+@app.command()
+def near_duplicates(
+    file_paths: Optional[List[str]] = typer.Argument(
+        None, help="csv files to check against the database, without any the database is checked"
+    ),
+    window_days: int = typer.Option(
+        3, min=0, help="maximum number of days between the dates of a pair"
+    ),
+    min_score: float = typer.Option(
+        0.5, min=0, max=1, help="minimum text similarity of the unicity columns"
+    ),
+    output: Optional[str] = typer.Option(None, help="write the full report to this csv file"),
+):
+    """
+    Reports probable duplicates that the exact duplicate detection misses: the same account,
+    type and amount within a few days and similar texts.
+    """
+    from db import engine
+    from handle_csv import read_csv_file, umsatz_csv_params
+
+    column_mapping = umsatz_column_mapping()
+    if file_paths:
+        incoming = pl.concat(
+            [
+                read_csv_file(
+                    file_path, csv_params=umsatz_csv_params(), column_mapping=column_mapping
+                ).with_columns(pl.lit(file_path).alias("file"))
+                for file_path in file_paths
+            ],
+            how="diagonal_relaxed",
+        ).with_row_index("key")
+        window = timedelta(days=window_days)
+        existing = stored_transactions(
+            engine,
+            column_mapping,
+            date_from=incoming[MappedCols.booking_date_col.value].min() - window,
+            date_to=incoming[MappedCols.booking_date_col.value].max() + window,
+        )
+        report = find_near_duplicates(
+            incoming.with_columns(pl.col("key").cast(pl.Int64)),
+            existing,
+            column_mapping,
+            window_days=window_days,
+            min_score=min_score,
+        )
+        report = (
+            incoming.select(pl.col("key").cast(pl.Int64), "file")
+            .join(report, on="key", how="right")
+            .rename({"key": "row", "key_existing": "id"})
+        )
+    else:
+        existing = stored_transactions(engine, column_mapping)
+        report = find_near_duplicates(
+            existing,
+            existing,
+            column_mapping,
+            window_days=window_days,
+            min_score=min_score,
+            same_frame=True,
+        ).rename({"key": "id", "key_existing": "id_existing"})
+
+    print(f"{report.height} probable duplicates")
+    with pl.Config(tbl_rows=20, tbl_cols=-1, fmt_str_lengths=40):
+        print(report.head(20).select(report.columns[:12]))
+    if output is not None:
+        report.write_csv(output)
+        print(f"wrote the report to {output}")
+
+
+if __name__ == "__main__":
+    app()
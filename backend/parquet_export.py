@@ -0,0 +1,188 @@
+from typing import Dict, List, Optional, Tuple
+from datetime import date, timedelta
+import json
+import os
+import re
+import shutil
+import typer
+import polars as pl
+from sqlalchemy import select, func
+
+from data_model import Transaction
+from detail_types import detail_type_labels
+from transaction_frame import transaction_frame
+
+app = typer.Typer()
+
+EXPORT_DIR = os.environ.get("SUMMARIZER_EXPORT_DIR", "export")
+# the high-water mark and the columns of the last export, written after its partitions
+STATE_FILE = "_export_state.json"
+# bump when the layout of the partitions changes, so the next export rewrites all of them
+EXPORT_VERSION = 1
+PARTITION_FILE = "data.parquet"
+PARTITION_PATTERN = re.compile(r"^month=\d{4}-\d{2}$")
+
+
+def partition_dir(directory: str, month: str) -> str:
+    """
+    The hive style directory of a month, e.g. export/month=2022-08.
+    """
+    return os.path.join(directory, f"month={month}")
+
+
+def month_range(month: str) -> Tuple[date, date]:
+    """
+    The first and the last day of a month given as YYYY-MM.
+    """
+    first = date.fromisoformat(f"{month}-01")
+    last = (first + timedelta(days=31)).replace(day=1) - timedelta(days=1)
+    return first, last
+
+
+def month_runs(months: List[str]) -> List[Tuple[date, date]]:
+    """
+    The date ranges covering the given months, consecutive months joined into one range.
+
+    Args:
+        months (List[str]): the months as YYYY-MM, sorted
+
+    Returns:
+        List[Tuple[date, date]]: the first and the last day of every run of months
+    """
+    runs: List[Tuple[date, date]] = []
+    for month in months:
+        first, last = month_range(month)
+        if len(runs) > 0 and runs[-1][1] + timedelta(days=1) == first:
+            runs[-1] = (runs[-1][0], last)
+        else:
+            runs.append((first, last))
+    return runs
+
+
+def read_state(directory: str) -> Optional[dict]:
+    """
+    The state of the last export into directory.
+
+    Args:
+        directory (str): the export directory
+
+    Returns:
+        Optional[dict]: max_id, columns and version, None if there was no export yet
+    """
+    path = os.path.join(directory, STATE_FILE)
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def write_state(directory: str, state: dict):
+    """
+    Writes the state of an export, replacing the old one in one step.
+
+    Args:
+        directory (str): the export directory
+        state (dict): max_id, columns and version
+    """
+    path = os.path.join(directory, STATE_FILE)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(state, f)
+    os.replace(tmp_path, path)
+
+
+def touched_months(db_engine, after_id: Optional[int]) -> List[str]:
+    """
+    The booking months of the transactions stored after the high-water mark.
+
+    Args:
+        db_engine (sqlalchemy engine): the database engine
+        after_id (Optional[int]): the highest transaction id of the last export, None for all
+
+    Returns:
+        List[str]: the months as YYYY-MM, sorted
+    """
+    month = func.strftime("%Y-%m", Transaction.booking_date)
+    stmt = select(month).distinct()
+    if after_id is not None:
+        stmt = stmt.where(Transaction.id > after_id)
+    with db_engine.connect() as conn:
+        return sorted(conn.execute(stmt).scalars().all())
+
+
+def write_partitions(db_engine, directory: str, full: bool = False) -> Dict[str, int]:
+    """
+    Exports the transactions with their details as columns (see transaction_frame) to one
+    zstd compressed Parquet file per booking month, in hive layout (month=YYYY-MM/data.parquet).
+    Only the months of the transactions stored since the last export, tracked by their highest
+    id, are read and rewritten, with one query per run of consecutive months. All months are rewritten on the first export, when the detail
+    labels changed (the partitions keep the same columns) or with full, which also removes the
+    partitions of months without transactions.
+
+    Changes to stored transactions do not move the high-water mark, e.g. a recategorize or
+    deleted transactions need a full export.
+
+    Args:
+        db_engine (sqlalchemy engine): the database engine
+        directory (str): the export directory
+        full (bool, optional): whether to rewrite all months. Defaults to False.
+
+    Returns:
+        Dict[str, int]: the number of rewritten partitions, of their transactions and the new
+            high-water mark
+    """
+    os.makedirs(directory, exist_ok=True)
+    state = read_state(directory)
+    labels = sorted(detail_type_labels(db_engine).values())
+    if (
+        state is None
+        or state.get("version") != EXPORT_VERSION
+        or state.get("columns") != labels
+    ):
+        full = True
+    # read before the transactions, rows stored meanwhile are exported again next time
+    with db_engine.connect() as conn:
+        max_id = conn.execute(select(func.max(Transaction.id))).scalar() or 0
+    months = touched_months(db_engine, after_id=None if full else state["max_id"])
+
+    rows = 0
+    for date_from, date_to in month_runs(months):
+        df = transaction_frame(db_engine, date_from=date_from, date_to=date_to).with_columns(
+            pl.col("booking_date").dt.strftime("%Y-%m").alias("month")
+        )
+        for (month,), partition in df.partition_by("month", as_dict=True).items():
+            path = partition_dir(directory, month)
+            os.makedirs(path, exist_ok=True)
+            file_path = os.path.join(path, PARTITION_FILE)
+            tmp_path = f"{file_path}.{os.getpid()}.tmp"
+            partition.drop("month").write_parquet(tmp_path, compression="zstd", statistics=True)
+            os.replace(tmp_path, file_path)
+            rows += partition.height
+    if full:
+        for name in os.listdir(directory):
+            if PARTITION_PATTERN.match(name) and name.split("=", 1)[1] not in months:
+                shutil.rmtree(os.path.join(directory, name))
+    write_state(directory, {"version": EXPORT_VERSION, "max_id": max_id, "columns": labels})
+    return {"partitions": len(months), "transactions": rows, "max_id": max_id}
+
+
+@app.command()
+def export_partitions(
+    directory: str = typer.Argument(EXPORT_DIR, help="the export directory"),
+    full: bool = typer.Option(False, help="rewrite all months, e.g. after a recategorize"),
+):
+    """
+    Exports the transactions to Parquet files partitioned by booking month, rewriting only the
+    months with transactions stored since the last export.
+    """
+    from db import engine
+
+    counts = write_partitions(engine, directory, full=full)
+    print(
+        f"rewrote {counts['partitions']} monthly partitions with {counts['transactions']} "
+        f"transactions in {directory}, exported up to id {counts['max_id']}"
+    )
+
+
+if __name__ == "__main__":
+    app()
@@ -0,0 +1,18 @@
+from typing import Optional
+import polars as pl
+import seaborn as sns
+import matplotlib.pyplot as plt
+
+# only imported by the commands that render charts, seaborn and matplotlib are slow to import
+
+
+def save_lineplot(
+    df: pl.DataFrame, x: str, y: str, hue: Optional[str] = None, file_path: str = "out.png"
+):
+    """
+    Saves a line plot of two columns of df to an image file.
+    """
+    myplot = sns.lineplot(data=df.to_pandas(), x=x, y=y, hue=hue)
+    plt.setp(myplot.get_xticklabels(), rotation=90)
+    fig = myplot.get_figure()
+    fig.savefig(file_path)
@@ -0,0 +1,136 @@
+from typing import List, Optional, Tuple
+from datetime import datetime
+import re
+import typer
+from sqlalchemy import create_engine, select, text
+
+from data_model import (
+    Base,
+    Transaction,
+    TransactionDetail,
+    TransactionDetailType,
+    TransactionType,
+)
+from data_io import detail_profile_stmt
+
+app = typer.Typer()
+
+# a SCAN that is not served by an index reads the whole table (or subquery)
+FULL_SCAN = re.compile(r"\bSCAN (\w+)\b(?! USING (COVERING )?INDEX)")
+TABLE_SCAN = re.compile(r"\bSCAN (\w+)\b")
+
+
+def hot_queries() -> List[Tuple[str, object, bool]]:
+    """
+    The queries that run once per csv row or over the whole history and therefore
+    must be served by an index.
+
+    Returns:
+        List[Tuple[str, object, bool]]: name, statement and whether a full scan of an
+        index (instead of a search) is acceptable
+    """
+    some_date = datetime(2023, 1, 2)
+    return [
+        (
+            "find_transactions",
+            select(Transaction.id).where(
+                Transaction.amount_cents == 1250,
+                Transaction.booking_date == some_date,
+                Transaction.value_date == some_date,
+                Transaction.tr_type == TransactionType.debit,
+            ),
+            False,
+        ),
+        (
+            "find_transaction_details",
+            select(TransactionDetail).where(TransactionDetail.transaction_id == 1),
+            False,
+        ),
+        (
+            "find_duplicates fingerprint",
+            select(Transaction.id).where(Transaction.fingerprint == "0" * 40),
+            False,
+        ),
+        (
+            "find_duplicates legacy check",
+            select(Transaction.id).where(Transaction.fingerprint.is_(None)).limit(1),
+            False,
+        ),
+        (
+            "sync_detail_types",
+            select(TransactionDetailType.id).where(TransactionDetailType.label == "info"),
+            False,
+        ),
+        (
+            "summarize_transaction_detail",
+            detail_profile_stmt(top_k=5),
+            True,
+        ),
+    ]
+
+
+def explain(conn, stmt) -> List[str]:
+    """
+    Runs EXPLAIN QUERY PLAN for a statement.
+
+    Args:
+        conn (sqlalchemy connection): a connection to a sqlite database
+        stmt (sqlalchemy statement): the statement to explain
+
+    Returns:
+        List[str]: the detail column of every plan step
+    """
+    compiled = stmt.compile(conn, compile_kwargs={"literal_binds": True})
+    return [row.detail for row in conn.execute(text(f"EXPLAIN QUERY PLAN {compiled}"))]
+
+
+def full_scans(plan: List[str], allow_index_scan: bool) -> List[str]:
+    """
+    Finds the plan steps that fall back to a full scan of one of our tables.
+    Scans of subqueries and CTEs are not counted, their own steps are in the plan as well.
+
+    Args:
+        plan (List[str]): the plan steps as returned by explain
+        allow_index_scan (bool): whether a scan over a (covering) index is fine
+
+    Returns:
+        List[str]: the offending plan steps
+    """
+    pattern = FULL_SCAN if allow_index_scan else TABLE_SCAN
+    return [
+        step
+        for step in plan
+        if (match := pattern.search(step)) and match.group(1) in Base.metadata.tables
+    ]
+
+
+@app.command()
+def check(db_url: Optional[str] = typer.Argument(None)):
+    """
+    Checks that none of the hot queries falls back to a full table scan.
+    Without a database url the check runs on a fresh in-memory database with the current schema.
+    """
+    if db_url is None:
+        engine = create_engine("sqlite+pysqlite:///:memory:")
+        Base.metadata.create_all(engine)
+    else:
+        engine = create_engine(db_url)
+
+    failed = []
+    with engine.connect() as conn:
+        for name, stmt, allow_index_scan in hot_queries():
+            plan = explain(conn, stmt)
+            scans = full_scans(plan, allow_index_scan=allow_index_scan)
+            print(f"{'FAIL' if scans else 'ok'}: {name}")
+            for step in plan:
+                print(f"    {step}")
+            if scans:
+                failed.append(name)
+
+    if failed:
+        print(f"full scans in: {', '.join(failed)}")
+        raise typer.Exit(code=1)
+
+
+if __name__ == "__main__":
+    app()
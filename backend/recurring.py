@@ -0,0 +1,267 @@
+from typing import Optional
+from datetime import date, datetime
+import typer
+import polars as pl
+
+from column_mapping import MappedCols
+from categories import DEFAULT_IBAN_COLUMN, normalize_iban
+from amounts import cents_to_units, units_to_cents
+
+app = typer.Typer()
+
+# the detail holding the name of the counterparty, the series are keyed by the iban if there
+# is one, otherwise by the name
+COUNTERPARTY_COLUMN = "beguenstigter/zahlungspflichtiger"
+# the usual cadences: nominal days between two payments, the deviation still counted as on
+# time and the calendar offset to the next payment
+CADENCES = pl.DataFrame(
+    {
+        "cadence": ["weekly", "biweekly", "monthly", "quarterly", "half-yearly", "yearly"],
+        "days": [7.0, 14.0, 30.44, 91.31, 182.62, 365.25],
+        "tolerance": [1, 2, 4, 10, 15, 20],
+        "offset": ["1w", "2w", "1mo", "3mo", "6mo", "1y"],
+    }
+)
+# other regular gaps are reported as every n days if they are in this range, longer ones are
+# too few per year to tell a rhythm from chance
+MIN_GAP_DAYS = 5
+MAX_GAP_DAYS = 62
+
+
+def find_recurring(
+    df: pl.DataFrame,
+    min_count: int = 3,
+    amount_tolerance: float = 0.05,
+    min_regularity: float = 0.75,
+    as_of: Optional[date] = None,
+) -> pl.DataFrame:
+    """
+    Finds recurring payments such as standing orders, subscriptions or salaries.
+    The transactions are split into series of the same counterparty, type and a similar amount:
+    sorted by amount, a new series starts where the amount grows by more than amount_tolerance.
+    Within a series the gaps between the booking dates are diffed, their median is matched to
+    a cadence and the share of the gaps that are on time is the regularity.
+    Everything is vectorized, there is no loop over series or rows.
+
+    Args:
+        df (pl.DataFrame): the transactions with the mapped columns (amounts in cents) and the
+            counterparty and iban columns
+        min_count (int, optional): the minimum number of payments of a series. Defaults to 3.
+        amount_tolerance (float, optional): the relative difference of the amounts of
+            neighbouring payments of a series. Defaults to 0.05.
+        min_regularity (float, optional): the minimum share of the gaps that match the cadence.
+            Defaults to 0.75.
+        as_of (Optional[date], optional): the date a series is overdue at, to tell the active
+            ones. Defaults to None (the last booking date of df).
+
+    Returns:
+        pl.DataFrame: one row per recurring series with cadence, amount, regularity, the
+            last and the next expected date, active ones and the larger amounts first
+    """
+    booking_date = pl.col(MappedCols.booking_date_col.value)
+    iban = (
+        normalize_iban(pl.col(DEFAULT_IBAN_COLUMN))
+        if DEFAULT_IBAN_COLUMN in df.columns
+        else pl.lit(None, dtype=pl.Utf8)
+    )
+    counterparty = (
+        pl.col(COUNTERPARTY_COLUMN).cast(pl.Utf8).str.strip_chars()
+        if COUNTERPARTY_COLUMN in df.columns
+        else pl.lit(None, dtype=pl.Utf8)
+    )
+    if as_of is None:
+        as_of = df[MappedCols.booking_date_col.value].max()
+
+    payments = (
+        df.select(
+            booking_date.alias("date"),
+            pl.col(MappedCols.tr_type_col.value).cast(pl.Utf8).alias("tr_type"),
+            pl.col(MappedCols.amount_col.value).abs().alias("amount_cents"),
+            iban.replace("", None).alias("iban"),
+            counterparty.replace("", None).alias("counterparty"),
+        )
+        .with_columns(
+            pl.coalesce(pl.col("iban"), pl.col("counterparty").str.to_lowercase()).alias("party")
+        )
+        .drop_nulls(["party", "date", "amount_cents"])
+        .sort("party", "tr_type", "amount_cents")
+        .with_columns(
+            (
+                (pl.col("party") != pl.col("party").shift(1))
+                | (pl.col("tr_type") != pl.col("tr_type").shift(1))
+                | (pl.col("amount_cents") > pl.col("amount_cents").shift(1) * (1 + amount_tolerance))
+            )
+            .fill_null(True)
+            .cum_sum()
+            .alias("series")
+        )
+        .sort("series", "date")
+        .with_columns(
+            pl.when(pl.col("series") == pl.col("series").shift(1))
+            .then(pl.col("date").diff().dt.total_days())
+            .alias("gap")
+        )
+    )
+
+    series = (
+        payments.group_by("series")
+        .agg(
+            pl.col("counterparty").drop_nulls().mode().first(),
+            pl.col("iban").first(),
+            pl.col("tr_type").first(),
+            pl.len().alias("count"),
+            pl.col("amount_cents").median().round(0).cast(pl.Int64).alias("amount"),
+            pl.col("amount_cents").min().alias("amount_min"),
+            pl.col("amount_cents").max().alias("amount_max"),
+            pl.col("date").min().alias("first_date"),
+            pl.col("date").max().alias("last_date"),
+            pl.col("gap").median().alias("gap_days"),
+            # the cadence of the last payments, shows series that changed their rhythm
+            pl.col("gap").tail(3).median().alias("recent_gap_days"),
+        )
+        .filter(pl.col("count") >= min_count, pl.col("gap_days") >= 1)
+        .sort("gap_days")
+        .join_asof(CADENCES, left_on="gap_days", right_on="days", strategy="nearest")
+    )
+    # gaps far from any usual cadence are still regular if they keep their own rhythm
+    series = series.with_columns(
+        ((pl.col("gap_days") - pl.col("days")).abs() <= pl.col("tolerance")).alias("usual")
+    )
+    is_usual = pl.col("usual")
+    series = series.with_columns(
+        pl.when(is_usual)
+        .then(pl.col("cadence"))
+        .otherwise(pl.format("every {} days", pl.col("gap_days").round(0).cast(pl.Int64)))
+        .alias("cadence"),
+        pl.when(is_usual).then(pl.col("days")).otherwise(pl.col("gap_days")).alias("days"),
+        pl.when(is_usual)
+        .then(pl.col("tolerance"))
+        .otherwise((pl.col("gap_days") * 0.1).round(0).cast(pl.Int64).clip(1))
+        .alias("tolerance"),
+        pl.when(is_usual)
+        .then(pl.col("offset"))
+        .otherwise(pl.format("{}d", pl.col("gap_days").round(0).cast(pl.Int64)))
+        .alias("offset"),
+    ).filter(is_usual | pl.col("gap_days").is_between(MIN_GAP_DAYS, MAX_GAP_DAYS))
+
+    regularity = (
+        payments.select("series", "gap")
+        .drop_nulls("gap")
+        .join(series.select("series", "days", "tolerance"), on="series")
+        .group_by("series")
+        .agg(
+            ((pl.col("gap") - pl.col("days")).abs() <= pl.col("tolerance"))
+            .mean()
+            .alias("regularity")
+        )
+    )
+    next_expected = pl.col("last_date").dt.offset_by(pl.col("offset"))
+    return (
+        series.join(regularity, on="series")
+        .filter(pl.col("regularity") >= min_regularity)
+        .with_columns(
+            next_expected.alias("next_expected"),
+            (
+                next_expected + pl.duration(days=pl.col("tolerance")) >= pl.lit(as_of)
+            ).alias("active"),
+            *[cents_to_units(pl.col(col)) for col in ("amount", "amount_min", "amount_max")],
+        )
+        .sort(["active", "amount"], descending=True)
+        .select(
+            "counterparty",
+            "iban",
+            "tr_type",
+            "cadence",
+            "amount",
+            "amount_min",
+            "amount_max",
+            "count",
+            "gap_days",
+            "recent_gap_days",
+            "regularity",
+            "first_date",
+            "last_date",
+            "next_expected",
+            "active",
+        )
+    )
+
+
+def stored_payments(db_engine, date_from=None, date_to=None) -> pl.DataFrame:
+    """
+    The stored transactions with the columns find_recurring needs, in the layout of parsed
+    csv rows (the mapped columns with the amounts in cents).
+
+    Args:
+        db_engine (sqlalchemy engine): the database engine
+        date_from (Optional[date], optional): first booking date. Defaults to None.
+        date_to (Optional[date], optional): last booking date. Defaults to None.
+
+    Returns:
+        pl.DataFrame: the transactions
+    """
+    from detail_types import detail_type_labels
+    from transaction_frame import transaction_frame
+
+    labels = set(detail_type_labels(db_engine).values())
+    df = transaction_frame(
+        db_engine,
+        date_from=date_from,
+        date_to=date_to,
+        columns=["booking_date", "amount", "tr_type"]
+        + [col for col in (COUNTERPARTY_COLUMN, DEFAULT_IBAN_COLUMN) if col in labels],
+    )
+    return df.with_columns(
+        units_to_cents(pl.col("amount")).alias(MappedCols.amount_col.value)
+    ).drop("amount")
+
+
+@app.command()
+def recurring(
+    date_from: Optional[datetime] = typer.Option(None, formats=["%Y-%m-%d"]),
+    date_to: Optional[datetime] = typer.Option(None, formats=["%Y-%m-%d"]),
+    min_count: int = typer.Option(3, min=2, help="minimum number of payments of a series"),
+    amount_tolerance: float = typer.Option(
+        0.05, min=0, help="relative difference of the amounts within a series"
+    ),
+    min_regularity: float = typer.Option(
+        0.75, min=0, max=1, help="minimum share of the payments that are on time"
+    ),
+    active_only: bool = typer.Option(False, help="leave out series that are overdue"),
+    output: Optional[str] = typer.Option(None, help="write the series to this csv file"),
+):
+    """
+    Lists standing orders, subscriptions, salaries and other recurring payments with their
+    cadence and the date of the next payment.
+    """
+    from db import engine
+
+    df = stored_payments(
+        engine,
+        date_from=date_from.date() if date_from else None,
+        date_to=date_to.date() if date_to else None,
+    )
+    report = find_recurring(
+        df,
+        min_count=min_count,
+        amount_tolerance=amount_tolerance,
+        min_regularity=min_regularity,
+        as_of=date_to.date() if date_to else None,
+    )
+    if active_only:
+        report = report.filter(pl.col("active"))
+    print(f"{report.height} recurring series in {df.height} transactions")
+    with pl.Config(tbl_rows=30, tbl_cols=-1, fmt_str_lengths=30, tbl_width_chars=160):
+        print(
+            report.head(30).select(
+                "counterparty", "tr_type", "cadence", "amount", "count", "regularity",
+                "last_date", "next_expected", "active",
+            )
+        )
+    if output is not None:
+        report.write_csv(output)
+        print(f"wrote the series to {output}")
+
+
+if __name__ == "__main__":
+    app()
@@ -0,0 +1,45 @@
+from sqlalchemy import select
+from sqlalchemy.dialects.sqlite import insert
+
+from data_model import DataRevision
+
+# changes to stored transactions or their details that keep the ids: categories, amounts,
+# removed details or deleted transactions
+TRANSACTIONS = "transactions"
+# changes to the stored fingerprints other than new transactions: backfilled fingerprints or
+# deleted transactions
+FINGERPRINTS = "fingerprints"
+
+
+def read_revision(conn, name: str) -> int:
+    """
+    The current revision of a counter, 0 if it was never bumped.
+
+    Args:
+        conn (sqlalchemy connection): the database connection
+        name (str): the counter, e.g. TRANSACTIONS
+
+    Returns:
+        int: the revision
+    """
+    revision = conn.execute(
+        select(DataRevision.revision).where(DataRevision.name == name)
+    ).scalar()
+    return revision or 0
+
+
+def bump_revision(conn, name: str):
+    """
+    Counts a change, in the database transaction of the change so both commit together.
+
+    Args:
+        conn (sqlalchemy connection): the connection holding the open database transaction
+        name (str): the counter, e.g. TRANSACTIONS
+    """
+    stmt = insert(DataRevision).values(name=name, revision=1)
+    conn.execute(
+        stmt.on_conflict_do_update(
+            index_elements=[DataRevision.name],
+            set_={"revision": DataRevision.revision + 1},
+        )
+    )
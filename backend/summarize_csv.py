@@ -1,11 +1,14 @@
 import csv
-from typing import List, Tuple, Optional
+from typing import List, Tuple, Optional, Iterator, TYPE_CHECKING
 from datetime import datetime
 import typer
 import polars as pl
-import pandas as pd
-import seaborn as sns
-import matplotlib.pyplot as plt
+
+from csv_stream import iter_csv_batches
+from csv_cache import cached_frame
+
+if TYPE_CHECKING:
+    import pandas as pd
 
 app = typer.Typer()
 
@@ -41,9 +44,29 @@ def read_csv_file(file_path: str) -> pl.DataFrame:
     """
     Reads a CSV file and returns the column headers and rows as separate Polars DataFrames.
     """
-    df = pl.read_csv(file_path, separator=";", encoding="iso8859-1")
+    return cached_frame(
+        file_path,
+        key_parts=("summarize_csv", ";", "iso8859-1"),
+        loader=lambda: normalize_frame(
+            pl.read_csv(file_path, separator=";", encoding="iso8859-1")
+        ),
+    )
+
+
+def iter_csv_file(file_path: str, batch_size: int = 50000) -> Iterator[pl.DataFrame]:
+    """
+    Reads a CSV file batch by batch, see read_csv_file. Only one batch is in memory at a time.
+    """
+    for batch in iter_csv_batches(
+        file_path, separator=";", encoding="iso8859-1", batch_size=batch_size
+    ):
+        yield normalize_frame(batch)
 
-    # Remove spaces from column names
+
+def normalize_frame(df: pl.DataFrame) -> pl.DataFrame:
+    """
+    Removes spaces from the column names and casts the dates and the amount.
+    """
     df.columns = [header.strip().replace(" ", "_") for header in df.columns]
     df = df.with_columns(
         pl.col("Buchungstag").str.strptime(pl.Date, "%d.%m.%y"),
@@ -54,23 +77,35 @@ def read_csv_file(file_path: str) -> pl.DataFrame:
     return df
 
 
-def pd_read_csv_file(file_path: str) -> pd.DataFrame:
+def monthly_costs(df: pl.DataFrame) -> pl.DataFrame:
+    """
+    Sums up the debits per month. The sums of several batches of a file can be combined
+    by summing them up again per month.
+    """
+    return (
+        df.filter(pl.col("Betrag") < 0)
+        # .filter(pl.col("Betrag") > -2000)
+        .filter(pl.col("Buchungstag") < datetime(2023, 4, 1))
+        .with_columns(
+            pl.col("Betrag")*-1,
+            pl.col("Buchungstag").dt.truncate("1mo"),
+        )
+        .group_by("Buchungstag")
+        .agg(pl.col("Betrag").sum())
+    )
+
+
+def pd_read_csv_file(file_path: str) -> "pd.DataFrame":
     """
     Reads a CSV file and returns the column headers and rows as separate Polars DataFrames.
+    Goes through the same parsed csv cache as read_csv_file.
     """
-    df = pd.read_csv(file_path, sep=";", encoding="iso8859-1")
+    import pandas as pd
+
+    df = read_csv_file(file_path).to_pandas()
+    df["Buchungstag"] = pd.to_datetime(df["Buchungstag"])
+    df["Valutadatum"] = pd.to_datetime(df["Valutadatum"])
 
-    # Remove spaces from column names
-    df.columns = [header.strip().replace(" ", "_") for header in df.columns]
-    df["Buchungstag"] = pd.to_datetime(df["Buchungstag"], format="%d.%m.%y")
-    df["Valutadatum"] = pd.to_datetime(df["Valutadatum"], format="%d.%m.%y")
-    df["Betrag"] = pd.to_numeric(df["Betrag"].str.replace(",", "."))
-    
-    # df = df.with_columns(
-    #     pl.col("Buchungstag").str.strptime(pl.Date, "%d.%m.%y"),
-    #     pl.col("Valutadatum").str.strptime(pl.Date, "%d.%m.%y"),
-    #     pl.col("Betrag").str.replace(",", ".").cast(pl.Float64),
-    # )
     print(df.head)
     return df
 
@@ -123,31 +158,33 @@ def summarize_csv(
     filename: str,
     # column_name: Optional[str] = typer.Argument(None),
     print_headers: Optional[bool] = typer.Argument(False),
+    streaming: bool = typer.Option(False, help="read the file batch by batch"),
+    batch_size: int = 50000,
 ):
     # headers, rows = read_csv_file(filename)
-    df = read_csv_file(filename)
-    if print_headers:
-        print(df.columns)
-
-    only_neg = (
-        df.filter(pl.col("Betrag") < 0)
-        # .filter(pl.col("Betrag") > -2000)
-        .filter(pl.col("Buchungstag") < datetime(2023, 4, 1))
-        .sort("Buchungstag")
-        .with_columns(pl.col("Betrag")*-1)
-    )
-    costs_summary = only_neg.groupby_dynamic("Buchungstag", every="1mo").agg(
-        pl.col("Betrag").sum()
-    )
-    costs_summary = costs_summary.with_columns(
+    if streaming:
+        monthly = []
+        for batch in iter_csv_file(filename, batch_size=batch_size):
+            if print_headers and len(monthly) == 0:
+                print(batch.columns)
+            monthly.append(monthly_costs(batch))
+        costs_summary = (
+            pl.concat(monthly).group_by("Buchungstag").agg(pl.col("Betrag").sum())
+        )
+    else:
+        df = read_csv_file(filename)
+        if print_headers:
+            print(df.columns)
+        costs_summary = monthly_costs(df)
+
+    costs_summary = costs_summary.sort("Buchungstag").with_columns(
         pl.col("Buchungstag").dt.strftime("%Y-%m").alias("yearmonth")
     )
     print(costs_summary.head(12))
 
-    myplot = sns.lineplot(data=costs_summary, x="yearmonth", y="Betrag")
-    plt.setp(myplot.get_xticklabels(), rotation=90)
-    fig = myplot.get_figure()
-    fig.savefig("out.png")
+    from plots import save_lineplot
+
+    save_lineplot(costs_summary, x="yearmonth", y="Betrag")
 
     # if column_name is not None:
     #     if column_name in headers:
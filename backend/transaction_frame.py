@@ -0,0 +1,183 @@
+from typing import Dict, List, Optional
+from datetime import date, datetime, timedelta
+import typer
+import polars as pl
+from sqlalchemy import select, func, cast, literal, String, type_coerce
+
+from data_model import Transaction, TransactionDetail, DetailValue
+from detail_types import detail_type_labels
+from fingerprint import KEY_SEPARATOR
+from amounts import cents_to_units
+
+app = typer.Typer()
+
+# the columns of transaction_base, in the order of the wide frame
+BASE_COLUMNS = ["id", "booking_date", "value_date", "amount", "tr_type", "category"]
+
+# sqlite stores DateTime as text, parsing it in polars is much faster than row by row in sqlalchemy
+DATETIME_FORMAT = "%Y-%m-%d %H:%M:%S%.f"
+QUERY_SCHEMA = {
+    "id": pl.Int64,
+    "booking_date": pl.Utf8,
+    "value_date": pl.Utf8,
+    "amount": pl.Int64,
+    "tr_type": pl.Utf8,
+    "category": pl.Utf8,
+    "details": pl.Utf8,
+}
+# the details of a transaction are packed into one text column as type id, KEY_SEPARATOR,
+# description, with DETAIL_SEPARATOR between the details
+DETAIL_SEPARATOR = "\x1e"
+
+
+def transaction_frame(
+    db_engine,
+    date_from: Optional[date] = None,
+    date_to: Optional[date] = None,
+    columns: Optional[List[str]] = None,
+    batch_size: int = 50000,
+) -> pl.DataFrame:
+    """
+    Reads the transactions as one wide frame, with the detail labels as columns.
+    The transactions are read with one streaming query in batches of batch_size rows, one row
+    per transaction with its details packed into a single text column by sqlite (group_concat
+    over the transaction_detail index). The details are unpacked and turned into columns with
+    vectorized string splits and a single pivot. The date range and the columns are applied
+    in the query, so details that are not asked for are not read at all.
+
+    Args:
+        db_engine (sqlalchemy engine): the database engine
+        date_from (Optional[date], optional): first booking date. Defaults to None.
+        date_to (Optional[date], optional): last booking date. Defaults to None.
+        columns (Optional[List[str]], optional): the base columns and detail labels to return,
+            id is always included. Defaults to None (all).
+        batch_size (int, optional): the number of transactions per batch. Defaults to 50000.
+
+    Returns:
+        pl.DataFrame: one row per transaction, sorted by booking date and id
+    """
+    labels: Dict[int, str] = detail_type_labels(db_engine)
+    if columns is None:
+        base_columns = BASE_COLUMNS
+        type_ids = list(labels)
+    else:
+        unknown = [col for col in columns if col not in BASE_COLUMNS and col not in labels.values()]
+        if len(unknown) > 0:
+            raise ValueError(f"unknown columns: {unknown}")
+        base_columns = [col for col in BASE_COLUMNS if col == "id" or col in columns]
+        type_ids = [type_id for type_id, label in labels.items() if label in columns]
+
+    selected = {
+        "id": Transaction.id,
+        "booking_date": type_coerce(Transaction.booking_date, String),
+        "value_date": type_coerce(Transaction.value_date, String),
+        "amount": Transaction.amount_cents,
+        "tr_type": type_coerce(Transaction.tr_type, String),
+        "category": Transaction.category,
+    }
+    stmt = select(*[selected[col].label(col) for col in base_columns])
+    if len(type_ids) > 0:
+        packed = (
+            select(
+                func.group_concat(
+                    cast(TransactionDetail.transaction_detail_type_id, String)
+                    + literal(KEY_SEPARATOR)
+                    + DetailValue.value,
+                    DETAIL_SEPARATOR,
+                )
+            )
+            .select_from(TransactionDetail)
+            .join(DetailValue, DetailValue.id == TransactionDetail.value_id)
+            .where(
+                TransactionDetail.transaction_id == Transaction.id,
+                TransactionDetail.transaction_detail_type_id.in_(type_ids),
+            )
+            .scalar_subquery()
+        )
+        stmt = stmt.add_columns(packed.label("details"))
+    if date_from is not None:
+        stmt = stmt.where(Transaction.booking_date >= datetime.combine(date_from, datetime.min.time()))
+    if date_to is not None:
+        stmt = stmt.where(
+            Transaction.booking_date < datetime.combine(date_to + timedelta(days=1), datetime.min.time())
+        )
+
+    schema = {
+        col: QUERY_SCHEMA[col] for col in base_columns + (["details"] if len(type_ids) > 0 else [])
+    }
+    with db_engine.connect() as conn:
+        batches = list(
+            pl.read_database(
+                stmt, conn, iter_batches=True, batch_size=batch_size, schema_overrides=schema
+            )
+        )
+    wide = pl.concat(batches) if len(batches) > 0 else pl.DataFrame(schema=schema)
+
+    if len(type_ids) > 0:
+        details = (
+            wide.select("id", pl.col("details").str.split(DETAIL_SEPARATOR))
+            .explode("details")
+            .drop_nulls("details")
+            .select(
+                "id",
+                pl.col("details")
+                .str.splitn(KEY_SEPARATOR, 2)
+                .struct.rename_fields(["type_id", "description"]),
+            )
+            .unnest("details")
+        )
+        wide = wide.drop("details")
+        if details.height > 0:
+            pivoted = details.pivot(
+                on="type_id", index="id", values="description", aggregate_function="first"
+            )
+            wide = wide.join(
+                pivoted.rename({col: labels[int(col)] for col in pivoted.columns if col != "id"}),
+                on="id",
+                how="left",
+            )
+        # labels without any detail in the range are still columns
+        wide = wide.with_columns(
+            [
+                pl.lit(None, dtype=pl.Utf8).alias(labels[type_id])
+                for type_id in type_ids
+                if labels[type_id] not in wide.columns
+            ]
+        ).select(base_columns + [labels[type_id] for type_id in type_ids])
+
+    date_cols = [col for col in ("booking_date", "value_date") if col in base_columns]
+    wide = wide.with_columns(
+        [pl.col(col).str.to_datetime(DATETIME_FORMAT).dt.date() for col in date_cols]
+    )
+    if "amount" in base_columns:
+        wide = wide.with_columns(cents_to_units(pl.col("amount")))
+    return wide.sort([col for col in ("booking_date", "id") if col in wide.columns])
+
+
+@app.command()
+def export(
+    file_path: str,
+    date_from: Optional[datetime] = typer.Option(None, formats=["%Y-%m-%d"]),
+    date_to: Optional[datetime] = typer.Option(None, formats=["%Y-%m-%d"]),
+    columns: Optional[List[str]] = typer.Option(None, help="base columns and detail labels, can be given several times"),
+):
+    """
+    Exports the transactions with their details as columns to a csv or parquet file.
+    """
+    from db import engine
+
+    df = transaction_frame(
+        engine,
+        date_from=None if date_from is None else date_from.date(),
+        date_to=None if date_to is None else date_to.date(),
+        columns=columns or None,
+    )
+    if file_path.endswith(".parquet"):
+        df.write_parquet(file_path)
+    else:
+        df.write_csv(file_path)
+    print(f"wrote {df.height} transactions to {file_path}")
+
+
+if __name__ == "__main__":
+    app()
@@ -0,0 +1,468 @@
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+from array import array
+from datetime import date, datetime
+from itertools import chain
+import sys
+import time
+import numpy as np
+import typer
+from sqlalchemy import select, func, cast, Integer, String, type_coerce
+
+from data_model import Transaction, TransactionDetail, DetailValue
+from detail_types import detail_type_labels
+
+app = typer.Typer()
+
+# sqlite's julianday of 0001-01-01 00:00, julianday - ORDINAL_OFFSET is date.toordinal
+ORDINAL_OFFSET = 1721424.5
+TR_TYPES = ["debit", "credit"]
+# the code of a missing category or detail
+NO_VALUE = -1
+# the columns that can be grouped by besides the detail labels
+GROUP_KEYS = ["month", "year", "tr_type", "category"]
+# the ordinal of numpy's datetime64 epoch, 1970-01-01
+EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+
+
+def column_view(values: array) -> np.ndarray:
+    """
+    A numpy view of a typed array, without copying it. The array can not be resized while
+    the view exists.
+    """
+    return np.frombuffer(values, dtype=values.typecode)
+
+
+def selection_view(rows: Sequence[int]) -> np.ndarray:
+    """
+    The positions of a selection as a numpy array, a view if it is a typed array.
+    """
+    if isinstance(rows, array):
+        return column_view(rows)
+    return np.asarray(rows, dtype="l")
+
+
+def to_selection(positions: np.ndarray) -> array:
+    """
+    A selection as returned by filter from numpy positions.
+    """
+    selection = array("l")
+    selection.frombytes(positions.astype(selection.typecode).tobytes())
+    return selection
+
+
+class transactionStore:
+    """
+    Class that holds the transactions read-only in memory, column by column in typed arrays:
+    the ids and amounts in cents as int64, the dates as int32 day ordinals, the type as int8
+    and the category and every detail label as int32 codes. The detail codes are the ids of
+    the detail_value table, whose texts are kept once in values, so filters on a text are
+    evaluated once per distinct text and not once per transaction.
+    A transaction takes about 37 bytes plus 4 per detail column, the texts are shared.
+
+    Selections are arrays of row positions, returned by filter and accepted by the aggregations.
+    Both work on numpy views of the arrays, the date ranges by bisection of the rows sorted
+    by booking date (day_order), so no python code runs per row.
+    """
+
+    def __init__(
+        self,
+        ids: array,
+        booking_days: array,
+        value_days: array,
+        amount_cents: array,
+        tr_types: array,
+        category_codes: array,
+        categories: List[str],
+        details: Dict[str, array],
+        values: Dict[int, str],
+    ):
+        """
+        Initialization, see load.
+
+        Args:
+            ids (array): the transaction ids, ascending
+            booking_days (array): the booking dates as ordinals
+            value_days (array): the value dates as ordinals
+            amount_cents (array): the amounts in cents, positive
+            tr_types (array): the index of the type in TR_TYPES
+            category_codes (array): the index of the category in categories or NO_VALUE
+            categories (List[str]): the categories
+            details (Dict[str, array]): the value id (or NO_VALUE) per row, per detail label
+            values (Dict[int, str]): the texts of the value ids
+        """
+        self.ids = ids
+        self.booking_days = booking_days
+        self.value_days = value_days
+        self.amount_cents = amount_cents
+        self.tr_types = tr_types
+        self.category_codes = category_codes
+        self.categories = categories
+        self.details = details
+        self.values = values
+        # the positions ordered by booking date and the booking dates in that order
+        self.day_order = np.argsort(column_view(booking_days), kind="stable").astype(np.int32)
+        self.sorted_days = column_view(booking_days)[self.day_order]
+
+    @classmethod
+    def load(
+        cls, db_engine, columns: Optional[List[str]] = None, batch_size: int = 50000
+    ) -> "transactionStore":
+        """
+        Reads all transactions with two queries, streamed in batches of plain rows straight
+        into the arrays. The dates are turned into ordinals by sqlite, no orm objects and no
+        datetime objects are created. The details are placed by bisection of the ascending ids,
+        a batch at a time.
+
+        Args:
+            db_engine (sqlalchemy engine): the database engine
+            columns (Optional[List[str]], optional): the detail labels to load.
+                Defaults to None (all).
+            batch_size (int, optional): the number of rows per fetch. Defaults to 50000.
+
+        Returns:
+            transactionStore: the store
+        """
+        labels = detail_type_labels(db_engine)
+        if columns is not None:
+            unknown = [col for col in columns if col not in labels.values()]
+            if len(unknown) > 0:
+                raise ValueError(f"unknown columns: {unknown}")
+        type_labels = {
+            type_id: label
+            for type_id, label in labels.items()
+            if columns is None or label in columns
+        }
+
+        ids = array("q")
+        booking_days = array("i")
+        value_days = array("i")
+        amount_cents = array("q")
+        tr_types = array("b")
+        category_codes = array("i")
+        category_index: Dict[str, int] = {}
+        type_codes = {tr_type: code for code, tr_type in enumerate(TR_TYPES)}
+
+        base_stmt = select(
+            Transaction.id,
+            cast(func.julianday(Transaction.booking_date) - ORDINAL_OFFSET, Integer),
+            cast(func.julianday(Transaction.value_date) - ORDINAL_OFFSET, Integer),
+            Transaction.amount_cents,
+            type_coerce(Transaction.tr_type, String),
+            Transaction.category,
+        ).order_by(Transaction.id)
+        # a sequential scan of all details, the type index would make it a lookup per detail
+        detail_stmt = select(
+            TransactionDetail.transaction_id,
+            TransactionDetail.transaction_detail_type_id,
+            TransactionDetail.value_id,
+        )
+        values_stmt = select(DetailValue.id, DetailValue.value)
+        if columns is not None:
+            values_stmt = values_stmt.where(
+                DetailValue.id.in_(
+                    select(TransactionDetail.value_id).where(
+                        TransactionDetail.transaction_detail_type_id.in_(list(type_labels))
+                    )
+                )
+            )
+
+        with db_engine.connect() as conn:
+            result = conn.execution_options(stream_results=True, yield_per=batch_size).execute(
+                base_stmt
+            )
+            for batch in result.partitions():
+                batch_ids, booking, valuta, cents, types, categories = zip(*batch)
+                ids.extend(batch_ids)
+                booking_days.extend(booking)
+                value_days.extend(valuta)
+                amount_cents.extend(cents)
+                tr_types.extend(type_codes[tr_type] for tr_type in types)
+                category_codes.extend(
+                    NO_VALUE
+                    if category is None
+                    else category_index.setdefault(category, len(category_index))
+                    for category in categories
+                )
+
+            details = {label: array("i", [NO_VALUE]) * len(ids) for label in type_labels.values()}
+            if len(type_labels) > 0 and len(ids) > 0:
+                id_view = column_view(ids)
+                codes_by_type = {
+                    type_id: column_view(details[label]) for type_id, label in type_labels.items()
+                }
+                # the reads are not one snapshot, the details of transactions an import
+                # committed after the transactions were read are left out
+                result = conn.execution_options(
+                    stream_results=True, yield_per=batch_size
+                ).execute(detail_stmt)
+                for batch in result.partitions():
+                    transaction_ids, type_ids, value_ids = np.fromiter(
+                        chain.from_iterable(batch), dtype=np.int64, count=3 * len(batch)
+                    ).reshape(-1, 3).T
+                    positions = np.searchsorted(id_view, transaction_ids)
+                    known = positions < len(id_view)
+                    known[known] = id_view[positions[known]] == transaction_ids[known]
+                    for type_id, codes in codes_by_type.items():
+                        selected = known & (type_ids == type_id)
+                        codes[positions[selected]] = value_ids[selected]
+                del id_view, codes_by_type
+                values = dict(conn.execute(values_stmt).all())
+            else:
+                values = {}
+
+        return cls(
+            ids=ids,
+            booking_days=booking_days,
+            value_days=value_days,
+            amount_cents=amount_cents,
+            tr_types=tr_types,
+            category_codes=category_codes,
+            categories=list(category_index),
+            details=details,
+            values=values,
+        )
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def nbytes(self) -> int:
+        """
+        The memory used by the arrays and the texts, without the python object overhead
+        of the containers.
+
+        Returns:
+            int: the size in bytes
+        """
+        arrays = [
+            self.ids,
+            self.booking_days,
+            self.value_days,
+            self.amount_cents,
+            self.tr_types,
+            self.category_codes,
+            *self.details.values(),
+        ]
+        texts = [*self.categories, *self.values.values()]
+        return (
+            sum(col.itemsize * len(col) for col in arrays)
+            + self.day_order.nbytes
+            + self.sorted_days.nbytes
+            + sum(sys.getsizeof(text) for text in texts)
+        )
+
+    def all_rows(self) -> array:
+        """
+        The selection of all rows.
+        """
+        return to_selection(np.arange(len(self.ids)))
+
+    def filter(
+        self,
+        date_from: Optional[date] = None,
+        date_to: Optional[date] = None,
+        tr_type: Optional[str] = None,
+        category: Optional[str] = None,
+        contains: Optional[Dict[str, str]] = None,
+        rows: Optional[Sequence[int]] = None,
+    ) -> array:
+        """
+        Selects the rows that match all of the given conditions.
+
+        Args:
+            date_from (Optional[date], optional): first booking date. Defaults to None.
+            date_to (Optional[date], optional): last booking date. Defaults to None.
+            tr_type (Optional[str], optional): debit or credit. Defaults to None.
+            category (Optional[str], optional): the category. Defaults to None.
+            contains (Optional[Dict[str, str]], optional): detail label -> text that the detail
+                contains, case insensitive. Defaults to None.
+            rows (Optional[Sequence[int]], optional): the selection to filter further.
+                Defaults to None (all rows).
+
+        Returns:
+            array: the positions of the matching rows
+        """
+        mask = np.ones(len(self.ids), dtype=bool)
+        if date_from is not None or date_to is not None:
+            # the rows of the date range are a slice of the rows ordered by booking date
+            first = 0 if date_from is None else np.searchsorted(
+                self.sorted_days, date_from.toordinal(), side="left"
+            )
+            last = len(self.ids) if date_to is None else np.searchsorted(
+                self.sorted_days, date_to.toordinal(), side="right"
+            )
+            in_range = np.zeros(len(self.ids), dtype=bool)
+            in_range[self.day_order[first:last]] = True
+            mask &= in_range
+        if tr_type is not None:
+            mask &= column_view(self.tr_types) == TR_TYPES.index(tr_type)
+        if category is not None:
+            if category in self.categories:
+                mask &= column_view(self.category_codes) == self.categories.index(category)
+            else:
+                mask[:] = False
+        for label, text in (contains or {}).items():
+            if label not in self.details:
+                raise ValueError(f"unknown column: {label}")
+            needle = text.lower()
+            # the texts are tested once, the rows only compare codes
+            matching = [
+                value_id for value_id, value in self.values.items() if needle in value.lower()
+            ]
+            mask &= np.isin(column_view(self.details[label]), np.array(matching, dtype=np.int32))
+        if rows is None:
+            return to_selection(np.flatnonzero(mask))
+        positions = selection_view(rows)
+        return to_selection(positions[mask[positions]])
+
+    def group_codes(self, by: str, positions: np.ndarray) -> Tuple[np.ndarray, Callable[[int], str]]:
+        """
+        The group codes of the rows for a column: month (YYYY-MM) or year of the booking date,
+        tr_type, category or a detail label, and the function that turns a code into the key.
+        Missing categories and details are "".
+
+        Args:
+            by (str): the column
+            positions (np.ndarray): the positions of the rows
+
+        Returns:
+            Tuple[np.ndarray, Callable[[int], str]]: the codes as int64 and the key of a code
+        """
+        if by in ("month", "year"):
+            unit = "M" if by == "month" else "Y"
+            days = column_view(self.booking_days)[positions].astype(np.int64) - EPOCH_ORDINAL
+            codes = days.astype("datetime64[D]").astype(f"datetime64[{unit}]").astype(np.int64)
+            return codes, lambda code: str(np.datetime64(code, unit))
+        if by == "tr_type":
+            codes = column_view(self.tr_types)[positions].astype(np.int64)
+            return codes, lambda code: TR_TYPES[code]
+        if by == "category":
+            names = self.categories
+            codes = column_view(self.category_codes)[positions].astype(np.int64)
+            return codes, lambda code: "" if code == NO_VALUE else names[code]
+        if by in self.details:
+            values = self.values
+            codes = column_view(self.details[by])[positions].astype(np.int64)
+            return codes, lambda code: values.get(code, "")
+        raise ValueError(f"unknown group column: {by}, use one of {GROUP_KEYS} or a detail label")
+
+    def signed_cents(self, positions: Optional[np.ndarray], signed: bool) -> np.ndarray:
+        """
+        The amounts in cents of the rows, debits negative if signed.
+        """
+        cents = column_view(self.amount_cents)
+        tr_types = column_view(self.tr_types)
+        if positions is not None:
+            cents, tr_types = cents[positions], tr_types[positions]
+        if not signed:
+            return cents
+        return np.where(tr_types == TR_TYPES.index("debit"), -cents, cents)
+
+    def sum(self, rows: Optional[Sequence[int]] = None, signed: bool = False) -> int:
+        """
+        The total amount of the rows in cents.
+
+        Args:
+            rows (Optional[Sequence[int]], optional): the selection. Defaults to None (all rows).
+            signed (bool, optional): whether debits count negative. Defaults to False.
+
+        Returns:
+            int: the total in cents
+        """
+        positions = None if rows is None else selection_view(rows)
+        return int(self.signed_cents(positions, signed).sum())
+
+    def group_sum(
+        self, by: List[str], rows: Optional[Sequence[int]] = None, signed: bool = False
+    ) -> Dict[Tuple[str, ...], Tuple[int, int]]:
+        """
+        The total amount in cents and the number of rows per group. The rows are grouped by
+        their codes, the keys are only made for the groups.
+
+        Args:
+            by (List[str]): the group columns, see group_codes
+            rows (Optional[Sequence[int]], optional): the selection. Defaults to None (all rows).
+            signed (bool, optional): whether debits count negative. Defaults to False.
+
+        Returns:
+            Dict[Tuple[str, ...], Tuple[int, int]]: the total and the count per group key
+        """
+        positions = np.arange(len(self.ids)) if rows is None else selection_view(rows)
+        if len(positions) == 0:
+            return {}
+        cents = self.signed_cents(positions, signed)
+        if len(by) == 0:
+            return {(): (int(cents.sum()), len(positions))}
+        codes, key_functions = zip(*(self.group_codes(col, positions) for col in by))
+        # the group number of every row, numbered column by column to stay below len(rows)
+        group_count, groups = 1, np.zeros(len(positions), dtype=np.int64)
+        for column_codes in codes:
+            uniques, inverse = np.unique(column_codes, return_inverse=True)
+            group_ids, groups = np.unique(groups * len(uniques) + inverse, return_inverse=True)
+            group_count = len(group_ids)
+        totals = np.zeros(group_count, dtype=np.int64)
+        np.add.at(totals, groups, cents)
+        counts = np.bincount(groups, minlength=group_count)
+        # a row of every group, its codes make the key
+        first = np.zeros(group_count, dtype=np.int64)
+        first[groups[::-1]] = np.arange(len(groups) - 1, -1, -1)
+        group_codes = [column_codes[first].tolist() for column_codes in codes]
+        # different codes can have the same key, e.g. a missing and an empty detail
+        result: Dict[Tuple[str, ...], Tuple[int, int]] = {}
+        for group, total, count in zip(zip(*group_codes), totals.tolist(), counts.tolist()):
+            key = tuple(key_of(code) for key_of, code in zip(key_functions, group))
+            known_total, known_count = result.get(key, (0, 0))
+            result[key] = (known_total + total, known_count + count)
+        return {key: result[key] for key in sorted(result)}
+
+    def row(self, pos: int) -> dict:
+        """
+        One row with its texts, e.g. to show a selection.
+
+        Args:
+            pos (int): the position of the row
+
+        Returns:
+            dict: id, dates, amount in cents, tr_type, category and the details
+        """
+        category_code = self.category_codes[pos]
+        return {
+            "id": self.ids[pos],
+            "booking_date": date.fromordinal(self.booking_days[pos]),
+            "value_date": date.fromordinal(self.value_days[pos]),
+            "amount_cents": self.amount_cents[pos],
+            "tr_type": TR_TYPES[self.tr_types[pos]],
+            "category": None if category_code == NO_VALUE else self.categories[category_code],
+            **{label: self.values.get(codes[pos]) for label, codes in self.details.items()},
+        }
+
+
+@app.command()
+def store_summary(
+    by: List[str] = typer.Option(["month", "tr_type"], help="group columns, can be given several times"),
+    date_from: Optional[datetime] = typer.Option(None, formats=["%Y-%m-%d"]),
+    date_to: Optional[datetime] = typer.Option(None, formats=["%Y-%m-%d"]),
+    tr_type: Optional[str] = typer.Option(None, help="debit or credit"),
+    columns: Optional[List[str]] = typer.Option(None, help="detail labels to load, can be given several times"),
+):
+    """
+    Loads the transactions into the in-memory store and prints its size and the totals per group.
+    """
+    from db import engine
+
+    start = time.perf_counter()
+    store = transactionStore.load(engine, columns=columns or None)
+    print(
+        f"loaded {len(store)} transactions in {time.perf_counter() - start:.2f}s, "
+        f"{store.nbytes() / 1024 / 1024:.1f} MB"
+    )
+    rows = store.filter(
+        date_from=date_from.date() if date_from else None,
+        date_to=date_to.date() if date_to else None,
+        tr_type=tr_type,
+    )
+    for key, (cents, count) in store.group_sum(by, rows=rows).items():
+        print(f"{' '.join(key)}: {cents / 100:.2f} ({count})")
+
+
+if __name__ == "__main__":
+    app()